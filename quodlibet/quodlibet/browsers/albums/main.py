@@ -12,11 +12,12 @@ from __future__ import absolute_import
 
 import os
 
-from gi.repository import Gtk, Pango, Gdk, GLib, Gio
+from gi.repository import Gtk, Pango, Gdk, GLib
 
 from quodlibet.util.i18n import numeric_phrase
 from .prefs import Preferences, DEFAULT_PATTERN_TEXT
 from .models import AlbumModel, AlbumFilterModel, AlbumSortModel, AlbumItem
+from .models import CoverLoader
 
 import quodlibet
 from quodlibet import app
@@ -273,6 +274,13 @@ class VisibleUpdate(object):
 
         raise NotImplementedError
 
+    def _visible_rows(self, model, iters):
+        """Gets called with all rows in and around the visible area,
+        starting in the middle.
+        """
+
+        pass
+
     def __stop_update(self, adj, view):
         if self.__pending_paths:
             copool.remove(self.__scan_paths)
@@ -335,15 +343,19 @@ class VisibleUpdate(object):
 
         vlist_new = map(Gtk.TreePath, vlist_new)
 
+        visible_iters = []
         visible_paths = []
         for path in vlist_new:
             try:
                 iter_ = model.get_iter(path)
             except ValueError:
                 continue
+            visible_iters.append(iter_)
             if self._row_needs_update(model, iter_):
                 visible_paths.append((model, path))
 
+        self._visible_rows(model, visible_iters)
+
         if not self.__pending_paths and visible_paths:
             copool.add(self.__scan_paths)
         self.__pending_paths = visible_paths
@@ -416,7 +428,7 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
         if self.__model is None:
             self._init_model(library)
 
-        self._cover_cancel = Gio.Cancellable.new()
+        self._cover_loader = CoverLoader()
 
         sw = ScrolledWindow()
         sw.set_shadow_type(Gtk.ShadowType.IN)
@@ -573,10 +585,14 @@ class AlbumList(Browser, util.InstanceTracker, VisibleUpdate,
         scale_factor = self.get_scale_factor()
         item.scan_cover(scale_factor=scale_factor,
                         callback=callback,
-                        cancel=self._cover_cancel)
+                        loader=self._cover_loader)
+
+    def _visible_rows(self, model, iters):
+        self._cover_loader.set_visible(
+            [model.get_value(iter_) for iter_ in iters])
 
     def __destroy(self, browser):
-        self._cover_cancel.cancel()
+        self._cover_loader.cancel_all()
         self.disable_row_update()
 
         self.view.set_model(None)
@@ -5,6 +5,10 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation
 
+from collections import OrderedDict
+
+from gi.repository import Gio
+
 from quodlibet import app
 from quodlibet import config
 from quodlibet.qltk.models import ObjectStore, ObjectModelFilter
@@ -28,7 +32,7 @@ class AlbumItem(object):
         return size
 
     def scan_cover(self, force=False, scale_factor=1,
-            callback=None, cancel=None):
+            callback=None, cancel=None, loader=None):
         if (self.scanned and not force) or not self.album or \
                 not self.album.songs:
             return
@@ -39,13 +43,106 @@ class AlbumItem(object):
             callback()
 
         s = self.COVER_SIZE * scale_factor
-        app.cover_manager.get_pixbuf_many_async(
-            self.album.songs, s, s, cancel, set_cover_cb)
+        if loader is not None:
+            loader.request(self, s, set_cover_cb)
+        else:
+            app.cover_manager.get_pixbuf_many_async(
+                self.album.songs, s, s, cancel, set_cover_cb)
 
     def __repr__(self):
         return repr(self.album)
 
 
+class CoverLoader(object):
+    """Loads the covers of album items, a few at a time.
+
+    Requests for the same item get merged while waiting and the most
+    visible items get loaded first. Requests for items which are no longer
+    visible get cancelled and the items marked as not scanned, so they get
+    requested again once they are visible.
+    """
+
+    MAX_LOADING = 4
+    """Number of covers to load at the same time"""
+
+    def __init__(self):
+        # item -> (size, [callbacks]), in request order
+        self._pending = OrderedDict()
+        # item -> (size, [callbacks], cancellable)
+        self._loading = {}
+        # item -> rank, lower ones get loaded first
+        self._ranks = {}
+
+    def __len__(self):
+        return len(self._pending) + len(self._loading)
+
+    def request(self, item, size, callback):
+        """Load the cover of the item with the given size. `callback` gets
+        called with the pixbuf, or None if loading failed, and not at all
+        if there is no cover.
+        """
+
+        entry = self._pending.get(item)
+        if entry is not None and entry[0] == size:
+            entry[1].append(callback)
+            return
+
+        # a new request while loading means the item has changed
+        self._cancel(item)
+        self._pending[item] = (size, [callback])
+        self._dispatch()
+
+    def set_visible(self, items):
+        """Takes a list of the visible items, most important first, and
+        cancels all requests for other items.
+        """
+
+        self._ranks = dict((item, i) for i, item in enumerate(items))
+        for item in list(self._pending) + list(self._loading):
+            if item not in self._ranks:
+                self._cancel(item)
+                item.scanned = False
+        self._dispatch()
+
+    def cancel_all(self):
+        for item in list(self._pending) + list(self._loading):
+            self._cancel(item)
+        self._ranks.clear()
+
+    def _cancel(self, item):
+        self._pending.pop(item, None)
+        entry = self._loading.pop(item, None)
+        if entry is not None:
+            entry[2].cancel()
+
+    def _dispatch(self):
+        pending = self._pending
+        ranks = self._ranks
+        count = len(ranks)
+
+        while pending and len(self._loading) < self.MAX_LOADING:
+            # items outside of the visible range go last, in request order
+            item = min(pending, key=lambda i: ranks.get(i, count))
+            size, callbacks = pending.pop(item)
+            if item.album is None:
+                continue
+            cancel = Gio.Cancellable.new()
+            self._loading[item] = (size, callbacks, cancel)
+
+            def done_cb(pixbuf, item=item, cancel=cancel):
+                entry = self._loading.get(item)
+                if entry is None or entry[2] is not cancel:
+                    return
+                del self._loading[item]
+                for callback in entry[1]:
+                    callback(pixbuf)
+                self._dispatch()
+
+            if not app.cover_manager.get_pixbuf_many_async(
+                    item.album.songs, size, size, cancel, done_cb):
+                del self._loading[item]
+
+
 class AlbumModelMixin(object):
 
     def get_items(self, paths):
@@ -12,11 +12,11 @@ from __future__ import absolute_import
 
 import os
 
-from gi.repository import Gtk, Pango, Gdk, Gio
+from gi.repository import Gtk, Pango, Gdk
 
 from .prefs import Preferences, DEFAULT_PATTERN_TEXT
 from quodlibet.browsers.albums.models import (AlbumModel,
-    AlbumFilterModel, AlbumSortModel)
+    AlbumFilterModel, AlbumSortModel, CoverLoader)
 from quodlibet.browsers.albums.main import (get_cover_size,
     AlbumTagCompletion, PreferencesButton, VisibleUpdate)
 
@@ -215,7 +215,7 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
         if self.__model is None:
             self._init_model(library)
 
-        self._cover_cancel = Gio.Cancellable.new()
+        self._cover_loader = CoverLoader()
 
         self.scrollwin = sw = ScrolledWindow()
         sw.set_shadow_type(Gtk.ShadowType.IN)
@@ -383,10 +383,14 @@ class CoverGrid(Browser, util.InstanceTracker, VisibleUpdate,
         scale_factor = self.get_scale_factor() * mag
         item.scan_cover(scale_factor=scale_factor,
                         callback=callback,
-                        cancel=self._cover_cancel)
+                        loader=self._cover_loader)
+
+    def _visible_rows(self, model, iters):
+        self._cover_loader.set_visible(
+            [model.get_value(iter_) for iter_ in iters])
 
     def __destroy(self, browser):
-        self._cover_cancel.cancel()
+        self._cover_loader.cancel_all()
         self.disable_row_update()
 
         self.view.set_model(None)
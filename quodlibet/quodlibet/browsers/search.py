@@ -107,7 +107,7 @@ class SearchBar(Browser):
         except Query.error:
             pass
         else:
-            return self._query.filter(self._library)
+            return self._library.filter_query(self._query)
 
     def activate(self):
         songs = self._get_songs()
@@ -33,6 +33,8 @@ if PY2:
     izip_longest, izip
     import Queue as queue
     queue
+    import sre_parse
+    sre_parse
 
     xrange = xrange
     long = long
@@ -105,6 +107,12 @@ elif PY3:
     import codecs
     import queue
     queue
+    try:
+        # sre_parse is deprecated since Python 3.11
+        from re import _parser as sre_parse
+    except ImportError:
+        import sre_parse
+    sre_parse
 
     xrange = range
     long = int
@@ -51,6 +51,19 @@ INITIAL = {
     "library": {
         "exclude": "",
         "refresh_on_start": "true",
+        # keep an index of tag values to speed up searching large libraries
+        "search_index": "false",
+        # number of threads for reading tags of new files while scanning,
+        # 0 reads them in the main loop
+        "scan_threads": "0",
+        # only check files in directories which changed since the last
+        # refresh, misses files modified in place
+        "skip_unchanged_dirs": "false",
+        # apply changes to files in the scan directories while running
+        "watch": "false",
+        # only read the song keys on start and load the songs themselves
+        # when needed or in the background
+        "lazy_load": "false",
     },
     # State about the player, to restore on startup
     "memory": {
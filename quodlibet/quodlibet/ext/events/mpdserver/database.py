@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+
+"""Indexes of the library for answering MPD database queries"""
+
+from senf import fsn2text
+
+from quodlibet.compat import iteritems, text_type
+
+
+def get_uri(song):
+    """The MPD URI of a song, its path without the leading slash"""
+
+    return fsn2text(song("~filename")).lstrip(u"/")
+
+
+def get_values(song, key):
+    """A list of all values of a tag as text"""
+
+    return [v if isinstance(v, text_type) else fsn2text(v)
+            for v in song.list(key)]
+
+
+def _get_dir_uri(uri):
+    return uri.rsplit(u"/", 1)[0] if u"/" in uri else u""
+
+
+class MPDDatabase(object):
+    """Keeps indexes of tag values and directories of all songs in the
+    library.
+
+    The indexes get built the first time they are needed and then kept
+    up to date through the library signals.
+    """
+
+    def __init__(self, library):
+        self._library = library
+        # tag -> {value: set of songs}
+        self._tags = {}
+        # tag -> {song: values it is indexed under}
+        self._song_values = {}
+        # directory URI -> (set of sub directory URIs, set of songs)
+        self._dirs = None
+        # URI -> song
+        self._uris = None
+        # song -> length it is counted with in the sum of all lengths
+        self._lengths = None
+        self._playtime = 0
+        self._sigs = [
+            library.connect('added', self.__added),
+            library.connect('removed', self.__removed),
+            library.connect('changed', self.__changed),
+        ]
+
+    def destroy(self):
+        for sig in self._sigs:
+            self._library.disconnect(sig)
+        self._sigs = []
+        self._tags.clear()
+        self._song_values.clear()
+        self._dirs = self._uris = self._lengths = None
+        self._playtime = 0
+
+    def __len__(self):
+        return len(self._library)
+
+    @property
+    def playtime(self):
+        """The length of all songs in seconds"""
+
+        if self._lengths is None:
+            self._lengths = {}
+            self._playtime = 0
+            self._add_lengths(self._library.values())
+        return int(self._playtime)
+
+    def songs(self):
+        """A set of all songs"""
+
+        return set(self._library.values())
+
+    def _get_tag(self, key):
+        try:
+            return self._tags[key]
+        except KeyError:
+            index = self._tags[key] = {}
+            self._song_values[key] = {}
+            self._add_tag(key, self._library.values())
+            return index
+
+    def _add_tag(self, key, songs):
+        index = self._tags[key]
+        song_values = self._song_values[key]
+        for song in songs:
+            values = get_values(song, key)
+            song_values[song] = values
+            for value in values:
+                try:
+                    index[value].add(song)
+                except KeyError:
+                    index[value] = {song}
+
+    def _remove_tag(self, key, songs):
+        # the old values, the songs might have changed already
+        index = self._tags[key]
+        song_values = self._song_values[key]
+        for song in songs:
+            for value in song_values.pop(song, ()):
+                entry = index.get(value)
+                if entry is None:
+                    continue
+                entry.discard(song)
+                if not entry:
+                    del index[value]
+
+    def _add_lengths(self, songs):
+        lengths = self._lengths
+        for song in songs:
+            length = song("~#length", 0)
+            lengths[song] = length
+            self._playtime += length
+
+    def _remove_lengths(self, songs):
+        # the old lengths, the songs might have changed already
+        pop = self._lengths.pop
+        for song in songs:
+            self._playtime -= pop(song, 0)
+
+    def _get_dirs(self):
+        if self._dirs is None:
+            self._dirs = {u"": (set(), set())}
+            self._uris = {}
+            self._add_dirs(self._library.values())
+        return self._dirs
+
+    def _add_dirs(self, songs):
+        dirs = self._dirs
+        uris = self._uris
+        for song in songs:
+            uri = get_uri(song)
+            uris[uri] = song
+            dir_uri = _get_dir_uri(uri)
+            entry = dirs.get(dir_uri)
+            if entry is None:
+                entry = dirs[dir_uri] = (set(), set())
+                # register all parents which aren't known yet
+                child = dir_uri
+                while child:
+                    parent = _get_dir_uri(child)
+                    if parent in dirs:
+                        dirs[parent][0].add(child)
+                        break
+                    dirs[parent] = ({child}, set())
+                    child = parent
+            entry[1].add(song)
+
+    def _remove_dirs(self, songs):
+        dirs = self._dirs
+        uris = self._uris
+        for song in songs:
+            uri = get_uri(song)
+            if uris.get(uri) is not song:
+                # removed before or the path changed, look it up
+                for uri, other in iteritems(uris):
+                    if other is song:
+                        break
+                else:
+                    continue
+            del uris[uri]
+
+            dir_uri = _get_dir_uri(uri)
+            dirs[dir_uri][1].discard(song)
+            # remove empty directories
+            while dir_uri and dirs[dir_uri] == (set(), set()):
+                del dirs[dir_uri]
+                parent = _get_dir_uri(dir_uri)
+                dirs[parent][0].discard(dir_uri)
+                dir_uri = parent
+
+    def __added(self, library, songs):
+        if self._lengths is not None:
+            self._add_lengths(songs)
+        for key in self._tags:
+            self._add_tag(key, songs)
+        if self._dirs is not None:
+            self._add_dirs(songs)
+
+    def __removed(self, library, songs):
+        if self._lengths is not None:
+            self._remove_lengths(songs)
+        for key in self._tags:
+            self._remove_tag(key, songs)
+        if self._dirs is not None:
+            self._remove_dirs(songs)
+
+    def __changed(self, library, songs):
+        if self._lengths is not None:
+            self._remove_lengths(songs)
+            self._add_lengths(songs)
+        for key in self._tags:
+            self._remove_tag(key, songs)
+            self._add_tag(key, songs)
+        if self._dirs is not None:
+            self._remove_dirs(songs)
+            self._add_dirs(songs)
+
+    def values(self, key):
+        """Returns a list of all values of a tag"""
+
+        return list(self._get_tag(key).keys())
+
+    def find(self, keys, value):
+        """Returns a set of songs where one of the tags has the value"""
+
+        result = set()
+        for key in keys:
+            result.update(self._get_tag(key).get(value, ()))
+        return result
+
+    def search(self, keys, text):
+        """Returns a set of songs where one of the tags contains the text,
+        ignoring case
+        """
+
+        text = text.lower()
+        result = set()
+        for key in keys:
+            for value, songs in iteritems(self._get_tag(key)):
+                if text in value.lower():
+                    result.update(songs)
+        return result
+
+    def find_uri(self, uri, exact=True):
+        """Returns a set of songs with the URI, or containing it ignoring
+        case if not exact
+        """
+
+        self._get_dirs()
+        uris = self._uris
+        if exact:
+            song = uris.get(uri.lstrip(u"/"))
+            return set() if song is None else {song}
+
+        text = uri.lower()
+        return {s for u, s in iteritems(uris) if text in u.lower()}
+
+    def lsinfo(self, uri):
+        """Returns a tuple of sorted sub directory URIs and songs sorted by
+        URI for a directory or None if it doesn't exist
+        """
+
+        entry = self._get_dirs().get(uri.strip(u"/"))
+        if entry is None:
+            return None
+        dirs, songs = entry
+        return sorted(dirs), sorted(songs, key=get_uri)
+
+    def iter_below(self, uri):
+        """Returns an iterator of (directory URI, None) and (None, song)
+        tuples for everything below a directory recursively, or raises
+        KeyError if it doesn't exist
+        """
+
+        dirs = self._get_dirs()
+        root = uri.strip(u"/")
+        if root not in dirs:
+            raise KeyError(uri)
+        return self.__iter_below(root)
+
+    def __iter_below(self, root):
+        dirs = self._dirs
+        stack = [root]
+        while stack:
+            dir_uri = stack.pop()
+            if dir_uri not in dirs:
+                # removed in the meantime
+                continue
+            if dir_uri != root:
+                yield dir_uri, None
+            sub_dirs, songs = dirs[dir_uri]
+            for song in sorted(songs, key=get_uri):
+                yield None, song
+            stack.extend(sorted(sub_dirs, reverse=True))
+
+    def songs_below(self, uri):
+        """Returns a set of all songs below a directory"""
+
+        try:
+            return {s for d, s in self.iter_below(uri) if s is not None}
+        except KeyError:
+            return set()
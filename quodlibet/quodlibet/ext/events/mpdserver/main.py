@@ -7,13 +7,15 @@
 
 import re
 import shlex
+from collections import deque
 
 from senf import bytes2fsn, fsn2bytes
 
 from quodlibet import const
-from quodlibet.util import print_d, print_w
+from quodlibet.util import copool, print_d, print_w
 from quodlibet.compat import text_type, iteritems
 from .tcpserver import BaseTCPServer, BaseTCPConnection
+from .database import MPDDatabase, get_uri, get_values
 
 
 class AckError(object):
@@ -79,6 +81,24 @@ def format_tags(song):
     return u"\n".join(lines)
 
 
+def format_song(song):
+    """Gives the file, tags and time lines for a song"""
+
+    lines = [u"file: %s" % get_uri(song)]
+    tags = format_tags(song)
+    if tags:
+        lines.append(tags)
+    lines.append(u"Time: %d" % int(song("~#length", 0)))
+    return u"\n".join(lines)
+
+
+# lowercase MPD tag type -> ql key
+TAG_TYPES = dict((mpd_key.lower(), ql_key) for mpd_key, ql_key in TAG_MAPPING)
+
+# lowercase MPD tag type -> MPD tag type
+TAG_NAMES = dict((mpd_key.lower(), mpd_key) for mpd_key, ql_key in TAG_MAPPING)
+
+
 class ParseError(Exception):
     pass
 
@@ -136,6 +156,11 @@ class MPDService(object):
 
         self._config = config
         self._options = app.player_options
+        self._db = MPDDatabase(app.library)
+
+        # responses which only change together with an idle event
+        self._status = None
+        self._currentsong = None
 
         if not self._config.config_get("password"):
             self.default_permission = Permissions.PERMISSION_ALL
@@ -174,6 +199,14 @@ class MPDService(object):
         id_ = app.player.connect("song-started", playlist_changed)
         self._player_sigs.append(id_)
 
+        def library_changed(library, songs):
+            player = app.player
+            if player.info in songs or player.song in songs:
+                self._status = None
+                self._currentsong = None
+
+        self._library_sig = app.library.connect("changed", library_changed)
+
     def _get_id(self, info):
         # XXX: we need a unique 31 bit ID, but don't have one.
         # Given that the heap is continuous and each object is >16 bytes
@@ -183,6 +216,9 @@ class MPDService(object):
     def destroy(self):
         for id_ in self._player_sigs:
             self._app.player.disconnect(id_)
+        self._app.library.disconnect(self._library_sig)
+        self._db.destroy()
+        del self._db
         del self._options
         del self._app
 
@@ -226,6 +262,8 @@ class MPDService(object):
         self._idle_subscriptions.pop(connection, None)
 
     def emit_changed(self, subsystem):
+        self._status = None
+        self._currentsong = None
         for conn, subs in iteritems(self._idle_queue):
             subs.add(subsystem)
         self.flush_idle()
@@ -286,14 +324,14 @@ class MPDService(object):
         self._options.single = value
 
     def stats(self):
-        has_song = int(bool(self._app.player.info))
+        db = self._db
         stats = [
-            ("artists", has_song),
-            ("albums", has_song),
-            ("songs", has_song),
+            ("artists", len(db.values("artist"))),
+            ("albums", len(db.values("album"))),
+            ("songs", len(db)),
             ("uptime", 1),
             ("playtime", 1),
-            ("db_playtime", 1),
+            ("db_playtime", db.playtime),
             ("db_update", 1252868674),
         ]
 
@@ -303,6 +341,31 @@ class MPDService(object):
         app = self._app
         info = app.player.info
 
+        if self._status is None:
+            self._status = self._get_status()
+        status, state = self._status
+        status = list(status)
+
+        if info and state != "stop":
+            total_time = int(info("~#length"))
+            elapsed_time = int(app.player.get_position() / 1000)
+            elapsed_exact = "%1.3f" % (app.player.get_position() / 1000.0)
+            status.extend([
+                ("time", "%d:%d" % (elapsed_time, total_time)),
+                ("elapsed", elapsed_exact),
+                ("bitrate", info("~#bitrate")),
+            ])
+
+        return status
+
+    def _get_status(self):
+        """Returns the status entries which only change together with
+        an idle event and the playback state
+        """
+
+        app = self._app
+        info = app.player.info
+
         if info:
             if app.player.paused:
                 state = "pause"
@@ -324,32 +387,25 @@ class MPDService(object):
         ]
 
         if info:
-            total_time = int(info("~#length"))
-            elapsed_time = int(app.player.get_position() / 1000)
-            elapsed_exact = "%1.3f" % (app.player.get_position() / 1000.0)
             status.extend([
                 ("song", 0),
                 ("songid", self._get_id(info)),
             ])
 
-            if state != "stop":
-                status.extend([
-                    ("time", "%d:%d" % (elapsed_time, total_time)),
-                    ("elapsed", elapsed_exact),
-                    ("bitrate", info("~#bitrate")),
-                ])
-
-        return status
+        return status, state
 
     def currentsong(self):
+        if self._currentsong is None:
+            self._currentsong = (self._get_currentsong(),)
+        return self._currentsong[0]
+
+    def _get_currentsong(self):
         info = self._app.player.info
         if info is None:
             return None
 
         parts = []
-        parts.append(u"file: %s" % info("~filename"))
-        parts.append(format_tags(info))
-        parts.append(u"Time: %d" % int(info("~#length")))
+        parts.append(format_song(info))
         parts.append(u"Pos: %d" % 0)
         parts.append(u"Id: %d" % self._get_id(info))
 
@@ -372,11 +428,87 @@ class MPDService(object):
         info = self._app.player.info
         if version != self._pl_ver and info:
             parts = []
-            parts.append(u"file: %s" % info("~filename"))
+            parts.append(u"file: %s" % get_uri(info))
             parts.append(u"Pos: %d" % 0)
             parts.append(u"Id: %d" % self._get_id(info))
             return u"\n".join(parts)
 
+    def find(self, filters, exact=True):
+        """Returns a list of songs sorted by URI matching all filters.
+
+        filters is a list of (tag type, value) tuples, where the tag type
+        is a lowercase MPD tag type or one of "any", "file" and "base".
+        If not exact, the values only have to be contained ignoring case.
+        """
+
+        db = self._db
+        result = None
+        for tag, value in filters:
+            if tag == u"file":
+                songs = db.find_uri(value, exact)
+            elif tag == u"base":
+                songs = db.songs_below(value)
+            else:
+                if tag == u"any":
+                    keys = set(TAG_TYPES.values())
+                else:
+                    keys = [TAG_TYPES[tag]]
+                if exact:
+                    songs = db.find(keys, value)
+                else:
+                    songs = db.search(keys, value)
+                if tag == u"any":
+                    songs |= db.find_uri(value, exact)
+
+            if result is None:
+                result = songs
+            else:
+                result &= songs
+            if not result:
+                return []
+
+        if result is None:
+            result = db.songs()
+        return sorted(result, key=get_uri)
+
+    def count(self, filters):
+        """Returns the number of songs and their length in seconds"""
+
+        songs = self.find(filters)
+        return len(songs), int(sum(s("~#length", 0) for s in songs))
+
+    def list(self, tag, filters):
+        """Returns a sorted list of all values of a tag type for songs
+        matching the filters.
+        """
+
+        if tag == u"file":
+            return [get_uri(s) for s in self.find(filters)]
+
+        key = TAG_TYPES[tag]
+        if not filters:
+            return sorted(self._db.values(key))
+
+        values = set()
+        for song in self.find(filters):
+            values.update(get_values(song, key))
+        return sorted(values)
+
+    def lsinfo(self, uri):
+        """Returns a tuple of directory URIs and songs in a directory or
+        None if it doesn't exist.
+        """
+
+        return self._db.lsinfo(uri)
+
+    def listall(self, uri):
+        """Returns an iterator of (directory URI, None) or (None, song)
+        tuples for everything below a directory. Raises KeyError if it
+        doesn't exist.
+        """
+
+        return self._db.iter_below(uri)
+
 
 class MPDServer(BaseTCPServer):
 
@@ -418,8 +550,14 @@ class MPDConnection(BaseTCPConnection):
         str_version = u".".join(map(text_type, service.version))
         self._buf = bytearray((u"OK MPD %s\n" % str_version).encode("utf-8"))
         self._read_buf = bytearray()
+        # complete lines not handled yet
+        self._lines = deque()
 
         # begin - command processing state
+        # a command which writes its response in steps
+        self._routine = None
+        # if it waits for the client to read the response so far
+        self._paused = False
         self._use_command_list = False
         # everything below is only valid if _use_command_list is True
         self._command_list_ok = False
@@ -434,26 +572,7 @@ class MPDConnection(BaseTCPConnection):
 
     def handle_read(self, data):
         self._feed_data(data)
-
-        while 1:
-            line = self._get_next_line()
-            if line is None:
-                break
-
-            self.log(u"-> " + repr(line))
-
-            try:
-                cmd, args = parse_command(line)
-            except ParseError:
-                # TODO: not sure what to do here re command lists
-                continue
-
-            try:
-                self._handle_command(cmd, args)
-            except MPDRequestError as e:
-                self._error(e.msg, e.code, e.index)
-                self._use_command_list = False
-                del self._command_list[:]
+        self.__process()
 
     def handle_write(self):
         data = self._buf[:]
@@ -463,8 +582,19 @@ class MPDConnection(BaseTCPConnection):
     def can_write(self):
         return bool(self._buf)
 
+    def handle_drained(self):
+        if self._paused:
+            self._paused = False
+            copool.resume(self)
+        else:
+            self.__process()
+
     def handle_close(self):
         self.log("connection closed")
+        if self._paused:
+            copool.remove(self)
+            self._paused = False
+        self._routine = None
         self.service.remove_connection(self)
         del self.service
 
@@ -484,25 +614,31 @@ class MPDConnection(BaseTCPConnection):
     def _feed_data(self, new_data):
         """Feed new data into the read buffer"""
 
-        self._read_buf.extend(new_data)
+        read_buf = self._read_buf
+        read_buf.extend(new_data)
+        if b"\n" not in new_data:
+            return
+
+        # split all pipelined commands at once
+        lines = read_buf.split(b"\n")
+        del read_buf[:]
+        read_buf.extend(lines.pop())
+        self._lines.extend(bytes(l) for l in lines)
 
     def _get_next_line(self):
         """Returns the next line from the read buffer or None"""
 
         try:
-            index = self._read_buf.index(b"\n")
-        except ValueError:
+            return self._lines.popleft()
+        except IndexError:
             return None
 
-        line = bytes(self._read_buf[:index])
-        del self._read_buf[:index + 1]
-        return line
-
     def write_line(self, line):
         """Writes a line to the client"""
 
         assert isinstance(line, text_type)
-        self.log(u"<- " + repr(line))
+        if const.DEBUG:
+            self.log(u"<- " + repr(line))
 
         self._buf.extend(line.encode("utf-8", errors="replace") + b"\n")
 
@@ -520,7 +656,69 @@ class MPDConnection(BaseTCPConnection):
             error.append(u" %s" % msg)
         self.write_line(u"".join(error))
 
+    def __process(self):
+        # while a response is being streamed, new commands have to wait
+        if self._routine is None:
+            self._routine = self._process_commands()
+            if self._routine is not None:
+                copool.add(self.__resume, funcid=self)
+
+    def _process_commands(self):
+        """Handles buffered commands until one of them takes longer or the
+        client doesn't keep up with reading the responses.
+
+        Returns the unfinished command or None.
+        """
+
+        while not self._closed and not self.congested:
+            line = self._get_next_line()
+            if line is None:
+                break
+
+            if const.DEBUG:
+                self.log(u"-> " + repr(line))
+
+            try:
+                cmd, args = parse_command(line)
+            except ParseError:
+                # TODO: not sure what to do here re command lists
+                continue
+
+            routine = self.__run_command(cmd, args)
+            for step in routine:
+                return routine
+
+    def __run_command(self, command, args):
+        try:
+            for step in self._handle_command(command, args):
+                yield
+        except MPDRequestError as e:
+            self._error(e.msg, e.code, e.index)
+            self._use_command_list = False
+            del self._command_list[:]
+
+    def __resume(self):
+        while self._routine is not None:
+            if self.congested:
+                # wait for handle_drained()
+                self._paused = True
+                copool.pause(self)
+                yield True
+                continue
+
+            try:
+                next(self._routine)
+            except StopIteration:
+                # continue with the commands received in the meantime
+                self._routine = self._process_commands()
+            if self._closed:
+                break
+            self.start_write()
+            yield True
+
     def _handle_command(self, command, args):
+        """Handles a command and yields if it takes longer"""
+
         self._command = command
 
         if command == u"command_list_end":
@@ -530,7 +728,8 @@ class MPDConnection(BaseTCPConnection):
 
             for i, (cmd, args) in enumerate(self._command_list):
                 try:
-                    self._exec_command(cmd, args)
+                    for step in self._exec_command(cmd, args):
+                        yield
                 except MPDRequestError as e:
                     # reraise with index
                     raise MPDRequestError(e.msg, e.code, i)
@@ -552,9 +751,16 @@ class MPDConnection(BaseTCPConnection):
         if self._use_command_list:
             self._command_list.append((command, args))
         else:
-            self._exec_command(command, args)
+            for step in self._exec_command(command, args):
+                yield
 
     def _exec_command(self, command, args, no_ack=False):
+        """Executes a command and yields if it takes longer.
+
+        Commands can return an iterator to write their response in steps,
+        which gets exhausted before the next command is handled.
+        """
+
         self._command = command
 
         if command not in self._commands:
@@ -573,7 +779,10 @@ class MPDConnection(BaseTCPConnection):
             raise MPDRequestError("Insufficient permission",
                     AckError.PERMISSION)
 
-        cmd(self, self.service, args)
+        steps = cmd(self, self.service, args)
+        if steps is not None:
+            for step in steps:
+                yield
 
         if self._use_command_list:
             if self._command_list_ok:
@@ -637,6 +846,49 @@ def _parse_range(arg):
         raise MPDRequestError("invalid range")
 
 
+def _parse_tag(arg):
+    tag = arg.lower()
+    if tag not in TAG_TYPES and tag != u"file":
+        raise MPDRequestError("Unknown tag type", AckError.ARG)
+    return tag
+
+
+def _parse_filters(args):
+    if not args or len(args) % 2:
+        raise MPDRequestError("Incorrect arguments", AckError.ARG)
+
+    filters = []
+    for tag, value in zip(args[::2], args[1::2]):
+        tag = tag.lower()
+        if tag not in TAG_TYPES and tag not in (u"any", u"file", u"base"):
+            raise MPDRequestError("Unknown tag type", AckError.ARG)
+        filters.append((tag, value))
+    return filters
+
+
+# number of songs written before giving the main loop a chance to run
+_SONGS_PER_STEP = 200
+
+
+def _write_songs(conn, songs):
+    for i, song in enumerate(songs, 1):
+        conn.write_line(format_song(song))
+        if not i % _SONGS_PER_STEP:
+            yield
+
+
+def _write_tree(conn, items, info=True):
+    for i, (dir_uri, song) in enumerate(items, 1):
+        if dir_uri is not None:
+            conn.write_line(u"directory: %s" % dir_uri)
+        elif info:
+            conn.write_line(format_song(song))
+        else:
+            conn.write_line(u"file: %s" % get_uri(song))
+        if not i % _SONGS_PER_STEP:
+            yield
+
+
 @MPDConnection.Command("idle", ack=False)
 def _cmd_idle(conn, service, args):
     service.register_idle(conn, args)
@@ -676,7 +928,21 @@ def _cmd_listplaylists(conn, service, args):
 
 @MPDConnection.Command("list")
 def _cmd_list(conn, service, args):
-    pass
+    _verify_length(args, 1)
+    tag = _parse_tag(args[0])
+    if tag == u"album" and len(args) == 2:
+        # list album ARTIST
+        filters = [(u"artist", args[1])]
+    elif len(args) > 1:
+        filters = _parse_filters(args[1:])
+    else:
+        filters = []
+
+    name = TAG_NAMES.get(tag, u"file")
+    for i, value in enumerate(service.list(tag, filters), 1):
+        conn.write_line(u"%s: %s" % (name, value))
+        if not i % _SONGS_PER_STEP:
+            yield
 
 
 @MPDConnection.Command("playid")
@@ -761,8 +1027,21 @@ def _cmd_currentsong(conn, service, args):
 
 @MPDConnection.Command("count")
 def _cmd_count(conn, service, args):
-    conn.write_line(u"songs: 0")
-    conn.write_line(u"playtime: 0")
+    songs, playtime = service.count(_parse_filters(args))
+    conn.write_line(u"songs: %d" % songs)
+    conn.write_line(u"playtime: %d" % playtime)
+
+
+@MPDConnection.Command("find")
+def _cmd_find(conn, service, args):
+    songs = service.find(_parse_filters(args))
+    return _write_songs(conn, songs)
+
+
+@MPDConnection.Command("search")
+def _cmd_search(conn, service, args):
+    songs = service.find(_parse_filters(args), exact=False)
+    return _write_songs(conn, songs)
 
 
 @MPDConnection.Command("plchanges")
@@ -783,9 +1062,23 @@ def _cmd_plchangesposid(conn, service, args):
         conn.write_line(changes)
 
 
+def _listall(conn, service, args, info):
+    uri = args[0] if args else u""
+    try:
+        items = service.listall(uri)
+    except KeyError:
+        raise MPDRequestError("No such directory", AckError.NO_EXIST)
+    return _write_tree(conn, items, info)
+
+
+@MPDConnection.Command("listall")
+def _cmd_listall(conn, service, args):
+    return _listall(conn, service, args, False)
+
+
 @MPDConnection.Command("listallinfo")
-def _cmd_listallinfo(*args):
-    _cmd_currentsong(*args)
+def _cmd_listallinfo(conn, service, args):
+    return _listall(conn, service, args, True)
 
 
 @MPDConnection.Command("seek")
@@ -842,7 +1135,15 @@ def _cmd_tagtypes(conn, service, args):
 
 @MPDConnection.Command("lsinfo")
 def _cmd_lsinfo(conn, service, args):
-    _verify_length(args, 1)
+    uri = args[0] if args else u""
+    result = service.lsinfo(uri)
+    if result is None:
+        raise MPDRequestError("No such directory", AckError.NO_EXIST)
+
+    dirs, songs = result
+    for dir_uri in dirs:
+        conn.write_line(u"directory: %s" % dir_uri)
+    return _write_songs(conn, songs)
 
 
 @MPDConnection.Command("playlistinfo")
@@ -124,8 +124,18 @@ class BaseTCPConnection(object):
     """Abstract base class for TCP connections.
 
     Subclasses need to implement the handle_*() can_*() methods.
+
+    Once more than `WRITE_HIGH_WATER` bytes are waiting to be sent, the
+    connection is congested: no more data gets requested through
+    handle_write() and reading stops, so a client which doesn't read its
+    responses can't make us buffer ever more of them. Once the pending data
+    drops below `WRITE_LOW_WATER` bytes, handle_drained() gets called and
+    reading continues.
     """
 
+    WRITE_HIGH_WATER = 256 * 1024
+    WRITE_LOW_WATER = 64 * 1024
+
     def __init__(self, server, sock):
         self._server = server
         self._sock = sock
@@ -133,18 +143,32 @@ class BaseTCPConnection(object):
         self._in_id = None
         self._out_id = None
         self._closed = False
+        self._reading = False
+        self._congested = False
+        self._write_buf = bytearray()
 
     @property
     def name(self):
         return str(self._sock.fileno())
 
+    @property
+    def congested(self):
+        """If the client doesn't keep up with reading the sent data"""
+
+        return self._congested
+
     def start_read(self):
         """Start to read and call handle_read() if data is available.
 
         Only call once.
         """
 
-        assert self._in_id is None and not self._closed
+        assert not self._reading and not self._closed
+        self._reading = True
+        self._add_read_watch()
+
+    def _add_read_watch(self):
+        assert self._in_id is None
 
         def can_read_cb(sock, flags, *args):
             if flags & (GLib.IOCondition.HUP | GLib.IOCondition.ERR):
@@ -181,6 +205,20 @@ class BaseTCPConnection(object):
             GLib.IOCondition.IN | GLib.IOCondition.ERR | GLib.IOCondition.HUP,
             can_read_cb)
 
+    def _set_congested(self, congested):
+        if congested == self._congested:
+            return
+        self._congested = congested
+
+        if congested:
+            if self._in_id is not None:
+                GLib.source_remove(self._in_id)
+                self._in_id = None
+        else:
+            if self._reading:
+                self._add_read_watch()
+            self.handle_drained()
+
     def start_write(self):
         """Trigger at least one call to handle_write() if can_write is True.
 
@@ -189,7 +227,7 @@ class BaseTCPConnection(object):
 
         assert not self._closed
 
-        write_buffer = bytearray()
+        write_buffer = self._write_buf
 
         def can_write_cb(sock, flags, *args):
             if flags & (GLib.IOCondition.HUP | GLib.IOCondition.ERR):
@@ -197,7 +235,8 @@ class BaseTCPConnection(object):
                 return False
 
             if flags & GLib.IOCondition.OUT:
-                if self.can_write():
+                if len(write_buffer) < self.WRITE_HIGH_WATER and \
+                        self.can_write():
                     write_buffer.extend(self.handle_write())
                 if not write_buffer:
                     self._out_id = None
@@ -208,7 +247,8 @@ class BaseTCPConnection(object):
                         result = sock.send(write_buffer)
                     except (IOError, OSError) as e:
                         if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
-                            return True
+                            result = 0
+                            break
                         elif e.errno == errno.EINTR:
                             continue
                         else:
@@ -218,6 +258,15 @@ class BaseTCPConnection(object):
 
                 del write_buffer[:result]
 
+                pending = len(write_buffer)
+                if pending >= self.WRITE_HIGH_WATER:
+                    self._set_congested(True)
+                elif pending < self.WRITE_LOW_WATER:
+                    # handle_drained() could close
+                    self._set_congested(False)
+                    if self._closed:
+                        return False
+
             return True
 
         if self._out_id is None:
@@ -243,6 +292,7 @@ class BaseTCPConnection(object):
         if self._out_id is not None:
             GLib.source_remove(self._out_id)
             self._out_id = None
+        del self._write_buf[:]
 
         self.handle_close()
         self._server._remove_connection(self)
@@ -268,6 +318,11 @@ class BaseTCPConnection(object):
 
         raise NotImplementedError
 
+    def handle_drained(self):
+        """Called when a congested connection can take more data again"""
+
+        pass
+
     def handle_close(self):
         """Called last when the connection gets closed"""
 
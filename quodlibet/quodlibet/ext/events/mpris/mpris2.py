@@ -6,7 +6,6 @@
 # published by the Free Software Foundation.
 
 import time
-import tempfile
 
 import dbus
 import dbus.service
@@ -15,6 +14,7 @@ from senf import fsn2uri
 from quodlibet import app
 from quodlibet.util.dbusutils import DBusIntrospectable, DBusProperty
 from quodlibet.util.dbusutils import dbus_unicode_validate as unival
+from quodlibet.util.path import is_temp_path
 from quodlibet.compat import iteritems, listmap
 
 from .util import MPRISObject
@@ -242,7 +242,7 @@ value="false"/>
         is_temp = False
         if cover:
             name = cover.name
-            is_temp = name.startswith(tempfile.gettempdir())
+            is_temp = is_temp_path(name)
             # This doesn't work for embedded images.. the file gets unlinked
             # after loosing the file handle
             metadata["mpris:artUrl"] = fsn2uri(name)
@@ -7,9 +7,13 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation
 
+import os
+import struct
+
 from gi.repository import Gtk, Gdk, Gst
 import cairo
 from math import ceil, floor
+from senf import fsnative
 
 from quodlibet import _, app
 from quodlibet import print_w
@@ -22,16 +26,273 @@ from quodlibet.qltk.seekbutton import TimeLabel
 from quodlibet.qltk.tracker import TimeTracker
 from quodlibet.qltk import get_fg_highlight_color
 from quodlibet.util import connect_destroy, print_d
+from quodlibet.util.atomic import atomic_save
+from quodlibet.util.path import mkdir, get_cache_folder, \
+    get_file_cache_key
+
+
+def resample(values, points):
+    """Returns a list of `points` values, averaging neighbouring values
+    or repeating them.
+    """
+
+    count = len(values)
+    if count == points or not count:
+        return list(values)
+
+    result = []
+    for i in range(points):
+        u1 = i * count // points
+        u2 = max((i + 1) * count // points, u1 + 1)
+        result.append(sum(values[u1:u2]) / float(u2 - u1))
+    return result
+
+
+class WaveformCache(object):
+    """Stores RMS values of songs on disk.
+
+    Entries are keyed by the path, mtime and size of the file and the
+    number of data points they were computed for. The values are stored
+    as 16 bit integers after a small header. If there is no entry for the
+    requested number of points, the closest larger one (or the largest)
+    gets resampled. Only the last stored resolution of a song is kept and
+    once the cache grows past MAX_SIZE the least recently used entries
+    get removed.
+    """
+
+    MAGIC = b"QLWF"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBI")
+
+    MAX_SIZE = 20 * 1024 * 1024
+    """Maximum size of all entries in bytes"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        # total size of all entries, gets computed on the first put()
+        self._size = None
+
+    def _list_entries(self):
+        """Returns a list of (access time, size, path) for all entries"""
+
+        entries = []
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                atime = max(stat.st_atime, stat.st_mtime)
+                entries.append((atime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except EnvironmentError:
+            return
+        if self._size is not None:
+            self._size -= size
+
+    def prune(self):
+        """Removes the least recently used entries until the cache is
+        below 3/4 of MAX_SIZE, if it is larger than MAX_SIZE.
+        """
+
+        entries = self._list_entries()
+        self._size = sum(e[1] for e in entries)
+        if self._size <= self.MAX_SIZE:
+            return
+
+        limit = self.MAX_SIZE * 3 // 4
+        for atime, size, path in sorted(entries):
+            if self._size <= limit:
+                break
+            self._remove(path)
+
+    def _get_base(self, song):
+        """Returns (folder, name prefix) or None"""
+
+        filename = song("~filename")
+        if not filename or not song.is_file:
+            return None
+        digest = get_file_cache_key(filename)
+        if digest is None:
+            return None
+        return os.path.join(self.folder, digest[:2]), digest + "-"
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as h:
+                data = h.read()
+        except EnvironmentError:
+            return None
+
+        size = self.HEADER.size
+        try:
+            magic, version, count = self.HEADER.unpack(data[:size])
+            if magic != self.MAGIC or version != self.VERSION:
+                return None
+            ints = struct.unpack("<%dH" % count, data[size:])
+        except struct.error:
+            return None
+        return [i / 65535.0 for i in ints]
+
+    def get(self, song, points):
+        """Returns a list of `points` RMS values or None"""
+
+        base = self._get_base(song)
+        if base is None:
+            return None
+        folder, prefix = base
+
+        values = self._read(os.path.join(folder, prefix + str(points)))
+        if values is not None:
+            return values
+
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return None
+
+        resolutions = []
+        for name in names:
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                resolutions.append(int(name[len(prefix):]))
+        larger = [r for r in resolutions if r > points]
+        resolutions = [min(larger)] if larger else sorted(resolutions)[-1:]
+
+        for resolution in resolutions:
+            values = self._read(os.path.join(folder, prefix + str(resolution)))
+            if values is not None:
+                return resample(values, points)
+
+    def put(self, song, points, values):
+        """Stores the RMS values for `points` data points"""
+
+        base = self._get_base(song)
+        if base is None or not values:
+            return
+        folder, prefix = base
+
+        ints = [int(round(min(max(v, 0.0), 1.0) * 65535)) for v in values]
+        data = self.HEADER.pack(self.MAGIC, self.VERSION, len(ints)) + \
+            struct.pack("<%dH" % len(ints), *ints)
+        name = prefix + str(points)
+        path = os.path.join(folder, name)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        try:
+            mkdir(folder, 0o700)
+            with atomic_save(fsnative(path), "wb") as h:
+                h.write(data)
+        except EnvironmentError as e:
+            print_w("Couldn't save waveform: %s" % e)
+            return
+
+        # the other resolutions of the song aren't needed anymore
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            names = []
+        for other in names:
+            if other != name and other.startswith(prefix):
+                self._remove(os.path.join(folder, other))
+
+        if self._size is None:
+            self.prune()
+        else:
+            self._size += len(data) - old_size
+            if self._size > self.MAX_SIZE:
+                self.prune()
+
+
+class RMSPipeline(object):
+    """Decodes a song and collects RMS values for `points` data points.
+
+    `callback` gets called with the list of values, or None in case of an
+    error.
+    """
+
+    def __init__(self, song, points, callback):
+        self.song = song
+        self.points = points
+        self.callback = callback
+        self._pipeline = None
+        self._bus_id = None
+        self._rms_vals = []
+
+    def start(self):
+        command_template = """
+        filesrc name=fs
+        ! decodebin ! audioconvert
+        ! level name=audiolevel interval={} post-messages=true
+        ! fakesink sync=false"""
+        interval = int(self.song("~#length") * 1E9 / self.points)
+        print_d("Computing data for each %.3f seconds" % (interval / 1E9))
+
+        command = command_template.format(interval)
+        pipeline = Gst.parse_launch(command)
+        pipeline.get_by_name("fs").set_property(
+            "location", self.song("~filename"))
+
+        bus = pipeline.get_bus()
+        self._bus_id = bus.connect("message", self._on_bus_message)
+        bus.add_signal_watch()
+
+        pipeline.set_state(Gst.State.PLAYING)
+        self._pipeline = pipeline
+
+    def stop(self):
+        if self._pipeline:
+            self._pipeline.set_state(Gst.State.NULL)
+            if self._bus_id:
+                bus = self._pipeline.get_bus()
+                bus.remove_signal_watch()
+                bus.disconnect(self._bus_id)
+                self._bus_id = None
+            self._pipeline = None
+
+    def _on_bus_message(self, bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            error, debug = message.parse_error()
+            print_d("Error received from element {name}: {error}".format(
+                name=message.src.get_name(), error=error))
+            print_d("Debugging information: {}".format(debug))
+            self.stop()
+            self.callback(None)
+        elif message.type == Gst.MessageType.ELEMENT:
+            structure = message.get_structure()
+            if structure.get_name() == "level":
+                rms_db = structure.get_value("rms")
+                # Calculate average of all channels (usually 2)
+                rms_db_avg = sum(rms_db) / len(rms_db)
+                # Normalize dB value to value between 0 and 1
+                rms = pow(10, (rms_db_avg / 20))
+                self._rms_vals.append(rms)
+            else:
+                print_w("Got unexpected message of type {}"
+                        .format(message.type))
+        elif message.type == Gst.MessageType.EOS:
+            self.stop()
+            self.callback(self._rms_vals)
 
 
 class WaveformSeekBar(Gtk.Box):
     """A widget containing labels and the seekbar."""
 
+    PRECOMPUTE_COUNT = 3
+    """Number of queued songs to compute the waveform for in advance"""
+
     def __init__(self, player, library):
         super(WaveformSeekBar, self).__init__()
 
         self._player = player
         self._rms_vals = []
+        self._cache = WaveformCache(get_cache_folder("waveforms"))
+        self._pipeline = None
+        self._bg_pipeline = None
 
         self._elapsed_label = TimeLabel()
         self._remaining_label = TimeLabel()
@@ -70,67 +331,76 @@ class WaveformSeekBar(Gtk.Box):
         # Close any existing pipeline to avoid leaks
         self._clean_pipeline()
 
-        command_template = """
-        filesrc name=fs
-        ! decodebin ! audioconvert
-        ! level name=audiolevel interval={} post-messages=true
-        ! fakesink sync=false"""
-        interval = int(song("~#length") * 1E9 / points)
-        print_d("Computing data for each %.3f seconds" % (interval / 1E9))
+        rms_vals = self._cache.get(song, points)
+        if rms_vals is not None:
+            print_d("Using cached waveform for %s" % song("~filename"))
+            self._set_waveform(rms_vals)
+            self._precompute_queued()
+            return
 
-        command = command_template.format(interval)
-        pipeline = Gst.parse_launch(command)
-        pipeline.get_by_name("fs").set_property("location", song("~filename"))
+        pipeline = self._bg_pipeline
+        if pipeline and pipeline.song is song and pipeline.points == points:
+            # the next song was precomputed already, keep going
+            self._bg_pipeline = None
+        else:
+            self._clean_bg_pipeline()
+            pipeline = RMSPipeline(song, points, None)
+            pipeline.start()
+        pipeline.callback = self._on_waveform_done
+        self._pipeline = pipeline
 
-        bus = pipeline.get_bus()
-        self._bus_id = bus.connect("message", self._on_bus_message)
-        bus.add_signal_watch()
+    def _on_waveform_done(self, rms_vals):
+        pipeline = self._pipeline
+        self._pipeline = None
+        if rms_vals is None:
+            return
 
-        pipeline.set_state(Gst.State.PLAYING)
+        self._cache.put(pipeline.song, pipeline.points, rms_vals)
+        self._set_waveform(rms_vals)
+        self._precompute_queued()
 
-        self._pipeline = pipeline
-        self._new_rms_vals = []
+    def _set_waveform(self, rms_vals):
+        self._rms_vals = rms_vals
+        self._waveform_scale.reset(self._rms_vals)
+        self._waveform_scale.set_placeholder(False)
+        self._update_redraw_interval()
 
-    def _on_bus_message(self, bus, message):
-        if message.type == Gst.MessageType.ERROR:
-            error, debug = message.parse_error()
-            print_d("Error received from element {name}: {error}".format(
-                name=message.src.get_name(), error=error))
-            print_d("Debugging information: {}".format(debug))
-        elif message.type == Gst.MessageType.ELEMENT:
-            structure = message.get_structure()
-            if structure.get_name() == "level":
-                rms_db = structure.get_value("rms")
-                # Calculate average of all channels (usually 2)
-                rms_db_avg = sum(rms_db) / len(rms_db)
-                # Normalize dB value to value between 0 and 1
-                rms = pow(10, (rms_db_avg / 20))
-                self._new_rms_vals.append(rms)
-            else:
-                print_w("Got unexpected message of type {}"
-                        .format(message.type))
-        elif message.type == Gst.MessageType.EOS:
-            self._clean_pipeline()
+    def _precompute_queued(self):
+        """Computes the waveforms of the next few queued songs in the
+        background, one at a time.
+        """
 
-            # Update the waveform with the new data
-            self._rms_vals = self._new_rms_vals
-            self._waveform_scale.reset(self._rms_vals)
-            self._waveform_scale.set_placeholder(False)
-            self._update_redraw_interval()
+        if self._bg_pipeline or self._pipeline or app.window is None:
+            return
 
-            # Clear temporary reference to the waveform data
-            del self._new_rms_vals
+        points = CONFIG.max_data_points
+        queued = app.window.playlist.q.get()[:self.PRECOMPUTE_COUNT]
+        for song in queued:
+            if song.is_file and song("~#length") > 0 and \
+                    self._cache.get(song, points) is None:
+                break
+        else:
+            return
+
+        def done(rms_vals):
+            self._bg_pipeline = None
+            if rms_vals is not None:
+                self._cache.put(song, points, rms_vals)
+                self._precompute_queued()
+
+        print_d("Precomputing waveform for %s" % song("~filename"))
+        self._bg_pipeline = RMSPipeline(song, points, done)
+        self._bg_pipeline.start()
 
     def _clean_pipeline(self):
-        if hasattr(self, "_pipeline") and self._pipeline:
-            self._pipeline.set_state(Gst.State.NULL)
-            if self._bus_id:
-                bus = self._pipeline.get_bus()
-                bus.remove_signal_watch()
-                bus.disconnect(self._bus_id)
-                self._bus_id = None
-            if self._pipeline:
-                self._pipeline = None
+        if self._pipeline:
+            self._pipeline.stop()
+            self._pipeline = None
+
+    def _clean_bg_pipeline(self):
+        if self._bg_pipeline:
+            self._bg_pipeline.stop()
+            self._bg_pipeline = None
 
     def _update_redraw_interval(self, *args):
         if self._player.info and self.is_visible():
@@ -140,6 +410,7 @@ class WaveformSeekBar(Gtk.Box):
 
     def _on_destroy(self, *args):
         self._clean_pipeline()
+        self._clean_bg_pipeline()
         self._label_tracker.destroy()
         self._redraw_tracker.destroy()
 
@@ -164,11 +435,11 @@ class WaveformSeekBar(Gtk.Box):
             self._update_label(player)
 
     def _on_song_started(self, player, song):
+        self._waveform_scale.set_placeholder(True)
         if player.info:
             # Trigger a re-computation of the waveform
             self._create_waveform(player.info, CONFIG.max_data_points)
 
-        self._waveform_scale.set_placeholder(True)
         self._update(player, True)
 
     def _on_song_ended(self, player, song, ended):
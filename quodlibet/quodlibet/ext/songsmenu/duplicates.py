@@ -13,6 +13,7 @@
 #    published by the Free Software Foundation.
 #
 
+import re
 import unicodedata
 
 import sys
@@ -367,11 +368,110 @@ def _remove_punctuation_trans():
         if unicodedata.category(unichr(i)).startswith('P'))
 
 
+class DuplicateIndex(object):
+    """Maps duplicate keys to the songs of a library.
+
+    Gets built for a set of key settings and is then kept up to date
+    through the library signals.
+    """
+
+    def __init__(self, library):
+        self.library = library
+        self.settings = None
+        self._get_key = None
+        # song -> key
+        self._keys = {}
+        # key -> set of songs
+        self._groups = {}
+        self._sigs = []
+
+    def build(self, settings, get_key):
+        """Computes the keys of all songs if the settings changed"""
+
+        if settings == self.settings:
+            return
+
+        print_d("Indexing duplicate keys for %d song(s)..." %
+                len(self.library))
+        self.settings = settings
+        self._get_key = get_key
+        self._keys.clear()
+        self._groups.clear()
+        self._add(self.library.values())
+
+        if not self._sigs:
+            self._sigs = [
+                self.library.connect('added', self.__added),
+                self.library.connect('removed', self.__removed),
+                self.library.connect('changed', self.__changed),
+            ]
+
+    def destroy(self):
+        for sig in self._sigs:
+            self.library.disconnect(sig)
+        self._sigs = []
+        self._keys.clear()
+        self._groups.clear()
+        self.settings = None
+
+    def get_key(self, song):
+        try:
+            return self._keys[song]
+        except KeyError:
+            return self._get_key(song)
+
+    def find(self, key):
+        """Returns a set of all songs with the key"""
+
+        return set(self._groups.get(key, ()))
+
+    def _add(self, songs):
+        get_key = self._get_key
+        keys = self._keys
+        groups = self._groups
+        for song in songs:
+            key = get_key(song)
+            keys[song] = key
+            if not key:
+                continue
+            try:
+                groups[key].add(song)
+            except KeyError:
+                groups[key] = {song}
+
+    def _remove(self, songs):
+        keys = self._keys
+        groups = self._groups
+        for song in songs:
+            key = keys.pop(song, None)
+            group = groups.get(key)
+            if group is None:
+                continue
+            group.discard(song)
+            if not group:
+                del groups[key]
+
+    def __added(self, library, songs):
+        self._add(songs)
+
+    def __removed(self, library, songs):
+        self._remove(songs)
+
+    def __changed(self, library, songs):
+        self._remove(songs)
+        self._add(songs)
+
+
+_index = None
+
+
 class Duplicates(SongsMenuPlugin, PluginConfigMixin):
     PLUGIN_ID = 'Duplicates'
     PLUGIN_NAME = _('Duplicates Browser')
     PLUGIN_DESC = _('Finds and displays similarly tagged versions of songs.')
     PLUGIN_ICON = Icons.EDIT_SELECT_ALL
+    # for getting disabled() called
+    PLUGIN_INSTANCE = True
 
     MIN_GROUP_SIZE = 2
     _CFG_KEY_KEY = "key_expression"
@@ -381,6 +481,10 @@ class Duplicates(SongsMenuPlugin, PluginConfigMixin):
     _CFG_REMOVE_DIACRITICS = 'remove_diacritics'
     _CFG_REMOVE_PUNCTUATION = 'remove_punctuation'
     _CFG_CASE_INSENSITIVE = 'case_insensitive'
+    _CFG_FUZZY = 'fuzzy'
+
+    FUZZY_LENGTH_DIFF = 5
+    """Maximum length difference in seconds for fuzzy matches"""
 
     plugin_handles = any_song(is_finite)
 
@@ -424,6 +528,9 @@ class Duplicates(SongsMenuPlugin, PluginConfigMixin):
             (cls._CFG_REMOVE_DIACRITICS, _("Remove _Diacritics")),
             (cls._CFG_REMOVE_PUNCTUATION, _("Remove _Punctuation")),
             (cls._CFG_CASE_INSENSITIVE, _("Case _Insensitive")),
+            (cls._CFG_FUZZY,
+             _("_Fuzzy matching (ignore text in brackets and all of the "
+               "above, compare lengths)")),
         ]
         vb2 = Gtk.VBox(spacing=6)
         for key, label in toggles:
@@ -442,39 +549,74 @@ class Duplicates(SongsMenuPlugin, PluginConfigMixin):
         return "".join(c for c in unicodedata.normalize('NFKD', text_type(s))
                        if not unicodedata.combining(c))
 
+    @classmethod
+    def _get_settings(cls):
+        return (cls.get_key_expression(),) + tuple(
+            cls.config_get_bool(key) for key in [
+                cls._CFG_REMOVE_DIACRITICS, cls._CFG_CASE_INSENSITIVE,
+                cls._CFG_REMOVE_PUNCTUATION, cls._CFG_REMOVE_WHITESPACE,
+                cls._CFG_FUZZY])
+
     @classmethod
     def get_key(cls, song):
-        key = song(cls.get_key_expression())
-        if cls.config_get_bool(cls._CFG_REMOVE_DIACRITICS):
+        (expression, diacritics, case_insensitive, punctuation, whitespace,
+         fuzzy) = cls._get_settings()
+
+        key = song(expression)
+        if fuzzy:
+            key = re.sub(r"\s*(\([^)]*\)|\[[^\]]*\])", u"", key)
+        if diacritics or fuzzy:
             key = cls.remove_accents(key)
-        if cls.config_get_bool(cls._CFG_CASE_INSENSITIVE):
+        if case_insensitive or fuzzy:
             key = key.lower()
-        if cls.config_get_bool(cls._CFG_REMOVE_PUNCTUATION):
+        if punctuation or fuzzy:
             key = (key.translate(_remove_punctuation_trans()))
-        if cls.config_get_bool(cls._CFG_REMOVE_WHITESPACE):
+        if whitespace or fuzzy:
             key = "_".join(key.split())
         return key
 
+    @classmethod
+    def get_index(cls):
+        """Returns the duplicate key index of the library for the current
+        settings
+        """
+
+        global _index
+
+        if _index is None or _index.library is not app.library:
+            if _index is not None:
+                _index.destroy()
+            _index = DuplicateIndex(app.library)
+        _index.build(cls._get_settings(), cls.get_key)
+        return _index
+
+    def disabled(self):
+        global _index
+
+        if _index is not None:
+            _index.destroy()
+            _index = None
+
     def plugin_songs(self, songs):
         model = DuplicatesTreeModel()
         self.__cfg_cache = {}
 
-        # Index all songs by our custom key
-        # TODO: make this cache-friendly
         print_d("Calculating duplicates for %d song(s)..." % len(songs))
+        index = self.get_index()
+        fuzzy = self.config_get_bool(self._CFG_FUZZY)
         groups = {}
         for song in songs:
-            key = self.get_key(song)
-            if key and key in groups:
-                print_d("Found duplicate based on '%s'" % key)
-                groups[key].add(song._song)
-            elif key:
-                groups[key] = {song._song}
-
-        for song in app.library:
-            key = self.get_key(song)
-            if key in groups:
-                groups[key].add(song)
+            song = song._song
+            key = index.get_key(song)
+            if not key:
+                continue
+            found = index.find(key)
+            found.add(song)
+            if fuzzy:
+                length = song("~#length")
+                found = {s for s in found if abs(
+                    s("~#length") - length) <= self.FUZZY_LENGTH_DIFF}
+            groups.setdefault(key, set()).update(found)
 
         # Now display the grouped duplicates
         for (key, children) in groups.items():
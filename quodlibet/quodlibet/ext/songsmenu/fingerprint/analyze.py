@@ -5,11 +5,17 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation
 
+import os
+import time
 import multiprocessing
+from collections import deque
 
-from gi.repository import Gst, GObject
+from gi.repository import Gst, GObject, GLib
+from senf import fsnative
 
-from quodlibet.util import connect_obj
+from quodlibet.util import connect_obj, print_w
+from quodlibet.util.atomic import atomic_save
+from quodlibet.util.path import mkdir, get_file_cache_key, get_cache_folder
 
 
 class FingerPrintResult(object):
@@ -21,6 +27,51 @@ class FingerPrintResult(object):
         self.length = length
 
 
+class FingerPrintCache(object):
+    """Stores fingerprints on disk, keyed by the path, mtime and size of
+    the file.
+    """
+
+    def __init__(self, folder=None):
+        if folder is None:
+            folder = get_cache_folder("fingerprints")
+        self.folder = folder
+
+    def _get_path(self, song):
+        digest = get_file_cache_key(song("~filename"))
+        if digest is None:
+            return None
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def get(self, song):
+        """A FingerPrintResult or None"""
+
+        path = self._get_path(song)
+        if path is None:
+            return None
+
+        try:
+            with open(path, "rb") as h:
+                length, chromaprint = h.read().decode("ascii").split(u"\n")
+            length = float(length)
+        except (EnvironmentError, ValueError):
+            return None
+        return FingerPrintResult(song, chromaprint, length)
+
+    def put(self, result):
+        path = self._get_path(result.song)
+        if path is None:
+            return
+
+        data = (u"%r\n%s" % (result.length, result.chromaprint))
+        try:
+            mkdir(os.path.dirname(path), 0o700)
+            with atomic_save(fsnative(path), "wb") as h:
+                h.write(data.encode("ascii"))
+        except (EnvironmentError, UnicodeEncodeError) as e:
+            print_w("[fingerprint] Couldn't save fingerprint: %s" % e)
+
+
 class FingerPrintPipeline(object):
 
     def __init__(self):
@@ -178,16 +229,34 @@ class FingerPrintPool(GObject.GObject):
             GObject.SignalFlags.RUN_LAST, None, (object, object)),
         }
 
-    def __init__(self, max_workers=None):
+    CACHED_PER_STEP = 20
+    """Number of cached results to emit per main loop iteration"""
+
+    def __init__(self, max_workers=None, cache=None):
         super(FingerPrintPool, self).__init__()
 
         if max_workers is None:
-            max_workers = int(multiprocessing.cpu_count() * 1.5)
+            # decoding is CPU bound
+            max_workers = multiprocessing.cpu_count()
         self._max_workers = max_workers
+        self._cache = FingerPrintCache() if cache is None else cache
 
         self._idle = set()
         self._workers = set()
         self._queue = []
+        self._cached = deque()
+        self._cached_id = None
+        self._start_time = None
+        self._done = 0
+
+    @property
+    def throughput(self):
+        """Finished songs per second since the first push()"""
+
+        if self._start_time is None:
+            return 0.0
+        elapsed = time.time() - self._start_time
+        return self._done / elapsed if elapsed > 0 else 0.0
 
     def _get_worker(self):
         """An idle FingerPrintPipeline or None"""
@@ -215,12 +284,33 @@ class FingerPrintPool(GObject.GObject):
     def push(self, song):
         """Add a new song to the queue"""
 
+        if self._start_time is None:
+            self._start_time = time.time()
+
+        result = self._cache.get(song)
+        if result is not None:
+            self._cached.append(result)
+            if self._cached_id is None:
+                self._cached_id = GLib.idle_add(self._emit_cached)
+            return
+
         worker = self._get_worker()
         if worker:
             self._start_song(worker, song)
         else:
             self._queue.append(song)
 
+    def _emit_cached(self):
+        for i in range(self.CACHED_PER_STEP):
+            if not self._cached:
+                self._cached_id = None
+                return False
+            result = self._cached.popleft()
+            self._done += 1
+            self.emit("fingerprint-started", result.song)
+            self.emit("fingerprint-done", result)
+        return True
+
     def stop(self):
         """Stop everything.
 
@@ -228,6 +318,13 @@ class FingerPrintPool(GObject.GObject):
         Can be called multiple times.
         """
 
+        self._stop_workers()
+        if self._cached_id is not None:
+            GLib.source_remove(self._cached_id)
+            self._cached_id = None
+        self._cached.clear()
+
+    def _stop_workers(self):
         for worker in self._workers:
             worker.stop()
         self._workers.clear()
@@ -235,7 +332,9 @@ class FingerPrintPool(GObject.GObject):
 
     def _callback(self, worker, song, result, error):
         self._idle.add(worker)
+        self._done += 1
         if result:
+            self._cache.put(result)
             self.emit("fingerprint-done", result)
         else:
             self.emit("fingerprint-error", song, error)
@@ -247,4 +346,4 @@ class FingerPrintPool(GObject.GObject):
             self._start_song(worker, song)
         elif len(self._idle) == len(self._workers):
             # all done, all idle, kill em
-            self.stop()
+            self._stop_workers()
@@ -299,6 +299,10 @@ class SearchWindow(Window):
         ccb.connect("toggled", self.__group_toggled)
         self._group_ccb = ccb
 
+        self.__progress = progress = Gtk.Label()
+        progress.set_alignment(0, 0.5)
+        inner_box.pack_start(progress, False, True, 0)
+
         outer_box.pack_start(inner_box, True, True, 0)
 
         bottom_box = Gtk.HBox(spacing=12)
@@ -322,6 +326,7 @@ class SearchWindow(Window):
         self._release_scores = {}
         self._directory_scores = {}
         self.__done = 0
+        self.__fp_done = 0
 
         self.connect("destroy", self.__destroy)
 
@@ -424,12 +429,23 @@ class SearchWindow(Window):
 
         self.__inc_done()
 
+    def __inc_fp_done(self, pool):
+        self.__fp_done += 1
+        text = _("Fingerprints: %(done)d/%(all)d") % {
+            "done": self.__fp_done, "all": len(self._iter_map)}
+        if pool.throughput:
+            text += " (%s)" % (
+                _("%(rate).1f songs per second") % {"rate": pool.throughput})
+        self.__progress.set_text(text)
+
     def __fp_done_cb(self, pool, result):
+        self.__inc_fp_done(pool)
         self._thread.put(result)
         with self.__update_row(result.song) as entry:
             entry.status = Status.LOOKUP
 
     def __fp_error_cb(self, pool, song, error_msg):
+        self.__inc_fp_done(pool)
         print_w(error_msg)
         with self.__update_row(song) as entry:
             entry.status = Status.ERROR
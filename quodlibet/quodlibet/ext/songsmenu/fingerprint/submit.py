@@ -125,14 +125,18 @@ class FingerprintDialog(Window):
         text += " %d/%d" % (to_send, all_)
         self.__stats.set_markup(text)
 
-    def __set_fraction(self, progress):
+    def __set_fraction(self, progress, rate=None):
         self.__bar.set_fraction(progress)
-        self.__bar.set_text("%d%%" % round(progress * 100))
+        text = "%d%%" % round(progress * 100)
+        if rate:
+            text += " (%s)" % (
+                _("%(rate).1f songs per second") % {"rate": rate})
+        self.__bar.set_text(text)
 
-    def __inc_fp_fraction(self):
+    def __inc_fp_fraction(self, pool):
         self.__fp_done += 1
         frac = self.__fp_done / float(len(self.__songs))
-        self.__set_fraction(frac)
+        self.__set_fraction(frac, pool.throughput)
         if self.__fp_done == len(self.__songs):
             self.__submit.set_sensitive(True)
             self.__show_final_stats()
@@ -146,12 +150,12 @@ class FingerprintDialog(Window):
 
     def __fp_done_cb(self, pool, result):
         self.__fp_results[result.song] = result
-        self.__inc_fp_fraction()
+        self.__inc_fp_fraction(pool)
         self.__update_stats()
 
     def __fp_error_cb(self, pool, song, error):
         print_w("[fingerprint] " + error)
-        self.__inc_fp_fraction()
+        self.__inc_fp_fraction(pool)
         self.__update_stats()
 
     def __show_final_stats(self):
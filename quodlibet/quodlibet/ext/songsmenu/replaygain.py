@@ -9,12 +9,18 @@
 #    published by the Free Software Foundation.
 #
 
+import os
+import time
+import shelve
+import hashlib
+
 from gi.repository import Gtk
 from gi.repository import GObject
 from gi.repository import Pango
 from gi.repository import Gst
 from gi.repository import GLib
 
+import quodlibet
 from quodlibet import print_d, ngettext, _
 from quodlibet.plugins import PluginConfigMixin
 
@@ -26,6 +32,7 @@ from quodlibet.qltk import Icons, Dialog
 from quodlibet.plugins.songsmenu import SongsMenuPlugin
 from quodlibet.plugins.songshelpers import is_writable, is_finite, each_song
 from quodlibet.util import cached_property, print_w, print_e, format_int_locale
+from quodlibet.util.path import get_file_cache_key
 from quodlibet.compat import xrange
 
 __all__ = ['ReplayGain']
@@ -71,6 +78,10 @@ class RGAlbum(object):
         except ZeroDivisionError:
             return 0.0
 
+    @property
+    def length(self):
+        return sum(song.length for song in self.songs)
+
     @property
     def done(self):
         for song in self.songs:
@@ -211,6 +222,98 @@ class RGSong(object):
         return "<Song=%s RG data=%s>" % (self.song, vals)
 
 
+class RGCache(object):
+    """Stores analysis results of songs, keyed by the path, mtime and
+    size of the files, so unchanged albums don't need to be analyzed again.
+
+    The album gain depends on all songs of an album, so entries only get
+    used if the album consists of the same files.
+    """
+
+    PATH = os.path.join(quodlibet.get_user_dir(), "replaygain.db")
+
+    def __init__(self, path=None):
+        self._path = path or self.PATH
+        self._shelf = None
+        # RGSong -> key used for storing
+        self._keys = {}
+
+    def _get_shelf(self):
+        if self._shelf is None:
+            try:
+                self._shelf = shelve.open(self._path)
+            except Exception as e:
+                # this is just a cache, so ignore
+                print_w("Couldn't open ReplayGain cache: %s" % e)
+                self._shelf = {}
+        return self._shelf
+
+    @staticmethod
+    def _get_key(rgsong):
+        return get_file_cache_key(rgsong.filename)
+
+    @staticmethod
+    def _get_album_id(keys):
+        return hashlib.sha1(
+            u"\0".join(sorted(keys)).encode("ascii")).hexdigest()
+
+    def lookup(self, album):
+        """Sets the results of all songs and the album and marks them done
+        if all of them are known. Returns True in that case.
+        """
+
+        keys = [self._get_key(song) for song in album.songs]
+        if not keys or None in keys:
+            return False
+        album_id = self._get_album_id(keys)
+
+        shelf = self._get_shelf()
+        entries = []
+        for key in keys:
+            try:
+                entry = shelf.get(key)
+            except Exception:
+                entry = None
+            if entry is None or entry[4] != album_id:
+                return False
+            entries.append(entry)
+
+        for song, key, entry in zip(album.songs, keys, entries):
+            song.gain, song.peak, album.gain, album.peak = entry[:4]
+            song.progress = 1.0
+            song.done = True
+            self._keys[song] = key
+        return True
+
+    def store(self, album):
+        """Stores the results of a finished album"""
+
+        if not album.done or album.error:
+            return
+
+        keys = [self._get_key(song) for song in album.songs]
+        if None in keys:
+            return
+        album_id = self._get_album_id(keys)
+
+        shelf = self._get_shelf()
+        try:
+            for song, key in zip(album.songs, keys):
+                old_key = self._keys.get(song)
+                if old_key is not None and old_key != key:
+                    shelf.pop(old_key, None)
+                shelf[key] = (
+                    song.gain, song.peak, album.gain, album.peak, album_id)
+                self._keys[song] = key
+        except Exception as e:
+            print_w("Couldn't save ReplayGain results: %s" % e)
+
+    def close(self):
+        if self._shelf is not None and hasattr(self._shelf, "close"):
+            self._shelf.close()
+        self._shelf = None
+
+
 class ReplayGainPipeline(GObject.Object):
 
     __gsignals__ = {
@@ -357,7 +460,7 @@ class ReplayGainPipeline(GObject.Object):
 
 class RGDialog(Dialog):
 
-    def __init__(self, albums, parent, process_mode):
+    def __init__(self, albums, parent, process_mode, cache=None):
         super(RGDialog, self).__init__(
             title=_('ReplayGain Analyzer'), parent=parent)
 
@@ -366,11 +469,12 @@ class RGDialog(Dialog):
                              Gtk.ResponseType.OK)
 
         self.process_mode = process_mode
+        self._cache = cache or RGCache()
         self.set_default_size(600, 400)
         self.set_border_width(6)
 
         hbox = Gtk.HBox(spacing=6)
-        info = Gtk.Label()
+        self._info = info = Gtk.Label()
         hbox.pack_start(info, True, True, 0)
         self.vbox.pack_start(hbox, False, False, 6)
 
@@ -456,6 +560,8 @@ class RGDialog(Dialog):
         self._timeout = None
         self._sigs = {}
         self._done = []
+        self._analyzed = set()
+        self._start_time = None
 
         self.__fill_view(view, albums)
         num_to_process = sum(int(rga.should_process) for rga in self._todo)
@@ -463,10 +569,11 @@ class RGDialog(Dialog):
             "There is <b>%(to-process)s</b> album to update (of %(all)s)",
             "There are <b>%(to-process)s</b> albums to update (of %(all)s)",
             num_to_process)
-        info.set_markup(template % {
+        self._info_text = template % {
             "to-process": format_int_locale(num_to_process),
             "all": format_int_locale(len(self._todo)),
-        })
+        }
+        info.set_markup(self._info_text)
         self.connect("destroy", self.__destroy)
         self.connect('response', self.__response)
 
@@ -490,8 +597,13 @@ class RGDialog(Dialog):
             view.expand_all()
 
     def start_analysis(self):
+        self._start_time = time.time()
         self._timeout = GLib.idle_add(self.__request_update)
 
+        # the longest albums first, so no pipeline is left with a long
+        # one at the end
+        self._todo.sort(key=lambda album: album.length, reverse=True)
+
         # fill the pipelines
         for p in self.pipes:
             if not self._todo:
@@ -517,8 +629,22 @@ class RGDialog(Dialog):
                 self._done.append(next_album)
                 self.__update_view_for(next_album)
                 next_album = None
+            elif self._cache.lookup(next_album):
+                print_d("Using cached results for %s" % next_album.title)
+                self._done.append(next_album)
+                self.__update_view_for(next_album, True)
+                next_album = None
         return next_album
 
+    def save_results(self):
+        """Stores the results of all finished albums in the cache again,
+        as writing the tags changes the files, and closes the cache.
+        """
+
+        for album in self._done:
+            self._cache.store(album)
+        self._cache.close()
+
     def __response(self, win, response):
         if response == Gtk.ResponseType.CANCEL:
             self.destroy()
@@ -531,6 +657,7 @@ class RGDialog(Dialog):
         # shut down any active processing and clean up resources, timeouts
         if self._timeout:
             GLib.source_remove(self._timeout)
+            self._timeout = None
         for p in self.pipes:
             if p in self._sigs:
                 for s in self._sigs.get(p, []):
@@ -538,6 +665,8 @@ class RGDialog(Dialog):
             p.quit()
 
     def __update(self, pipeline, album, song):
+        if song is not None and song.done:
+            self._analyzed.add(song)
         for row in self.model:
             row_album = row[0]
             if row_album is album:
@@ -551,20 +680,37 @@ class RGDialog(Dialog):
 
     def __done(self, pipeline, album):
         self._done.append(album)
-        if self._todo:
-            pipeline.start(self._todo.pop(0))
+        self._cache.store(album)
+        next_album = self.get_next_album()
+        if next_album:
+            pipeline.start(next_album)
         self.__update_view_for(album)
 
-    def __update_view_for(self, album):
+    def __update_view_for(self, album, children=False):
         for row in self.model:
             row_album = row[0]
             if row_album is album:
                 self.model.row_changed(row.path, row.iter)
+                if children:
+                    for child in row.iterchildren():
+                        self.model.row_changed(child.path, child.iter)
                 break
 
+    def __update_info(self):
+        elapsed = time.time() - self._start_time
+        count = len(self._analyzed)
+        text = ngettext("%(tracks)s track analyzed",
+                        "%(tracks)s tracks analyzed", count) % {
+            "tracks": format_int_locale(count)}
+        if count and elapsed > 0:
+            text += " (%s)" % (_("%(rate).1f per second") % {
+                "rate": count / elapsed})
+        self._info.set_markup(self._info_text + "\n" + text)
+
     def __request_update(self):
         GLib.source_remove(self._timeout)
         self._timeout = None
+        self.__update_info()
         # all done, stop
         if len(self._done) < self._count:
             for p in self.pipes:
@@ -594,6 +740,7 @@ class ReplayGain(SongsMenuPlugin, PluginConfigMixin):
 
     def __plugin_done(self, win):
         self.plugin_finish()
+        win.save_results()
 
     @classmethod
     def PluginPreferences(cls, parent):
@@ -7,12 +7,14 @@
 # published by the Free Software Foundation
 
 from ._audio import PEOPLE, AudioFile, DUMMY_SONG, decode_value, \
-    FILESYSTEM_TAGS, TIME_TAGS
+    FILESYSTEM_TAGS, TIME_TAGS, NUMERIC_ZERO_DEFAULT
 from ._image import EmbeddedImage, APICType
 from ._misc import AudioFileError, init, MusicFile, types, loaders, filter, \
     mimes
-from ._serialize import load_audio_files, dump_audio_files, SerializationError
+from ._serialize import load_audio_files, dump_audio_files, \
+    SerializationError, load_audio_files_from_file
 
 AudioFile, AudioFileError, EmbeddedImage, DUMMY_SONG, PEOPLE, decode_value,
 APICType, FILESYSTEM_TAGS, TIME_TAGS, init, MusicFile, types, loaders, filter,
-mimes, load_audio_files, dump_audio_files, SerializationError
+mimes, load_audio_files, dump_audio_files, SerializationError,
+load_audio_files_from_file, NUMERIC_ZERO_DEFAULT
@@ -13,6 +13,7 @@
 import os
 import shutil
 import time
+import unicodedata
 
 from senf import fsn2uri, fsnative, fsn2text, devnull, bytes2fsn, path2fsn
 
@@ -153,6 +154,35 @@ class AudioFile(dict, ImageContainer):
     def sort_key(self):
         return [self.album_key, self.__song_key()]
 
+    @util.cached_property
+    def _search_texts(self):
+        return {}
+
+    def search_text(self, name):
+        """Returns the NFC normalized text queries search for the lowercase
+        tag `name`, which has to be a normal tag or one of FILESYSTEM_TAGS.
+
+        The result gets cached until the song changes.
+        """
+
+        texts = self._search_texts
+        try:
+            return texts[name]
+        except KeyError:
+            pass
+
+        if name in FILESYSTEM_TAGS:
+            text = fsn2text(self(name, fsnative()))
+        else:
+            text = self.get(name)
+            if text is None:
+                if name in ("filename", "mountpoint"):
+                    text = fsn2text(self.get("~" + name, fsnative()))
+                else:
+                    text = self.get("~" + name, u"")
+        text = texts[name] = unicodedata.normalize("NFC", text)
+        return text
+
     @staticmethod
     def sort_by_func(tag):
         """Returns a fast sort function for a specific tag (or pattern).
@@ -210,17 +240,44 @@ class AudioFile(dict, ImageContainer):
             value = text_type(value)
 
         dict.__setitem__(self, key, value)
-
-        pop = self.__dict__.pop
-        pop("album_key", None)
-        pop("sort_key", None)
+        self.__invalidate_cache()
 
     def __delitem__(self, key):
         dict.__delitem__(self, key)
+        self.__invalidate_cache()
+
+    def __invalidate_cache(self):
+        """Drops all cached values derived from the tags"""
 
         pop = self.__dict__.pop
         pop("album_key", None)
         pop("sort_key", None)
+        pop("_search_texts", None)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.__invalidate_cache()
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        value = dict.setdefault(self, key, default)
+        self.__invalidate_cache()
+        return value
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self.__invalidate_cache()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self.__invalidate_cache()
+        return item
+
+    def clear(self):
+        dict.clear(self)
+        self.__invalidate_cache()
 
     @property
     def key(self):
@@ -10,9 +10,9 @@
 import pickle
 from senf import bytes2fsn, fsn2bytes, fsnative
 
-from quodlibet.util.picklehelper import pickle_loads, pickle_dumps
+from quodlibet.util.picklehelper import pickle_load, pickle_dumps
 from quodlibet.util import is_windows
-from quodlibet.compat import PY3, text_type
+from quodlibet.compat import PY3, text_type, cBytesIO
 from ._audio import AudioFile
 
 
@@ -23,6 +23,10 @@ class SerializationError(Exception):
 def _py2_to_py3(items):
     assert PY3
 
+    # Most keys are the same for all items, so share one instance
+    # for each instead of keeping a decoded copy per item
+    keys = {}
+
     for i in items:
         try:
             l = list(i.items())
@@ -31,13 +35,17 @@ def _py2_to_py3(items):
         i.clear()
         for k, v in l:
             if isinstance(k, bytes):
-                k = k.decode("utf-8", "replace")
+                try:
+                    k = keys[k]
+                except KeyError:
+                    keys[k] = k = k.decode("utf-8", "replace")
             else:
                 # strip surrogates
                 try:
                     k.encode("utf-8")
                 except UnicodeEncodeError:
                     k = k.encode("utf-8", "replace").decode("utf-8")
+                k = keys.setdefault(k, k)
 
             if k == "~filename" or k == "~mountpoint":
                 if isinstance(v, bytes):
@@ -144,6 +152,22 @@ def load_audio_files(data, process=True):
         SerializationError
     """
 
+    return load_audio_files_from_file(cBytesIO(data), process)
+
+
+def load_audio_files_from_file(fileobj, process=True):
+    """Like load_audio_files() but unpickles directly from a file object,
+    so the whole serialized data never has to be in memory at once.
+
+    Args:
+        fileobj (fileobj)
+        process (bool)
+    Returns:
+        List[AudioFile]
+    Raises:
+        SerializationError
+    """
+
     dummy = type("dummy", (dict,), {})
     error_occured = []
     temp_type_cache = {}
@@ -168,7 +192,7 @@ def load_audio_files(data, process=True):
         return temp_type_cache[real_type]
 
     try:
-        items = pickle_loads(data, lookup_func)
+        items = pickle_load(fileobj, lookup_func)
     except pickle.UnpicklingError as e:
         raise SerializationError(e)
 
@@ -16,23 +16,30 @@ also be queried in various ways.
 import time
 
 from quodlibet import print_d
+from quodlibet.util import copool
 
 from quodlibet.library.libraries import SongFileLibrary, SongLibrary
 from quodlibet.library.librarians import SongLibrarian
-from quodlibet.util.path import mtime
 
 
-def init(cache_fn=None):
+def init(cache_fn=None, lazy=False):
     """Set up the library and return the main one.
 
     Return a main library, and set a librarian for
     all future SongLibraries.
+
+    If `lazy` is True, songs which aren't needed right away get loaded in
+    the background once the main loop runs. Anything iterating over the
+    library before that loads them right away.
     """
 
     SongFileLibrary.librarian = SongLibrary.librarian = SongLibrarian()
     library = SongFileLibrary("main")
     if cache_fn:
-        library.load(cache_fn)
+        library.load(cache_fn, lazy=lazy)
+        if library.has_pending():
+            copool.add(library.iter_load_pending, "library_load",
+                       funcid="library_load")
     return library
 
 
@@ -51,5 +58,6 @@ def save(save_period=None):
         if not filename or not lib.dirty:
             continue
 
-        if not save_period or abs(time.time() - mtime(filename)) > save_period:
+        if not save_period or \
+                abs(time.time() - lib.get_save_mtime()) > save_period:
             lib.save()
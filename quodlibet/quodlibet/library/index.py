@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation
+
+"""An inverted trigram index over tag values.
+
+The index is used to narrow down the songs a query has to be evaluated for,
+it never decides if a song matches by itself. Because of this it is enough
+if the set of songs it returns contains all matching songs.
+
+All text is folded so that everything the unisearch regexes treat as equal
+(case, similar looking characters, punctuation variants) ends up the same.
+Songs where that folding isn't unambiguous are always returned.
+
+For numeric tags the index keeps array backed columns instead, which can be
+compared against a value without looking at the songs.
+
+For sorting by text tags `SortKeyCache` keeps the human sort keys of the
+songs for the last few tags used, independent of the search index.
+"""
+
+import re
+import unicodedata
+from array import array
+from collections import OrderedDict
+from itertools import compress, repeat
+
+from senf import fsn2text, fsnative
+
+from quodlibet.formats import AudioFile, FILESYSTEM_TAGS, \
+    NUMERIC_ZERO_DEFAULT
+from quodlibet.unisearch.db import get_replacement_mapping
+from quodlibet.util import cached_func, re_escape, tagsplit
+from quodlibet.util.dprint import print_d
+from quodlibet.compat import iteritems, text_type, number_types
+
+
+# synthesized tags which only depend on the song itself and as such
+# are kept up to date through the 'changed' signal
+SYNTHESIZED_TAGS = {
+    "~people", "~people:real", "~peoplesort", "~performers",
+    "~performerssort", "~basename", "~dirname", "~format", "~codec",
+    "~encoding"}
+
+# numeric tags which are either stored in the song or have a fixed default
+NUMERIC_TAGS = (NUMERIC_ZERO_DEFAULT - {"~#cue_in", "~#cue_out"}) | \
+    {"~#rating"}
+
+
+def _casefold(text):
+    try:
+        return text.casefold()
+    except AttributeError:
+        # Python 2
+        return text.lower()
+
+
+@cached_func
+def _get_fold_table():
+    """Returns a translate() table for casefolded text and a regex matching
+    text which can't be folded unambiguously.
+    """
+
+    normalize = unicodedata.normalize
+    targets = {}
+    unsafe = set()
+
+    for key, variants in iteritems(get_replacement_mapping()):
+        key = _casefold(normalize("NFC", key))
+        for variant in variants:
+            folded = _casefold(normalize("NFC", variant))
+            if len(folded) != 1:
+                unsafe.add(variant)
+                continue
+            if folded == key:
+                continue
+            targets.setdefault(folded, set()).add(key)
+
+    table = {}
+    for char, keys in iteritems(targets):
+        if len(keys) != 1:
+            unsafe.update([char, char.upper(), char.title()])
+            continue
+        table[char] = list(keys)[0]
+
+    # keys can be variants of other keys
+    for i in range(3):
+        for char, target in iteritems(table):
+            table[char] = u"".join(table.get(c, c) for c in target)
+
+    table = dict((ord(k), v) for k, v in iteritems(table))
+    if unsafe:
+        unsafe_re = re.compile(
+            u"[%s]" % u"".join(map(re_escape, sorted(unsafe))), re.UNICODE)
+    else:
+        unsafe_re = re.compile(u"(?!)")
+
+    return table, unsafe_re
+
+
+def fold_text(text):
+    """Returns the folded text or None if it can't be folded safely
+
+    Args:
+        text (text_type)
+    Returns:
+        text_type or None
+    """
+
+    table, unsafe_re = _get_fold_table()
+    text = unicodedata.normalize("NFC", text)
+    if unsafe_re.search(text):
+        return None
+    return _casefold(text).translate(table)
+
+
+def get_trigrams(text):
+    """Returns a set of all trigrams of the folded text"""
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def get_search_value(song, name):
+    """Returns the text a query searches for the lowercase tag `name`
+    or None if it can't be indexed.
+
+    Mirrors what `query._match.Tag.search` looks at.
+    """
+
+    if name[:1] == "~":
+        if name in FILESYSTEM_TAGS:
+            return fsn2text(song(name, fsnative()))
+        elif name in SYNTHESIZED_TAGS:
+            return song(name)
+        return None
+
+    value = song.get(name)
+    if value is None:
+        if name in ("filename", "mountpoint"):
+            value = fsn2text(song.get("~" + name, fsnative()))
+        else:
+            value = song.get("~" + name, u"")
+    return value
+
+
+class _TagIndex(object):
+
+    def __init__(self, name):
+        self.name = name
+        # trigram -> set of songs
+        self.postings = {}
+        # song -> trigrams
+        self.trigrams = {}
+        # songs which always need to be checked
+        self.unsafe = set()
+
+    def add(self, songs):
+        name = self.name
+        postings = self.postings
+        trigrams = self.trigrams
+        unsafe = self.unsafe
+
+        for song in songs:
+            value = get_search_value(song, name)
+            folded = None
+            if isinstance(value, text_type):
+                folded = fold_text(value)
+            if folded is None:
+                unsafe.add(song)
+                continue
+            grams = get_trigrams(folded)
+            trigrams[song] = grams
+            for gram in grams:
+                try:
+                    postings[gram].add(song)
+                except KeyError:
+                    postings[gram] = {song}
+
+    def remove(self, songs):
+        postings = self.postings
+        trigrams = self.trigrams
+
+        for song in songs:
+            self.unsafe.discard(song)
+            for gram in trigrams.pop(song, []):
+                entry = postings[gram]
+                entry.discard(song)
+                if not entry:
+                    del postings[gram]
+
+    def search(self, grams):
+        sets = []
+        for gram in grams:
+            entry = self.postings.get(gram)
+            if entry is None:
+                return set(self.unsafe)
+            sets.append(entry)
+
+        sets.sort(key=len)
+        result = set(sets[0])
+        for entry in sets[1:]:
+            result.intersection_update(entry)
+            if not result:
+                break
+        result.update(self.unsafe)
+        return result
+
+
+class _NumericColumn(object):
+
+    def __init__(self, name):
+        self.name = name
+        # the values and songs, all indexed by slot
+        self.values = array("d")
+        # the values rounded to two decimals like in queries, for searching
+        self.rounded = array("d")
+        self.songs = []
+        # song -> slot
+        self.slots = {}
+        # unused slots
+        self.free = []
+        # songs where the default value applies
+        self.missing = set()
+        # songs with non numeric values, always need to be checked
+        self.unsafe = set()
+
+    def add(self, songs):
+        name = self.name
+        values = self.values
+        rounded = self.rounded
+        column = self.songs
+        slots = self.slots
+        free = self.free
+
+        for song in songs:
+            value = song.get(name)
+            if value is None:
+                self.missing.add(song)
+                continue
+            elif not isinstance(value, number_types):
+                self.unsafe.add(song)
+                continue
+
+            if free:
+                slot = free.pop()
+                values[slot] = value
+                rounded[slot] = round(value, 2)
+                column[slot] = song
+            else:
+                slot = len(values)
+                values.append(value)
+                rounded.append(round(value, 2))
+                column.append(song)
+            slots[song] = slot
+
+    def remove(self, songs):
+        values = self.values
+        rounded = self.rounded
+        column = self.songs
+        slots = self.slots
+        free = self.free
+
+        for song in songs:
+            self.missing.discard(song)
+            self.unsafe.discard(song)
+            slot = slots.pop(song, None)
+            if slot is None:
+                continue
+            # NaN never compares true
+            values[slot] = rounded[slot] = float("nan")
+            column[slot] = None
+            free.append(slot)
+
+    def search(self, op, other):
+        matches = map(op, self.rounded, repeat(other))
+        result = set(compress(self.songs, matches))
+        # unused slots
+        result.discard(None)
+
+        default = AudioFile()(self.name, None)
+        if op(round(default, 2), other):
+            result.update(self.missing)
+        result.update(self.unsafe)
+        return result
+
+
+class SearchIndex(object):
+    """An inverted trigram index for the songs of a SongLibrary.
+
+    Tags get indexed the first time they are searched for and are then kept
+    up to date through the library signals.
+    """
+
+    def __init__(self, library):
+        self._library = library
+        self._tags = {}
+        self._columns = {}
+        self._sigs = [
+            library.connect('added', self.__added),
+            library.connect('removed', self.__removed),
+            library.connect('changed', self.__changed),
+        ]
+
+    def destroy(self):
+        for sig in self._sigs:
+            self._library.disconnect(sig)
+        self._sigs = []
+        self._tags.clear()
+        self._columns.clear()
+
+    @property
+    def tags(self):
+        """A list of all tags which are currently indexed"""
+
+        return list(self._tags.keys())
+
+    @property
+    def columns(self):
+        """A list of all numeric tags which are currently indexed"""
+
+        return list(self._columns.keys())
+
+    def _get_tag(self, name):
+        try:
+            return self._tags[name]
+        except KeyError:
+            pass
+
+        if name[:2] == "~#" or (
+                name[:1] == "~" and name not in FILESYSTEM_TAGS and
+                name not in SYNTHESIZED_TAGS):
+            return None
+
+        print_d("Indexing %r for %d songs" % (name, len(self._library)))
+        tag = _TagIndex(name)
+        tag.add(self._library.values())
+        self._tags[name] = tag
+        return tag
+
+    def candidates(self, names, literals):
+        """Returns a set of songs containing all songs where at least one
+        of the tags contains all literals, or None if the index can't help.
+
+        Args:
+            names (List[text_type]): lowercase tag names
+            literals (List[text_type]): literal texts
+        Returns:
+            set or None
+        """
+
+        grams = set()
+        for literal in literals:
+            folded = fold_text(literal)
+            if folded is not None:
+                grams.update(get_trigrams(folded))
+
+        if not grams or not names:
+            return None
+
+        tags = []
+        for name in names:
+            tag = self._get_tag(name)
+            if tag is None:
+                return None
+            tags.append(tag)
+
+        result = set()
+        for tag in tags:
+            result.update(tag.search(grams))
+        return result
+
+    def _get_column(self, name):
+        try:
+            return self._columns[name]
+        except KeyError:
+            pass
+
+        if name not in NUMERIC_TAGS:
+            return None
+
+        print_d("Indexing %r for %d songs" % (name, len(self._library)))
+        column = _NumericColumn(name)
+        column.add(self._library.values())
+        self._columns[name] = column
+        return column
+
+    def numeric_candidates(self, name, op, other):
+        """Returns a set of songs containing all songs where the value of the
+        numeric tag, rounded to two decimals like in queries, compares true
+        to `other`, or None if the index can't help.
+
+        Args:
+            name (str): a numeric tag like "~#playcount"
+            op (Callable[[float, float], bool]): e.g. `operator.lt`
+            other (float)
+        Returns:
+            set or None
+        """
+
+        column = self._get_column(name)
+        if column is None:
+            return None
+        return column.search(op, other)
+
+    def get_sort_func(self, name):
+        """Returns a sort key function for the numeric tag which uses the
+        indexed values, or None if the index can't help.
+
+        Like `AudioFile.sort_by_func` it works for all songs, not only
+        the ones in the library.
+        """
+
+        if callable(name):
+            return None
+
+        column = self._get_column(name)
+        if column is None:
+            return None
+
+        get_slot = column.slots.get
+        values = column.values
+
+        def sort_func(song):
+            slot = get_slot(song)
+            if slot is None:
+                return song(name)
+            return values[slot]
+
+        return sort_func
+
+    def __parts(self):
+        return list(self._tags.values()) + list(self._columns.values())
+
+    def __added(self, library, songs):
+        for part in self.__parts():
+            part.add(songs)
+
+    def __removed(self, library, songs):
+        for part in self.__parts():
+            part.remove(songs)
+
+    def __changed(self, library, songs):
+        for part in self.__parts():
+            part.remove(songs)
+            part.add(songs)
+
+
+class _SortKeys(object):
+    """Human sort keys for a tag, filled on demand"""
+
+    def __init__(self, name):
+        self.name = name
+        # song -> sort key
+        self.keys = {}
+        self.get_key = AudioFile.sort_by_func(name)
+
+    def remove(self, songs):
+        pop = self.keys.pop
+        for song in songs:
+            pop(song, None)
+
+
+class SortKeyCache(object):
+    """Caches the human sort keys of the songs of a SongLibrary for the last
+    few text tags sorted by.
+
+    Keys get computed when a song is first sorted and dropped on 'changed'
+    and 'removed'.
+    """
+
+    TAGS = 4
+    """Number of text tags to keep sort keys for"""
+
+    def __init__(self, library):
+        self._library = library
+        self._sort_keys = OrderedDict()
+        self._sigs = [
+            library.connect('removed', self.__removed),
+            library.connect('changed', self.__removed),
+        ]
+
+    def destroy(self):
+        for sig in self._sigs:
+            self._library.disconnect(sig)
+        self._sigs = []
+        self._sort_keys.clear()
+
+    @property
+    def tags(self):
+        """A list of all tags sort keys are kept for, least recently used
+        first
+        """
+
+        return list(self._sort_keys.keys())
+
+    def _get_sort_keys(self, name):
+        sort_keys = self._sort_keys
+        try:
+            keys = sort_keys.pop(name)
+        except KeyError:
+            # artistsort uses the sort key AudioFile already caches itself
+            if name == "artistsort":
+                return None
+            # only tags which depend on nothing but the song can be cached
+            if name not in FILESYSTEM_TAGS and not all(
+                    not t.startswith(("~", "#")) or t in SYNTHESIZED_TAGS
+                    for t in tagsplit(name)):
+                return None
+            keys = _SortKeys(name)
+            while len(sort_keys) >= self.TAGS:
+                sort_keys.popitem(last=False)
+
+        sort_keys[name] = keys
+        return keys
+
+    def get_sort_func(self, name):
+        """Returns a sort key function for the text tag which caches the
+        human sort keys, or None if they can't be cached.
+
+        Like `AudioFile.sort_by_func` it works for all songs, not only
+        the ones in the library.
+        """
+
+        if callable(name):
+            return None
+
+        sort_keys = self._get_sort_keys(name)
+        if sort_keys is None:
+            return None
+        return self.__get_cached_sort_func(sort_keys)
+
+    def __get_cached_sort_func(self, sort_keys):
+        keys = sort_keys.keys
+        get_key = sort_keys.get_key
+        contents = self._library._contents
+
+        def sort_func(song):
+            try:
+                return keys[song]
+            except KeyError:
+                key = get_key(song)
+                # songs outside of the library don't get updated
+                if contents.get(song.key) is song:
+                    keys[song] = key
+                return key
+
+        return sort_func
+
+    def __removed(self, library, songs):
+        for keys in self._sort_keys.values():
+            keys.remove(songs)
@@ -157,6 +157,7 @@ class SongLibrarian(Librarian):
         # the call for future libraries because the item's key has
         # changed. So, it needs to reimplement the method.
         re_add = []
+        old_key = song.key
         print_d("Renaming %r to %r" % (song.key, newname), self)
         for library in itervalues(self.libraries):
             try:
@@ -168,6 +169,7 @@ class SongLibrarian(Librarian):
         song.rename(newname)
         for library in re_add:
             library._contents[song.key] = song
+            library._renamed(old_key)
             if changed is None:
                 library._changed({song})
             else:
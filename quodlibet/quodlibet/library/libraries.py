@@ -15,24 +15,36 @@ least useful but most content-agnostic.
 
 import os
 import shutil
+import struct
 import time
+from collections import deque
 
 from gi.repository import GObject
-from senf import fsn2text, fsnative
+from senf import fsn2text, fsnative, fsn2bytes, bytes2fsn
+
+try:
+    from concurrent import futures
+except ImportError as e:
+    raise ImportError("python-futures is missing: %r" % e)
 
 from quodlibet import _
-from quodlibet.formats import MusicFile, AudioFileError, load_audio_files, \
-    dump_audio_files, SerializationError
+from quodlibet.formats import MusicFile, AudioFile, AudioFileError, \
+    load_audio_files, dump_audio_files, SerializationError, \
+    load_audio_files_from_file
 from quodlibet.query import Query
+from quodlibet.library.index import SearchIndex, SortKeyCache
+from quodlibet.library.watcher import MonitorWatcher, PollingWatcher
 from quodlibet.qltk.notif import Task
 from quodlibet.util.atomic import atomic_save
+from quodlibet.util.picklehelper import pickle_dumps, pickle_loads, \
+    PickleError
 from quodlibet.util.collection import Album
 from quodlibet.util.collections import DictMixin
 from quodlibet import util
 from quodlibet import formats
 from quodlibet.util.dprint import print_d, print_w
 from quodlibet.util.path import unexpand, mkdir, normalize_path, ishidden, \
-    ismount
+    ismount, mtime
 from quodlibet.compat import iteritems, iterkeys, itervalues, listkeys, \
     listvalues, listfilter
 
@@ -167,6 +179,13 @@ class Library(GObject.GObject, DictMixin):
         for item in items:
             content[item.key] = item
 
+    def _renamed(self, old_key):
+        """Called after an item previously stored under `old_key` got
+        a new key.
+        """
+
+        pass
+
     def add(self, items):
         """Add items. This causes an 'added' signal.
 
@@ -205,6 +224,113 @@ class Library(GObject.GObject, DictMixin):
         return items
 
 
+# Library files starting with this consist of a header record with the keys
+# of all items, followed by records of serialized items which can be loaded
+# independently. Older files are a single pickled list.
+_CHUNKED_MAGIC = b"QLLIBRARY1\n"
+
+_RECORD_HEADER = struct.calcsize("<I")
+
+
+def _read_records(fileobj):
+    """Yields the payload of each length prefixed record.
+
+    Stops at the first incomplete record (e.g. an interrupted append).
+    """
+
+    while True:
+        header = fileobj.read(_RECORD_HEADER)
+        if len(header) < _RECORD_HEADER:
+            break
+        size = struct.unpack("<I", header)[0]
+        data = fileobj.read(size)
+        if len(data) < size:
+            print_w("Ignoring truncated library record")
+            break
+        yield data
+
+
+def _write_record(fileobj, data):
+    fileobj.write(struct.pack("<I", len(data)))
+    fileobj.write(data)
+
+
+def _write_items(fileobj, items, chunk_size):
+    """Writes items in the chunked library file format, `chunk_size` items
+    per chunk.
+
+    Raises:
+        EnvironmentError, SerializationError
+    """
+
+    chunks = []
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        keys = [fsn2bytes(item.key, "utf-8") for item in chunk]
+        chunks.append((keys, dump_audio_files(chunk)))
+
+    fileobj.write(_CHUNKED_MAGIC)
+    _write_record(
+        fileobj, pickle_dumps([(k, len(d)) for k, d in chunks], 2))
+    for keys, data in chunks:
+        _write_record(fileobj, data)
+
+
+def _read_chunk_index(fileobj):
+    """Reads the header of a chunked library file.
+
+    Returns a list of (offset, size, keys) tuples for all chunks, or None
+    if it's a file in the old format, in which case the position of
+    `fileobj` is at the start again.
+
+    Raises:
+        EnvironmentError, SerializationError
+    """
+
+    if fileobj.read(len(_CHUNKED_MAGIC)) != _CHUNKED_MAGIC:
+        fileobj.seek(0)
+        return None
+
+    try:
+        header = pickle_loads(next(_read_records(fileobj)))
+        offset = fileobj.tell()
+        index = []
+        for keys, size in header:
+            offset += _RECORD_HEADER
+            index.append(
+                (offset, size, [bytes2fsn(k, "utf-8") for k in keys]))
+            offset += size
+    except (StopIteration, PickleError, TypeError, ValueError) as e:
+        raise SerializationError(e)
+    return index
+
+
+def _read_chunk(fileobj, offset, size):
+    """Returns the items of a chunk
+
+    Raises:
+        EnvironmentError, SerializationError
+    """
+
+    fileobj.seek(offset)
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise SerializationError("truncated library file")
+    return load_audio_files(data)
+
+
+def _load_index(filename):
+    """Returns the chunk index of a library file, or None if it doesn't
+    exist, is in the old format or is broken.
+    """
+
+    try:
+        with open(filename, "rb") as fileobj:
+            return _read_chunk_index(fileobj)
+    except (EnvironmentError, SerializationError):
+        return None
+
+
 def _load_items(filename):
     """Load items from disk.
 
@@ -212,15 +338,22 @@ def _load_items(filename):
     """
 
     try:
-        with open(filename, "rb") as fp:
-            data = fp.read()
+        fp = open(filename, "rb")
     except EnvironmentError:
         print_w("Couldn't load library file from: %r" % filename)
         return []
 
+    start = time.time()
     try:
-        items = load_audio_files(data)
-    except SerializationError:
+        with fp:
+            index = _read_chunk_index(fp)
+            if index is None:
+                items = load_audio_files_from_file(fp)
+            else:
+                items = []
+                for offset, size, keys in index:
+                    items.extend(_read_chunk(fp, offset, size))
+    except (SerializationError, EnvironmentError):
         # there are too many ways this could fail
         util.print_exc()
 
@@ -232,51 +365,361 @@ def _load_items(filename):
 
         return []
 
+    print_d("Loaded %d items in %.2f seconds" % (
+        len(items), time.time() - start))
+
     return items
 
 
+def get_journal_filename(filename):
+    """The path of the journal file belonging to a library file"""
+
+    return filename + fsnative(u".journal")
+
+
+def _base_stamp(filename):
+    """Identifies a specific version of the library file, so a journal
+    can't be replayed on top of a file it wasn't written for.
+    """
+
+    try:
+        stat = os.stat(filename)
+    except EnvironmentError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def _read_journal(filename):
+    """Reads the journal belonging to `filename`.
+
+    Returns a tuple of a dict of changed items by key and a set of removed
+    keys, or None in case there is no valid journal.
+    """
+
+    journal = get_journal_filename(filename)
+    try:
+        fileobj = open(journal, "rb")
+    except EnvironmentError:
+        return None
+
+    with fileobj:
+        records = _read_records(fileobj)
+        try:
+            stamp = tuple(pickle_loads(next(records)))
+        except (StopIteration, PickleError, TypeError):
+            print_w("Ignoring invalid library journal: %r" % journal)
+            return None
+
+        if stamp != _base_stamp(filename):
+            print_w("Ignoring outdated library journal: %r" % journal)
+            return None
+
+        all_changed = {}
+        all_removed = set()
+        count = 0
+        for data in records:
+            try:
+                removed, data = pickle_loads(data)
+                changed = load_audio_files(data) if data else []
+            except (PickleError, SerializationError, ValueError):
+                util.print_exc()
+                break
+            for key in removed:
+                all_changed.pop(key, None)
+                all_removed.add(key)
+            for item in changed:
+                all_changed[item.key] = item
+                all_removed.discard(item.key)
+            count += 1
+
+    print_d("Read %d journal records from %r" % (count, journal))
+    return all_changed, all_removed
+
+
+def _load_journal(filename, items):
+    """Applies the journal belonging to `filename` to the loaded items.
+
+    Returns the new item list or None in case there is no valid journal.
+    """
+
+    journal = _read_journal(filename)
+    if journal is None:
+        return None
+
+    changed, removed = journal
+    contents = dict((item.key, item) for item in items)
+    for key in removed:
+        contents.pop(key, None)
+    contents.update(changed)
+    return listvalues(contents)
+
+
 class PicklingMixin(object):
-    """A mixin to provide persistence of a library by pickling to disk"""
+    """A mixin to provide persistence of a library by pickling to disk
+
+    Once the library file is in sync with the library, changes to items
+    reported through `_journal_changed` and `_journal_removed` are
+    appended to a journal next to it on `save`, so saving only takes time
+    proportional to the number of changed items. The journal is compacted
+    by rewriting the library file once it gets too large.
+
+    The library file is written in chunks of items which can be loaded
+    independently. A lazy `load` only reads the keys of all items, the
+    items themselves get loaded on demand through `load_pending` or in the
+    background through `iter_load_pending`. Like a normal `load` this
+    doesn't cause any signals.
+    """
 
     filename = None
 
-    def load(self, filename):
-        """Load a library from a file, containing a picked list.
+    # rewrite the whole file if the journal is larger than this fraction of
+    # the library file
+    JOURNAL_COMPACT_RATIO = 0.5
+
+    CHUNK_SIZE = 1000
+    """Number of items per chunk in the library file"""
+
+    def __init__(self):
+        # key -> (offset, size) of the chunk, for items not loaded yet
+        self._pending = {}
+        # (offset, size) -> set of keys not loaded yet
+        self._pending_chunks = {}
+        # the library file version the chunks belong to
+        self._pending_stamp = None
+        self._journal_items = set()
+        self._journal_keys = set()
+        # if journaling is possible, requires that someone feeds us changes
+        self._journal_tracking = False
+        # if the library file + journal on disk match our content
+        self._journal_synced = False
+
+    def _journal_changed(self, items):
+        """Mark items as added or changed since the last save"""
+
+        self._journal_items.update(items)
+
+    def _journal_removed(self, keys):
+        """Mark item keys which might no longer be in the library"""
+
+        self._journal_keys.update(keys)
+
+    def _get_persisted(self, key):
+        """Returns the item which gets saved for key or None"""
+
+        return self._contents.get(key)
+
+    def load(self, filename, lazy=False):
+        """Load a library from a file.
 
         Loading does not cause added, changed, or removed signals.
+
+        If `lazy` is True only the keys get read from files in the chunked
+        format and the items get loaded later (see `load_pending`).
         """
 
         self.filename = filename
         print_d("Loading contents of %r." % filename, self)
 
-        items = _load_items(filename)
+        start = time.time()
+        self._pending.clear()
+        self._pending_chunks.clear()
+        index = _load_index(filename) if lazy else None
+        if index is None:
+            items = _load_items(filename)
+            journal_items = _load_journal(filename, items)
+            has_journal = journal_items is not None
+            if has_journal:
+                items = journal_items
+        else:
+            journal = _read_journal(filename)
+            has_journal = journal is not None
+            changed, removed = journal if has_journal else ({}, set())
+            # changed items are complete in the journal, no need to load
+            # them from the file
+            skip = removed.union(changed)
+            for offset, size, keys in index:
+                chunk = (offset, size)
+                keys = set(keys) - skip
+                if keys:
+                    self._pending_chunks[chunk] = keys
+                    for key in keys:
+                        self._pending[key] = chunk
+            self._pending_stamp = _base_stamp(filename)
+            items = listvalues(changed)
 
         # this loads all items without checking their validity, but makes
         # sure that non-mounted items are masked
         self._load_init(items)
 
-        print_d("Done loading contents of %r." % filename, self)
+        # only append to the journal if it was valid or doesn't exist yet,
+        # an empty library is cheap to save anyway
+        self._journal_items.clear()
+        self._journal_keys.clear()
+        self._journal_synced = bool(items or self._pending) and (
+            has_journal or
+            not os.path.exists(get_journal_filename(filename)))
+
+        print_d("Done loading contents of %r, %d items, %d pending "
+                "(%.2f seconds)." % (filename, len(items),
+                                     len(self._pending),
+                                     time.time() - start), self)
+
+    def has_pending(self):
+        """If there are items left to load after a lazy `load`"""
+
+        return bool(self._pending)
+
+    def _load_chunk(self, chunk):
+        keys = self._pending_chunks.pop(chunk)
+        for key in keys:
+            del self._pending[key]
+
+        try:
+            if _base_stamp(self.filename) != self._pending_stamp:
+                raise SerializationError("library file has changed")
+            with open(self.filename, "rb") as fileobj:
+                items = _read_chunk(fileobj, *chunk)
+        except (EnvironmentError, SerializationError):
+            util.print_exc()
+            print_w("Dropping %d items which couldn't be loaded" % (
+                len(self._pending) + len(keys)), self)
+            self._pending.clear()
+            self._pending_chunks.clear()
+            # the file doesn't represent our content anymore
+            self._journal_synced = False
+            return
+
+        self._load_init([i for i in items if i.key in keys])
+
+    def load_pending(self, key=None):
+        """Loads the pending item for `key` (and the others stored next to
+        it) or all pending items if `key` is None.
+
+        Loading does not cause added, changed, or removed signals.
+        """
+
+        if not self._pending:
+            return
+        elif key is None:
+            for chunk in list(self._pending_chunks.keys()):
+                if chunk in self._pending_chunks:
+                    self._load_chunk(chunk)
+        else:
+            chunk = self._pending.get(key)
+            if chunk is not None:
+                self._load_chunk(chunk)
+
+    def iter_load_pending(self, cofuncid=None):
+        """Like `load_pending` but loads one chunk per iteration, for
+        loading the items in the background with copool.
+        """
+
+        if not self._pending:
+            return
+
+        with Task(_("Library"), _("Loading songs")) as task:
+            if cofuncid:
+                task.copool(cofuncid, stop=False)
+            chunks = sorted(self._pending_chunks.keys())
+            for i, chunk in enumerate(chunks):
+                task.update(float(i) / len(chunks))
+                if chunk in self._pending_chunks:
+                    self._load_chunk(chunk)
+                    yield True
+
+    def _save_journal(self, filename):
+        """Appends all pending changes to the journal.
+
+        Returns False if the journal should be compacted instead.
+
+        Raises:
+            EnvironmentError
+        """
+
+        removed = [k for k in self._journal_keys
+                   if self._get_persisted(k) is None and
+                   k not in self._pending]
+        changed = [i for i in self._journal_items
+                   if self._get_persisted(i.key) is i]
+
+        print_d("Journaling %d changed and %d removed items." % (
+            len(changed), len(removed)), self)
+
+        record = pickle_dumps(
+            (removed, dump_audio_files(changed) if changed else b""), 2)
+
+        journal = get_journal_filename(filename)
+        try:
+            journal_size = os.path.getsize(journal)
+        except EnvironmentError:
+            journal_size = 0
+
+        base_size = os.path.getsize(filename)
+        if journal_size + len(record) > base_size * self.JOURNAL_COMPACT_RATIO:
+            return False
+
+        with open(journal, "ab") as fileobj:
+            if not journal_size:
+                _write_record(
+                    fileobj, pickle_dumps(_base_stamp(filename), 2))
+            _write_record(fileobj, record)
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+
+        return True
 
     def save(self, filename=None):
         """Save the library to the given filename, or the default if `None`"""
 
         if filename is None:
             filename = self.filename
+        is_default = (filename == self.filename)
+
+        if is_default and self._journal_tracking and self._journal_synced:
+            try:
+                done = self._save_journal(filename)
+            except (EnvironmentError, PickleError, SerializationError):
+                util.print_exc()
+                done = False
+            if done:
+                self._journal_items.clear()
+                self._journal_keys.clear()
+                self.dirty = False
+                return
 
         print_d("Saving contents to %r." % filename, self)
 
+        self.load_pending()
         try:
             dirname = os.path.dirname(filename)
             mkdir(dirname)
+            # sorted, so songs of the same folder end up in the same chunk
+            items = sorted(self.get_content(), key=lambda i: i.key)
             with atomic_save(filename, "wb") as fileobj:
-                fileobj.write(dump_audio_files(self.get_content()))
+                _write_items(fileobj, items, self.CHUNK_SIZE)
                 # unhandled SerializationError, shouldn't happen -> better
                 # not replace the library file with nothing
+            if is_default:
+                journal = get_journal_filename(filename)
+                if os.path.exists(journal):
+                    os.remove(journal)
         except EnvironmentError:
             print_w("Couldn't save library to path: %r" % filename)
         else:
+            if is_default:
+                self._journal_items.clear()
+                self._journal_keys.clear()
+                self._journal_synced = True
             self.dirty = False
 
+    def get_save_mtime(self):
+        """The last time the library was saved, or 0"""
+
+        filename = self.filename
+        if filename is None:
+            return 0
+        return max(mtime(filename), mtime(get_journal_filename(filename)))
+
 
 class PicklingLibrary(Library, PicklingMixin):
     """A library that pickles its contents to disk"""
@@ -285,6 +728,85 @@ class PicklingLibrary(Library, PicklingMixin):
         PicklingMixin.__init__(self)
         Library.__init__(self, name)
 
+        self._journal_tracking = True
+        self.connect("added", self.__journal_changed)
+        self.connect("changed", self.__journal_changed)
+        self.connect("removed", self.__journal_removed)
+
+    def __journal_changed(self, library, items):
+        self._journal_changed(items)
+
+    def __journal_removed(self, library, items):
+        self._journal_removed(item.key for item in items)
+
+    def _renamed(self, old_key):
+        self._journal_removed([old_key])
+
+    def destroy(self):
+        self._pending.clear()
+        self._pending_chunks.clear()
+        super(PicklingLibrary, self).destroy()
+
+    # everything iterating over the library or depending on its size
+    # needs all items, so load the pending ones first
+
+    def __iter__(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).__iter__()
+
+    def __len__(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).__len__()
+
+    def __bool__(self):
+        return bool(self._contents or self._pending)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, self._name)
+
+    def iteritems(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).iteritems()
+
+    def iterkeys(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).iterkeys()
+
+    def itervalues(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).itervalues()
+
+    def keys(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).keys()
+
+    def values(self):
+        self.load_pending()
+        return super(PicklingLibrary, self).values()
+
+    def __getitem__(self, key):
+        try:
+            return self._contents[key]
+        except KeyError:
+            if key not in self._pending:
+                raise
+        self.load_pending(key)
+        return self._contents[key]
+
+    def __contains__(self, item):
+        if super(PicklingLibrary, self).__contains__(item):
+            return True
+        key = getattr(item, "key", item)
+        try:
+            if key not in self._pending:
+                return False
+        except TypeError:
+            return False
+        self.load_pending(key)
+        return super(PicklingLibrary, self).__contains__(item)
+
 
 class AlbumLibrary(Library):
     """An AlbumLibrary listens to a SongLibrary and sorts its songs into
@@ -302,6 +824,8 @@ class AlbumLibrary(Library):
             "AlbumLibrary for %s" % library._name)
 
         self._library = library
+        # song -> album
+        self._albums = {}
         self._asig = library.connect('added', self.__added)
         self._rsig = library.connect('removed', self.__removed)
         self._csig = library.connect('changed', self.__changed)
@@ -319,27 +843,44 @@ class AlbumLibrary(Library):
         return self._contents.get(item)
 
     def __add(self, items):
-        changed = set()
         new = set()
+        contents = self._contents
+        albums = self._albums
+        # album -> added songs
+        added = {}
         for song in items:
             key = song.album_key
-            if key in self._contents:
-                changed.add(self._contents[key])
-            else:
+            album = contents.get(key)
+            if album is None:
                 album = Album(song)
-                self._contents[key] = album
+                contents[key] = album
                 new.add(album)
-            self._contents[key].songs.add(song)
+            added.setdefault(album, []).append(song)
+            albums[song] = album
 
-        changed -= new
+        for album, songs in iteritems(added):
+            album.add_songs(songs)
+
+        changed = set(added) - new
         return changed, new
 
+    def __remove(self, items):
+        """Removes the songs from their albums and returns the changed
+        albums"""
+
+        albums = self._albums
+        # album -> removed songs
+        removed = {}
+        for song in items:
+            removed.setdefault(albums.pop(song), []).append(song)
+
+        for album, songs in iteritems(removed):
+            album.remove_songs(songs)
+        return set(removed)
+
     def __added(self, library, items, signal=True):
         changed, new = self.__add(items)
 
-        for album in changed:
-            album.finalize()
-
         if signal:
             if new:
                 self.emit('added', new)
@@ -347,62 +888,63 @@ class AlbumLibrary(Library):
                 self.emit('changed', changed)
 
     def __removed(self, library, items):
-        changed = set()
+        changed = self.__remove(items)
         removed = set()
-        for song in items:
-            key = song.album_key
-            album = self._contents[key]
-            album.songs.remove(song)
-            changed.add(album)
+        for album in changed:
             if not album.songs:
                 removed.add(album)
-                del self._contents[key]
+                del self._contents[album.key]
 
         changed -= removed
 
-        for album in changed:
-            album.finalize()
-
         if removed:
             self.emit('removed', removed)
         if changed:
             self.emit('changed', changed)
 
     def __changed(self, library, items):
-        """Album keys could change between already existing ones.. so we
-        have to do it the hard way and search by id."""
+        """Album keys could change between already existing ones, so
+        look up the current album of each song and move it if needed."""
         print_d("Updating affected albums for %d items" % len(items))
-        changed = set()
-        removed = set()
         to_add = []
+        to_remove = []
+        contents = self._contents
+        albums = self._albums
+        # album -> changed songs staying in it
+        kept = {}
         for song in items:
+            album = albums.get(song)
             # in case the key hasn't changed
-            key = song.album_key
-            if key in self._contents and song in self._contents[key].songs:
-                changed.add(self._contents[key])
-            else:  # key changed.. look for it in each album
-                to_add.append(song)
-                for key, album in iteritems(self._contents):
-                    if song in album.songs:
-                        album.songs.remove(song)
-                        if not album.songs:
-                            removed.add(album)
-                        else:
-                            changed.add(album)
-                        break
+            if album is not None and contents.get(song.album_key) is album:
+                kept.setdefault(album, []).append(song)
+                continue
+
+            to_add.append(song)
+            if album is not None:
+                to_remove.append(song)
+
+        for album, songs in iteritems(kept):
+            album.songs_changed(songs)
+        changed = set(kept)
+
+        removed = set()
+        for album in self.__remove(to_remove):
+            if not album.songs:
+                removed.add(album)
+            else:
+                changed.add(album)
 
         # get new albums and changed ones because keys could have changed
         add_changed, new = self.__add(to_add)
         changed |= add_changed
 
         # check if albums that were empty at some point are still empty
-        for album in removed:
+        for album in list(removed):
             if not album.songs:
                 del self._contents[album.key]
                 changed.discard(album)
-
-        for album in changed:
-            album.finalize()
+            else:
+                removed.discard(album)
 
         if removed:
             self.emit("removed", removed)
@@ -419,17 +961,38 @@ class SongLibrary(PicklingLibrary):
     interface.
     """
 
+    index = None
+    """A `SearchIndex` used to speed up queries or None,
+    see `enable_index()`"""
+
+    sort_keys = None
+    """A `SortKeyCache` used to speed up sorting by text tags"""
+
     def __init__(self, *args, **kwargs):
         super(SongLibrary, self).__init__(*args, **kwargs)
+        self.sort_keys = SortKeyCache(self)
 
     @util.cached_property
     def albums(self):
         return AlbumLibrary(self)
 
+    def enable_index(self):
+        """Maintain an inverted index of tag values from now on, which
+        `filter_query` and `query` use to narrow down the songs which
+        have to be searched.
+        """
+
+        if self.index is None:
+            self.index = SearchIndex(self)
+
     def destroy(self):
         super(SongLibrary, self).destroy()
         if "albums" in self.__dict__:
             self.albums.destroy()
+        if self.index is not None:
+            self.index.destroy()
+            self.index = None
+        self.sort_keys.destroy()
 
     def tag_values(self, tag):
         """Return a set of all values for the given tag."""
@@ -449,9 +1012,11 @@ class SongLibrary(PicklingLibrary):
         method. Instead, use the librarian.
         """
         print_d("Renaming %r to %r" % (song.key, newname), self)
+        old_key = song.key
         del(self._contents[song.key])
         song.rename(newname)
         self._contents[song.key] = song
+        self._renamed(old_key)
         if changed is not None:
             print_d("%s: Delaying changed signal." % (type(self).__name__,))
             changed.add(song)
@@ -465,9 +1030,86 @@ class SongLibrary(PicklingLibrary):
 
         songs = self.values()
         if text != "":
-            songs = listfilter(Query(text, star).search, songs)
+            songs = self.filter_query(Query(text, star))
         return songs
 
+    def filter_query(self, query):
+        """Returns a list of all songs matching the Query"""
+
+        songs = self.values()
+        if self.index is not None:
+            candidates = query.candidates(self.index)
+            if candidates is not None:
+                songs = candidates
+        return listfilter(query.search, songs)
+
+
+class _MtimeChecker(object):
+    """Checks the validity of many items like `item.valid()` would, but
+    lists each directory once instead of looking at each file separately.
+
+    If `dir_mtimes` is given, directories with the same modification
+    time as in there are skipped and all items in them are considered
+    valid. The mtimes of checked directories get stored in it.
+    """
+
+    def __init__(self, dir_mtimes=None):
+        self._dir_mtimes = dir_mtimes
+        # dirname -> {basename: DirEntry} or None if skipped
+        self._dirs = {}
+        self.checked = 0
+        self.skipped = 0
+        self.dirs_checked = 0
+        self.dirs_skipped = 0
+
+    def _get_entries(self, dirname):
+        try:
+            return self._dirs[dirname]
+        except KeyError:
+            pass
+
+        dir_mtimes = self._dir_mtimes
+        dir_mtime = mtime(dirname)
+        if dir_mtimes is not None and dir_mtime and \
+                dir_mtimes.get(dirname) == dir_mtime:
+            entries = None
+            self.dirs_skipped += 1
+        else:
+            try:
+                entries = dict((e.name, e) for e in os.scandir(dirname))
+            except OSError:
+                entries = {}
+            if dir_mtimes is not None and dir_mtime:
+                dir_mtimes[dirname] = dir_mtime
+            self.dirs_checked += 1
+
+        self._dirs[dirname] = entries
+        return entries
+
+    def valid(self, item):
+        if not hasattr(os, "scandir") or \
+                not isinstance(item, AudioFile) or \
+                type(item).valid != AudioFile.valid:
+            self.checked += 1
+            return item.valid()
+
+        dirname, basename = os.path.split(item["~filename"])
+        entries = self._get_entries(dirname)
+        if entries is None:
+            self.skipped += 1
+            return True
+
+        self.checked += 1
+        file_mtime = 0
+        entry = entries.get(basename)
+        if entry is not None:
+            try:
+                file_mtime = entry.stat().st_mtime
+            except OSError:
+                pass
+        return (bool(item.get("~#mtime", 0)) and
+                item["~#mtime"] == file_mtime)
+
 
 def iter_paths(root, exclude=[], skip_hidden=True):
     """yields paths contained in root (symlinks dereferenced)
@@ -520,9 +1162,19 @@ class FileLibrary(PicklingLibrary):
     and have a mountpoint attribute.
     """
 
+    scan_threads = 0
+    """Number of threads used for loading new files while scanning,
+    0 loads them in the main loop"""
+
+    skip_unchanged_dirs = False
+    """Skip items in directories which haven't changed since the last
+    rebuild. Files which were modified in place won't get reloaded."""
+
     def __init__(self, name=None):
         super(FileLibrary, self).__init__(name)
         self._masked = {}
+        # dirname -> mtime of the directory on the last rebuild
+        self._dir_mtimes = {}
 
     def _load_init(self, items):
         """Add many items to the library, check if the
@@ -558,6 +1210,14 @@ class FileLibrary(PicklingLibrary):
             else:
                 masked[mountpoint][item.key] = item
 
+    def _get_persisted(self, key):
+        item = self._contents.get(key)
+        if item is None:
+            for items in itervalues(self._masked):
+                if key in items:
+                    return items[key]
+        return item
+
     def _load_item(self, item, force=False):
         """Add an item, or refresh it if it's already in the library.
         No signals will be fired.
@@ -647,6 +1307,9 @@ class FileLibrary(PicklingLibrary):
 
         print_d("Rebuilding, force is %s." % force, self)
 
+        for x in self.iter_load_pending(cofuncid):
+            yield x
+
         task = Task(_("Library"), _("Checking mount points"))
         if cofuncid:
             task.copool(cofuncid)
@@ -661,8 +1324,10 @@ class FileLibrary(PicklingLibrary):
         if cofuncid:
             task.copool(cofuncid)
         changed, removed = set(), set()
+        dir_mtimes = self._dir_mtimes if self.skip_unchanged_dirs else None
+        checker = _MtimeChecker(dir_mtimes)
         for i, (key, item) in task.list(enumerate(sorted(self.items()))):
-            if key in self._contents and force or not item.valid():
+            if key in self._contents and force or not checker.valid(item):
                 self.reload(item, changed, removed)
                 # These numbers are pretty empirical. We should yield more
             # often than we emit signals; that way the main loop stays
@@ -675,6 +1340,10 @@ class FileLibrary(PicklingLibrary):
                 removed = set()
             if len(changed) > 5 or i % 100 == 0:
                 yield True
+        print_d("Checked %d files in %d directories, skipped %d files in %d "
+                "unchanged directories." % (
+                    checker.checked, checker.dirs_checked,
+                    checker.skipped, checker.dirs_skipped), self)
         print_d("Removing %d, changing %d." % (len(removed), len(changed)),
                 self)
         if removed:
@@ -693,6 +1362,15 @@ class FileLibrary(PicklingLibrary):
 
         raise NotImplementedError
 
+    def _load_file(self, filename):
+        """Returns a new item for the file or None if it can't be loaded.
+
+        This gets called in worker threads by `_load_threaded` and must not
+        access the library.
+        """
+
+        raise NotImplementedError
+
     def contains_filename(self, filename):
         """Returns if a song for the passed filename is in the library.
 
@@ -746,22 +1424,75 @@ class FileLibrary(PicklingLibrary):
             if cofuncid:
                 task.copool(cofuncid)
 
+            if self.scan_threads > 0:
+                loaded = self._load_threaded(paths_to_load, task)
+            else:
+                loaded = (self.add_filename(real_path, False)
+                          for real_path in task.gen(paths_to_load))
+
             added = []
-            for real_path in task.gen(paths_to_load):
-                item = self.add_filename(real_path, False)
+            for item in loaded:
                 if item is not None:
                     added.append(item)
                     if len(added) > 100 or need_added():
                         self.add(added)
                         added = []
                         yield
-                if added and need_yield():
+                if need_yield():
                     yield
             if added:
                 self.add(added)
                 added = []
                 yield True
 
+    def _load_threaded(self, filenames, task):
+        """Like calling `add_filename(filename, False)` for each filename,
+        but loads them in a pool of `scan_threads` threads.
+
+        The threads only create the items, checking them against the
+        library contents happens here when the results get yielded.
+        Yields the results in order and None in between if the next one
+        isn't ready yet, so the main loop doesn't get blocked.
+        """
+
+        total = len(filenames)
+        filenames = iter(filenames)
+        # keep the threads busy, but don't load everything at once
+        max_pending = self.scan_threads * 4
+        pending = deque()
+        done = 0
+
+        pool = futures.ThreadPoolExecutor(self.scan_threads)
+        try:
+            while True:
+                while len(pending) < max_pending:
+                    try:
+                        filename = next(filenames)
+                    except StopIteration:
+                        break
+                    pending.append(pool.submit(self._load_file, filename))
+
+                if not pending:
+                    break
+
+                try:
+                    item = pending[0].result(timeout=0.015)
+                except futures.TimeoutError:
+                    yield None
+                    continue
+
+                pending.popleft()
+                done += 1
+                task.update(float(done) / total)
+                if item is not None:
+                    # it might have been added in the meantime
+                    item = self._contents.get(item.key, item)
+                yield item
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
     def get_content(self):
         """Return visible and masked items"""
 
@@ -830,9 +1561,72 @@ class SongFileLibrary(SongLibrary, FileLibrary):
         print_d("Initializing SongFileLibrary \"%s\"." % name)
         super(SongFileLibrary, self).__init__(name)
 
+    watcher = None
+    """A `library.watcher.LibraryWatcher` if enabled, see `watch()`"""
+
+    def watch(self, paths, exclude=[], poll_interval=None):
+        """Apply changes to files below `paths` to the library from now on.
+
+        By default file monitors are used, if `poll_interval` is given the
+        directories get compared every `poll_interval` seconds instead.
+        """
+
+        self.unwatch()
+        if poll_interval is None:
+            self.watcher = MonitorWatcher(self, paths, exclude)
+        else:
+            self.watcher = PollingWatcher(
+                self, paths, exclude, poll_interval)
+
+    def unwatch(self):
+        """Stop applying changes to files"""
+
+        if self.watcher is not None:
+            self.watcher.destroy()
+            self.watcher = None
+
+    def destroy(self):
+        self.unwatch()
+        super(SongFileLibrary, self).destroy()
+
+    def moved(self, song, filename, changed=None, removed=None):
+        """Update the song after its file was moved to `filename`, without
+        touching the file.
+
+        A different song already in the library for `filename` gets
+        removed. The 'changed' and 'removed' signals may fire for this
+        library or the songs are added to the passed changed/removed
+        set()s.
+        """
+
+        print_d("Moved %r to %r" % (song.key, filename), self)
+        old_key = song.key
+        del(self._contents[old_key])
+        song.sanitize(filename)
+        other = self._contents.get(song.key)
+        if other is not None and other is not song:
+            print_d("Replacing %r" % other.key, self)
+            if removed is None:
+                self.remove([other])
+            else:
+                del(self._contents[other.key])
+                self.dirty = True
+                removed.add(other)
+                if changed is not None:
+                    changed.discard(other)
+        self._contents[song.key] = song
+        self._renamed(old_key)
+        if changed is not None:
+            changed.add(song)
+        else:
+            self.changed({song})
+
     def contains_filename(self, filename):
         key = normalize_path(filename, True)
-        return key in self._contents
+        return key in self
+
+    def _load_file(self, filename):
+        return MusicFile(filename)
 
     def add_filename(self, filename, add=True):
         """Add a song to the library based on filename.
@@ -850,7 +1644,7 @@ class SongFileLibrary(SongLibrary, FileLibrary):
         key = normalize_path(filename, True)
         song = None
         if key not in self._contents:
-            song = MusicFile(filename)
+            song = self._load_file(filename)
             if song and add:
                 self.add([song])
         else:
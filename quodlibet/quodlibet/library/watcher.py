@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation
+
+"""Keeps a library up to date with changes in the file system.
+
+The watchers collect created, changed, deleted and moved paths and apply
+them to the library in one batch once things have calmed down. Instead of
+replaying single events, the batch checks the current state of all paths
+involved, which makes the order and duplicates of events irrelevant.
+"""
+
+import os
+import time
+
+from gi.repository import GLib, Gio
+
+from quodlibet import formats
+from quodlibet.util import copool
+from quodlibet.util.dprint import print_d, print_w
+from quodlibet.util.path import ishidden, mtime, normalize_path
+from quodlibet.compat import iteritems
+
+
+def _is_below(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class LibraryWatcher(object):
+    """Base class for applying file system changes below `paths` to a
+    SongFileLibrary.
+
+    Subclasses feed in changes with `_queue_changed`, `_queue_deleted` and
+    `_queue_moved`, which get applied in the background through copool
+    `DELAY` milliseconds after the last one, or right away when calling
+    `flush`.
+    """
+
+    DELAY = 1000
+
+    YIELD_TIME = 0.015
+    """Seconds after which applying changes gives control back to the main
+    loop"""
+
+    def __init__(self, library, paths, exclude=[]):
+        self._library = library
+        self._roots = [os.path.realpath(p) for p in paths]
+        self._exclude = list(exclude)
+        self._changed = set()
+        self._deleted = set()
+        self._moved = []
+        self._flush_id = None
+        # (paths, moves) waiting to be applied in order
+        self._batches = []
+        # the generator applying the batches while running in copool
+        self._applying = None
+
+    def destroy(self):
+        """Stop watching, queued changes get discarded"""
+
+        if self._flush_id is not None:
+            GLib.source_remove(self._flush_id)
+            self._flush_id = None
+        if self._applying is not None:
+            copool.remove(self)
+            self._applying = None
+        self._changed.clear()
+        self._deleted.clear()
+        del self._moved[:]
+        del self._batches[:]
+
+    def is_watched(self, path):
+        """If changes to the path should be applied"""
+
+        if not any(_is_below(path, root) for root in self._roots):
+            return False
+        if any(_is_below(path, p) for p in self._exclude):
+            return False
+        while not any(path == root for root in self._roots):
+            if ishidden(path):
+                return False
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return True
+
+    def _walk(self, path):
+        """Yields all watched directories below and including path"""
+
+        for dirpath, dnames, fnames in os.walk(path):
+            dnames[:] = [d for d in dnames
+                         if self.is_watched(os.path.join(dirpath, d))]
+            yield dirpath, fnames
+
+    def _iter_files(self, path):
+        """Yields all watched files below path"""
+
+        for dirpath, fnames in self._walk(path):
+            for fname in fnames:
+                filename = os.path.join(dirpath, fname)
+                if self.is_watched(filename):
+                    yield filename
+
+    def _queue_changed(self, path):
+        """A file or directory was created or changed"""
+
+        self._changed.add(path)
+        self._schedule()
+
+    def _queue_deleted(self, path):
+        """A file or directory was deleted"""
+
+        self._deleted.add(path)
+        self._schedule()
+
+    def _queue_moved(self, old, new):
+        """A file or directory was moved"""
+
+        self._moved.append((old, new))
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_id is not None:
+            GLib.source_remove(self._flush_id)
+        self._flush_id = GLib.timeout_add(self.DELAY, self.__flush_timeout)
+
+    def __flush_timeout(self):
+        self._flush_id = None
+        self._take_batch()
+        if self._applying is None:
+            self._applying = self._iter_apply()
+            copool.add(self.__apply_routine, funcid=self)
+        return False
+
+    def __apply_routine(self):
+        for x in self._applying:
+            yield x
+        self._applying = None
+
+    def _take_batch(self):
+        """Moves all queued changes into a new batch"""
+
+        if self._flush_id is not None:
+            GLib.source_remove(self._flush_id)
+            self._flush_id = None
+
+        if self._changed or self._deleted or self._moved:
+            self._batches.append(
+                (self._changed | self._deleted, list(self._moved)))
+            self._changed.clear()
+            self._deleted.clear()
+            del self._moved[:]
+
+    def _iter_apply(self):
+        while self._batches:
+            paths, moved = self._batches.pop(0)
+            for x in self._apply(paths, moved):
+                yield x
+
+    def _get_songs(self, paths):
+        """Returns a set of all songs in the library for the files or
+        below the directories.
+        """
+
+        library = self._library
+        songs = set()
+        prefixes = []
+        for path in paths:
+            key = normalize_path(path, True)
+            song = library.get(key)
+            if song is not None:
+                songs.add(song)
+            elif not os.path.isfile(path):
+                prefixes.append(key.rstrip(os.sep) + os.sep)
+
+        if prefixes:
+            prefixes = tuple(prefixes)
+            # songs not loaded yet could be anywhere below
+            library.load_pending()
+            for key, song in iteritems(library._contents):
+                if key.startswith(prefixes):
+                    songs.add(song)
+        return songs
+
+    def flush(self):
+        """Apply all queued changes to the library now"""
+
+        self._take_batch()
+        if self._applying is not None:
+            # finish what is running in the background first
+            copool.remove(self)
+            applying, self._applying = self._applying, None
+            for x in applying:
+                pass
+        for x in self._iter_apply():
+            pass
+
+    def _apply(self, paths, moved):
+        """Applies a batch of changes to the library, yields from time to
+        time so the main loop doesn't get blocked.
+        """
+
+        def need_yield(last_yield=[time.time()]):
+            current = time.time()
+            if abs(current - last_yield[0]) > self.YIELD_TIME:
+                last_yield[0] = current
+                return True
+            return False
+
+        library = self._library
+        changed, removed = set(), set()
+
+        # keep the songs and their stats if possible
+        for old, new in moved:
+            paths.update([old, new])
+            if not self.is_watched(new):
+                continue
+            old_prefix = normalize_path(old, True)
+            for song in self._get_songs([old]):
+                filename = new + song.key[len(old_prefix):]
+                if os.path.isfile(filename) and formats.filter(filename):
+                    library.moved(song, filename, changed, removed)
+                if need_yield():
+                    yield
+
+        for song in self._get_songs(paths):
+            # the library might have changed in the meantime
+            if song not in changed and song not in removed and \
+                    song in library and not song.valid():
+                library.reload(song, changed, removed)
+            if need_yield():
+                yield
+
+        new_files = set()
+        for path in paths:
+            if not self.is_watched(path):
+                continue
+            if os.path.isdir(path):
+                for filename in self._iter_files(path):
+                    new_files.add(filename)
+                    if need_yield():
+                        yield
+            elif os.path.isfile(path):
+                new_files.add(path)
+
+        added = []
+        for filename in sorted(new_files):
+            if formats.filter(filename) and \
+                    not library.contains_filename(filename):
+                song = library.add_filename(filename, False)
+                if song is not None:
+                    added.append(song)
+            if need_yield():
+                yield
+
+        changed = {song for song in changed if song in library}
+        print_d("Adding %d, removing %d, changing %d." % (
+            len(added), len(removed), len(changed)), self)
+        if removed:
+            library.emit('removed', removed)
+        if changed:
+            library.emit('changed', changed)
+        if added:
+            library.add(added)
+
+
+class PollingWatcher(LibraryWatcher):
+    """Finds changes by comparing file mtimes every `interval` seconds.
+
+    Moves are seen as a delete and a create. This needs to look at every
+    file, so it's mainly useful for testing.
+    """
+
+    def __init__(self, library, paths, exclude=[], interval=None):
+        super(PollingWatcher, self).__init__(library, paths, exclude)
+        self._mtimes = self._get_mtimes()
+        self._poll_id = None
+        if interval is not None:
+            self._poll_id = GLib.timeout_add_seconds(
+                interval, self.__poll_timeout)
+
+    def destroy(self):
+        if self._poll_id is not None:
+            GLib.source_remove(self._poll_id)
+            self._poll_id = None
+        super(PollingWatcher, self).destroy()
+
+    def _get_mtimes(self):
+        mtimes = {}
+        for root in self._roots:
+            for filename in self._iter_files(root):
+                mtimes[filename] = mtime(filename)
+        return mtimes
+
+    def __poll_timeout(self):
+        self.poll()
+        return True
+
+    def poll(self):
+        """Queue all changes since the last poll"""
+
+        old = self._mtimes
+        new = self._get_mtimes()
+        for filename, value in iteritems(new):
+            if old.get(filename) != value:
+                self._queue_changed(filename)
+        for filename in old:
+            if filename not in new:
+                self._queue_deleted(filename)
+        self._mtimes = new
+
+
+class MonitorWatcher(LibraryWatcher):
+    """Uses a Gio.FileMonitor for each directory, which on Linux is backed
+    by inotify.
+    """
+
+    def __init__(self, library, paths, exclude=[]):
+        super(MonitorWatcher, self).__init__(library, paths, exclude)
+        # path -> (monitor, signal id)
+        self._monitors = {}
+        for root in self._roots:
+            self._watch_tree(root)
+
+    def destroy(self):
+        for path in list(self._monitors.keys()):
+            self._unwatch(path)
+        super(MonitorWatcher, self).destroy()
+
+    def _watch_tree(self, path):
+        for dirpath, fnames in self._walk(path):
+            self._watch(dirpath)
+
+    def _watch(self, path):
+        if path in self._monitors:
+            return
+
+        flags = getattr(Gio.FileMonitorFlags, "WATCH_MOVES", None)
+        if flags is None:
+            flags = Gio.FileMonitorFlags.SEND_MOVED
+        try:
+            monitor = Gio.File.new_for_path(path).monitor_directory(
+                flags, None)
+        except GLib.GError as e:
+            print_w("Can't watch %r: %s" % (path, e))
+            return
+
+        id_ = monitor.connect("changed", self.__changed)
+        self._monitors[path] = (monitor, id_)
+
+    def _unwatch(self, path):
+        """Stop watching path and all directories below"""
+
+        for other in list(self._monitors.keys()):
+            if _is_below(other, path):
+                monitor, id_ = self._monitors.pop(other)
+                monitor.disconnect(id_)
+                monitor.cancel()
+
+    def _file_moved(self, path, new):
+        self._unwatch(path)
+        if new is not None and self.is_watched(new) and os.path.isdir(new):
+            self._watch_tree(new)
+
+        if not self.is_watched(path):
+            # e.g. a temporary file replacing the real one
+            if new is not None and self.is_watched(new):
+                self._queue_changed(new)
+        elif new is None:
+            self._queue_deleted(path)
+        else:
+            self._queue_moved(path, new)
+
+    def __changed(self, monitor, main_file, other_file, event_type):
+        Event = Gio.FileMonitorEvent
+        path = main_file.get_path()
+        if path is None:
+            return
+
+        other = other_file and other_file.get_path()
+
+        if event_type in (Event.MOVED, getattr(Event, "RENAMED", None)):
+            self._file_moved(path, other)
+            return
+
+        if not self.is_watched(path):
+            return
+
+        if event_type == getattr(Event, "MOVED_IN", None) and \
+                other is not None and self.is_watched(other):
+            # the source directory gets MOVED_OUT which handles it
+            return
+        elif event_type == getattr(Event, "MOVED_OUT", None) and \
+                other is not None and self.is_watched(other):
+            # moved between two watched directories, keep the songs
+            self._file_moved(path, other)
+            return
+
+        if event_type in (Event.CREATED, Event.CHANGES_DONE_HINT,
+                          getattr(Event, "MOVED_IN", None)):
+            if os.path.isdir(path):
+                self._watch_tree(path)
+            self._queue_changed(path)
+        elif event_type in (Event.DELETED,
+                            getattr(Event, "MOVED_OUT", None)):
+            self._unwatch(path)
+            self._queue_deleted(path)
@@ -54,7 +54,16 @@ def main(argv=None):
     print_d("Initializing main library (%s)" % (
             quodlibet.util.path.unexpand(library_path)))
 
-    library = quodlibet.library.init(library_path)
+    library = quodlibet.library.init(
+        library_path, lazy=config.getboolean("library", "lazy_load"))
+    if config.getboolean("library", "search_index"):
+        library.enable_index()
+    library.scan_threads = config.getint("library", "scan_threads")
+    library.skip_unchanged_dirs = config.getboolean(
+        "library", "skip_unchanged_dirs")
+    if config.getboolean("library", "watch"):
+        from quodlibet.util.library import get_scan_dirs, get_exclude_dirs
+        library.watch(get_scan_dirs(), get_exclude_dirs())
     app.library = library
 
     # this assumes that nullbe will always succeed
@@ -207,6 +216,7 @@ def main(argv=None):
     fsiface.destroy()
 
     tracker.destroy()
+    library.unwatch()
     quodlibet.library.save()
 
     config.save()
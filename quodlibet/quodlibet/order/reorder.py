@@ -6,10 +6,11 @@
 # published by the Free Software Foundation
 
 import random
+import weakref
 
 from quodlibet import _
+from quodlibet import app
 from quodlibet.order import Order, OrderRemembered
-from quodlibet.compat import iteritems
 
 
 class Reorder(Order):
@@ -34,24 +35,190 @@ class OrderShuffle(Reorder, OrderRemembered):
         return None
 
 
+class _WeightTree(object):
+    """A Fenwick tree over non-negative weights which allows changing a
+    weight and finding the position for a point in the cumulative weights
+    in O(log n).
+    """
+
+    def __init__(self, weights):
+        self._weights = list(weights)
+        n = len(self._weights)
+        tree = [0.0] + self._weights
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+        self._total = sum(self._weights)
+
+    def __len__(self):
+        return len(self._weights)
+
+    @property
+    def total(self):
+        """The sum of all weights"""
+
+        return self._total
+
+    def get(self, index):
+        return self._weights[index]
+
+    def set(self, index, weight):
+        diff = weight - self._weights[index]
+        if not diff:
+            return
+        self._weights[index] = weight
+        self._total += diff
+        tree = self._tree
+        i = index + 1
+        while i < len(tree):
+            tree[i] += diff
+            i += i & -i
+
+    def find(self, value):
+        """Returns the index of the first non-zero weight where the sum of
+        all weights up to and including it is larger than `value`, or None
+        if there is none.
+        """
+
+        tree = self._tree
+        n = len(self._weights)
+        pos = 0
+        mask = 1 << n.bit_length()
+        while mask:
+            next_ = pos + mask
+            if next_ <= n and tree[next_] <= value:
+                pos = next_
+                value -= tree[next_]
+            mask >>= 1
+
+        # rounding errors can point past the end or to a zero weight
+        weights = self._weights
+        while pos < n and not weights[pos] > 0:
+            pos += 1
+        if pos >= n:
+            pos = n - 1
+            while pos >= 0 and not weights[pos] > 0:
+                pos -= 1
+        return pos if pos >= 0 else None
+
+
 class OrderWeighted(Reorder, OrderRemembered):
+    """Prefers songs with a higher rating.
+
+    The ratings of all remaining songs are kept in a `_WeightTree` so
+    picking the next song doesn't have to look at the whole playlist. It
+    gets built on first use after the playlist changed and is then updated
+    for played songs and rating changes.
+    """
+
     name = "weighted"
     display_name = _("Prefer higher rated")
     accelerated_name = _("Prefer higher rated")
 
+    def __init__(self):
+        super(OrderWeighted, self).__init__()
+        self._weights = None
+        # remaining songs for choosing one if all have no weight
+        self._counts = None
+        # song -> list of playlist indices
+        self._indices = None
+        self._sig = None
+
+    def _build(self, playlist):
+        songs = playlist.get()
+        played = set(self._played)
+        self._weights = _WeightTree(
+            0.0 if i in played else s("~#rating")
+            for i, s in enumerate(songs))
+        self._counts = _WeightTree(
+            0.0 if i in played else 1.0 for i in range(len(songs)))
+        indices = self._indices = {}
+        for i, song in enumerate(songs):
+            indices.setdefault(song, []).append(i)
+        self._connect()
+
+    def _connect(self):
+        if self._sig is not None or app.library is None:
+            return
+        librarian = app.library.librarian
+        if librarian is None:
+            return
+
+        # only weakly reference the order, so it can go away without
+        # anyone having to disconnect it
+        ref = weakref.ref(self)
+
+        def changed(librarian, songs):
+            order = ref()
+            if order is None:
+                librarian.disconnect(sig)
+            else:
+                order._changed(songs)
+
+        sig = self._sig = librarian.connect('changed', changed)
+
+    def _changed(self, songs):
+        if self._weights is None:
+            return
+
+        weights = self._weights
+        counts = self._counts
+        for song in songs:
+            for i in self._indices.get(song, ()):
+                if counts.get(i):
+                    weights.set(i, song("~#rating"))
+
+    def _set_played(self, playlist, index, played):
+        if self._weights is None:
+            return
+        if len(self._weights) != len(playlist):
+            self._weights = None
+            return
+
+        if played:
+            self._weights.set(index, 0.0)
+            self._counts.set(index, 0.0)
+        else:
+            self._weights.set(index, playlist[index][0]("~#rating"))
+            self._counts.set(index, 1.0)
+
     def next(self, playlist, iter):
         super(OrderWeighted, self).next(playlist, iter)
-        remaining = self.remaining(playlist)
+        if iter is not None:
+            self._set_played(playlist, self._played[-1], True)
+
+        if self._weights is None or len(self._weights) != len(playlist):
+            self._build(playlist)
+        weights = self._weights
+        counts = self._counts
+
+        index = None
+        if weights.total > 0:
+            index = weights.find(random.random() * weights.total)
+        if index is None and counts.total > 0:
+            index = counts.find(random.random() * counts.total)
 
         # Don't try to search through an empty / played playlist.
-        if len(remaining) <= 0:
+        if index is None:
             return None
+        return playlist.get_iter([index])
+
+    def previous(self, playlist, iter):
+        result = super(OrderWeighted, self).previous(playlist, iter)
+        if result is not None:
+            index = playlist.get_path(result).get_indices()[0]
+            if index not in self._played:
+                self._set_played(playlist, index, False)
+        return result
+
+    def set(self, playlist, iter):
+        result = super(OrderWeighted, self).set(playlist, iter)
+        if iter is not None:
+            self._set_played(playlist, self._played[-1], True)
+        return result
 
-        total_score = sum([song('~#rating') for song in remaining.values()])
-        choice = random.random() * total_score
-        current = 0.0
-        for i, song in iteritems(remaining):
-            current += song("~#rating")
-            if current >= choice:
-                return playlist.get_iter([i])
-        raise ValueError
+    def reset(self, playlist):
+        super(OrderWeighted, self).reset(playlist)
+        self._weights = self._counts = self._indices = None
@@ -326,6 +326,10 @@ class PreferencesWindow(UniqueWindow):
             entry.set_tooltip_text(
                     _("The album art image file to use when forced"))
             entry.set_text(config.get("albumart", "filename"))
+            # found covers depend on the filename, but don't look for new
+            # ones on every key press
+            self.__covers_changed_deferred = util.DeferredSignal(
+                self.__covers_changed, timeout=500, owner=self)
             entry.connect('changed', self.__changed_text, 'filename')
             # Disable entry when not forcing
             entry.set_sensitive(cb.get_active())
@@ -341,9 +345,14 @@ class PreferencesWindow(UniqueWindow):
 
         def __changed_text(self, entry, name):
             config.set('albumart', name, entry.get_text())
+            self.__covers_changed_deferred()
 
         def __toggled_force_filename(self, cb, fn_entry):
             fn_entry.set_sensitive(cb.get_active())
+            self.__covers_changed_deferred.call()
+
+        def __covers_changed(self):
+            app.cover_manager.cover_changed([])
 
         def _entry(self, entry, name, section="settings"):
             config.set(section, name, entry.get_text())
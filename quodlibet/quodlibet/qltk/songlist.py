@@ -408,6 +408,7 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
         # might contain column header names not present...
         self._sort_sequence = []
         self.set_column_headers(self.headers)
+        self.__library = library
         librarian = library.librarian or library
 
         connect_destroy(librarian, 'changed', self.__song_updated)
@@ -746,33 +747,65 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
             return []
         return model.get()
 
-    def _sort_songs(self, songs):
-        """Sort passed songs in place based on the column sort orders"""
+    def __get_sort_func(self, tag):
+        if tag == "":
+            return lambda s: s.sort_key
+
+        sort_func = None
+        index = getattr(self.__library, "index", None)
+        if index is not None:
+            sort_func = index.get_sort_func(tag)
+        sort_keys = getattr(self.__library, "sort_keys", None)
+        if sort_func is None and sort_keys is not None:
+            sort_func = sort_keys.get_sort_func(tag)
+        if sort_func is None:
+            sort_func = AudioFile.sort_by_func(tag)
+        return sort_func
+
+    def _get_sort_keys(self):
+        """Returns a list of (key function, reverse) tuples for the column
+        sort orders, the first one deciding first.
+
+        Columns next to each other which get sorted in the same direction
+        are combined into one key, so they can be sorted in one go.
+        """
 
-        last_tag = None
-        last_order = None
-        first = True
-        for tag, reverse in self.get_sort_orders():
-            tag = get_sort_tag(tag)
-
-            # always sort using the default sort key first
-            if first:
-                first = False
-                songs.sort(key=lambda s: s.sort_key, reverse=reverse)
-                last_order = reverse
-                last_tag = ""
-
-            # no need to sort twice in a row with the same key/order
-            if tag == last_tag and last_order == reverse:
-                continue
-            last_order = reverse
-            last_tag = tag
+        orders = [(get_sort_tag(t), r) for t, r in self.get_sort_orders()]
+        if not orders:
+            return []
 
-            if tag == "":
-                songs.sort(key=lambda s: s.sort_key, reverse=reverse)
+        # the default sort key always decides last
+        orders.insert(0, ("", orders[0][1]))
+
+        # the last sorted column decides first, later ones with
+        # the same tag don't change anything
+        columns = []
+        tags = []
+        for tag, reverse in reversed(orders):
+            if tag not in tags:
+                tags.append(tag)
+                columns.append((tag, reverse))
+
+        groups = []
+        for tag, reverse in columns:
+            sort_func = self.__get_sort_func(tag)
+            if groups and groups[-1][1] == reverse:
+                groups[-1][0].append(sort_func)
             else:
-                sort_func = AudioFile.sort_by_func(tag)
-                songs.sort(key=sort_func, reverse=reverse)
+                groups.append(([sort_func], reverse))
+
+        def combine(sort_funcs):
+            if len(sort_funcs) == 1:
+                return sort_funcs[0]
+            return lambda song: tuple([f(song) for f in sort_funcs])
+
+        return [(combine(funcs), reverse) for funcs, reverse in groups]
+
+    def _sort_songs(self, songs):
+        """Sort passed songs in place based on the column sort orders"""
+
+        for sort_key, reverse in reversed(self._get_sort_keys()):
+            songs.sort(key=sort_key, reverse=reverse)
 
     def add_songs(self, songs):
         """Add songs to the list in the right order and position"""
@@ -785,18 +818,56 @@ class SongList(AllTreeView, SongListDnDMixin, DragScroll,
             self.set_songs(songs, scroll=False)
             return
 
-        if not self.is_sorted():
+        sort_keys = self._get_sort_keys()
+        if not self.is_sorted() or not sort_keys:
             model.append_many(songs)
             return
 
-        # FIXME: Replace with something fast
-        old_songs = self.get_songs()
-        old_songs.extend(songs)
+        sort_funcs = [f for f, r in sort_keys]
+        reverses = [r for f, r in sort_keys]
+
+        def get_keys(song):
+            return [f(song) for f in sort_funcs]
+
+        def is_before(keys, other):
+            for key, other_key, reverse in zip(keys, other, reverses):
+                if key != other_key:
+                    return other_key < key if reverse else key < other_key
+            return False
+
+        songs = list(songs)
+        self._sort_songs(songs)
 
-        self._sort_songs(old_songs)
+        # find the position of each new song after all equal ones using
+        # binary search on the rows, the new songs are sorted so each one
+        # comes after the previous
+        get_value = model.get_value
+        iter_nth_child = model.iter_nth_child
+
+        def get_song(position):
+            return get_value(iter_nth_child(None, position))
+
+        count = len(model)
+        groups = []
+        lo = 0
+        for song in songs:
+            keys = get_keys(song)
+            hi = count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if is_before(keys, get_keys(get_song(mid))):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            if groups and groups[-1][0] == lo:
+                groups[-1][1].append(song)
+            else:
+                groups.append((lo, [song]))
 
-        for index, song in sorted(zip(map(old_songs.index, songs), songs)):
-            model.insert(index, row=[song])
+        offset = 0
+        for position, group in groups:
+            model.insert_many(position + offset, group)
+            offset += len(group)
 
     def set_songs(self, songs, sorted=False, scroll=True, scroll_select=False):
         """Fill the song list.
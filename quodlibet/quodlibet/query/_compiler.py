@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation
+
+"""Turns a match tree into a single Python function.
+
+Evaluating the match tree means one method call per node and song, plus
+looking up the node attributes each time. The compiler instead generates
+the code of one function which evaluates the whole tree for a song with
+all regexes, tag names and helpers bound as locals.
+
+Children of Inter and Union get evaluated cheapest first, so that
+expensive checks only run if still needed.
+
+Tag values of songs are taken from `AudioFile.search_text` if possible,
+which caches them already normalized.
+"""
+
+import time
+import unicodedata
+
+from senf import fsn2text, fsnative
+
+from quodlibet.compat import exec_
+from quodlibet.formats import AudioFile
+from ._match import True_, Inter, Union, Neg, Tag, Regex, Numcmp
+
+
+def _get_cost(node):
+    """A rough estimate of how expensive it is to evaluate a node"""
+
+    if isinstance(node, True_):
+        return 0
+    elif isinstance(node, (Inter, Union)):
+        return sum(_get_cost(n._unpack()) for n in node.res)
+    elif isinstance(node, Neg):
+        return _get_cost(node.res._unpack())
+    elif isinstance(node, Tag):
+        # synthesized values are computed and filenames converted first
+        cost = len(node._names) + 4 * (len(node._intern) + len(node._fs))
+        if not isinstance(node.res, Regex):
+            cost *= _get_cost(node.res)
+        return cost
+    elif isinstance(node, Regex):
+        return 1
+    elif isinstance(node, Numcmp):
+        return 3
+    # extensions and unknown nodes
+    return 20
+
+
+class QueryCompiler(object):
+
+    def __init__(self, node):
+        self._root = node._unpack()
+
+    def compile(self):
+        """Returns a search function and a filter function for the node.
+
+        Returns:
+            Tuple[Callable[[AudioFile], bool], Callable[[List], List]]
+        """
+
+        self._scope = {"_time": time.time}
+        self._counter = 0
+        self._uses_get = False
+        self._uses_time = False
+        self._uses_text = False
+
+        body, result = self._node(self._root)
+
+        prelude = []
+        if self._uses_get:
+            prelude.append("g = s.get")
+        if self._uses_text:
+            self._scope["_AudioFile"] = AudioFile
+            prelude.append(
+                "st = s.search_text if isinstance(s, _AudioFile) else None")
+
+        content = ["def search(s):"]
+        if self._uses_time:
+            content.append("  t = _time()")
+        content.extend("  " + l for l in prelude + body)
+        content.append("  return %s" % result)
+
+        content.append("def filter_(seq):")
+        if self._uses_time:
+            content.append("  t = _time()")
+        content.append("  r = []")
+        content.append("  a = r.append")
+        content.append("  for s in seq:")
+        content.extend("    " + l for l in prelude + body)
+        content.append("    if %s:" % result)
+        content.append("      a(s)")
+        content.append("  return r")
+
+        code = "\n".join(content)
+        scope = self._scope
+        exec_(compile(code, "<query>", "exec"), scope)
+        return scope["search"], scope["filter_"]
+
+    def _var(self, prefix):
+        self._counter += 1
+        return "%s%d" % (prefix, self._counter)
+
+    def _bind(self, prefix, obj):
+        name = self._var(prefix)
+        self._scope[name] = obj
+        return name
+
+    def _node(self, node):
+        """Returns a list of code lines and a variable or expression
+        containing the result
+        """
+
+        node = node._unpack()
+
+        if isinstance(node, True_):
+            return [], "True"
+        elif isinstance(node, Inter):
+            return self._inter_union(node, True)
+        elif isinstance(node, Union):
+            return self._inter_union(node, False)
+        elif isinstance(node, Neg):
+            lines, res = self._node(node.res)
+            var = self._var("b")
+            lines.append("%s = not %s" % (var, res))
+            return lines, var
+        elif isinstance(node, Tag):
+            return self._tag(node)
+        elif isinstance(node, Numcmp):
+            self._uses_time = True
+            func = self._bind("n", node.search_at)
+            return [], "%s(s, t)" % func
+
+        func = self._bind("x", node.search)
+        return [], "%s(s)" % func
+
+    def _inter_union(self, node, is_inter):
+        children = sorted(node.res, key=lambda n: _get_cost(n._unpack()))
+        if not children:
+            return [], "True" if is_inter else "False"
+
+        var = self._var("b")
+        lines = []
+        for i, child in enumerate(children):
+            child_lines, res = self._node(child)
+            child_lines.append("%s = %s" % (var, res))
+            if i == 0:
+                lines.extend(child_lines)
+            else:
+                lines.append(("if %s:" if is_inter else "if not %s:") % var)
+                lines.extend("  " + l for l in child_lines)
+        return lines, var
+
+    def _value(self, node, value, normalized):
+        """Returns an expression matching the value variable against the
+        regex(es) of a Tag
+        """
+
+        node = node._unpack()
+
+        if isinstance(node, Regex):
+            if normalized:
+                search = node.normalized_search()
+            else:
+                search = node.search
+            return "%s(%s)" % (self._bind("r", search), value)
+        elif isinstance(node, (Inter, Union)):
+            if not node.res:
+                return "True" if isinstance(node, Inter) else "False"
+            parts = [self._value(n, value, normalized) for n in
+                     sorted(node.res, key=lambda n: _get_cost(n._unpack()))]
+            op = " and " if isinstance(node, Inter) else " or "
+            return "(%s)" % op.join(parts)
+        elif isinstance(node, Neg):
+            return "(not %s)" % self._value(node.res, value, normalized)
+        elif isinstance(node, True_):
+            return "True"
+
+        if normalized:
+            search = node.normalized_search()
+        else:
+            search = node.search
+        return "%s(%s)" % (self._bind("x", search), value)
+
+    def _tag(self, node):
+        var = self._var("b")
+        value = self._var("v")
+        normalized = node.res.normalized_search() is not None
+        match = self._value(node.res, value, normalized)
+
+        values = []
+        for name in node._names:
+            self._uses_get = True
+            if name in ("filename", "mountpoint"):
+                fallback = "fsn2text(g(%r, fsd))" % ("~" + name)
+            else:
+                fallback = "g(%r, u'')" % ("~" + name)
+            values.append([
+                "%s = g(%r)" % (value, name),
+                "if %s is None:" % value,
+                "  %s = %s" % (value, fallback),
+            ])
+        for name in node._intern:
+            values.append(["%s = s(%r)" % (value, name)])
+        for name in node._fs:
+            values.append(["%s = fsn2text(s(%r, fsd))" % (value, name)])
+
+        if normalized:
+            self._uses_text = True
+            self._scope["nfc"] = unicodedata.normalize
+            names = node._names + [None] * len(node._intern) + node._fs
+            for name, value_lines in zip(names, values):
+                value_lines.append(
+                    "%s = nfc('NFC', %s)" % (value, value))
+                if name is not None:
+                    value_lines[:] = [
+                        "if st is not None:",
+                        "  %s = st(%r)" % (value, name),
+                        "else:",
+                    ] + ["  " + l for l in value_lines]
+
+        if node._fs or node._names:
+            self._scope["fsn2text"] = fsn2text
+            self._scope["fsd"] = fsnative()
+
+        lines = ["%s = False" % var]
+        for i, value_lines in enumerate(values):
+            value_lines.extend([
+                "if %s:" % match,
+                "  %s = True" % var,
+            ])
+            if i == 0:
+                lines.extend(value_lines)
+            else:
+                lines.append("if not %s:" % var)
+                lines.extend("  " + l for l in value_lines)
+        return lines, var
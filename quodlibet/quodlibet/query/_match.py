@@ -10,13 +10,14 @@
 
 import time
 import operator
+import unicodedata
 
 from senf import fsn2text, fsnative
 
 from quodlibet.unisearch import compile
-from quodlibet.compat import floordiv, text_type
+from quodlibet.compat import floordiv, text_type, unichr, sre_parse
 from quodlibet.util import parse_date
-from quodlibet.formats import FILESYSTEM_TAGS, TIME_TAGS
+from quodlibet.formats import AudioFile, FILESYSTEM_TAGS, TIME_TAGS
 
 
 class error(ValueError):
@@ -35,6 +36,23 @@ class Node(object):
     def filter(self, sequence):
         return [s for s in sequence if self.search(s)]
 
+    def candidates(self, index, names=None):
+        """Returns a set of items which contains at least all items matching
+        this node, or None if all items have to be checked.
+
+        `index` is a `library.index.SearchIndex` and `names` the tags this
+        node gets matched against in case it is part of a `Tag`.
+        """
+
+        return None
+
+    def normalized_search(self):
+        """Returns a function like `search` for NFC normalized text,
+        or None if the node can't match text.
+        """
+
+        return None
+
     def _unpack(self):
         return self
 
@@ -58,15 +76,61 @@ class Regex(Node):
         dot_all = "s" in self.mod_string
         asym = "d" in self.mod_string
         try:
-            self.search = compile(self.pattern, ignore_case, dot_all, asym)
+            search = compile(
+                self.pattern, ignore_case, dot_all, asym, normalized=True)
         except ValueError:
             raise ParseError(
                 "The regular expression /%s/ is invalid." % self.pattern)
 
+        normalize = unicodedata.normalize
+        self._search_normalized = search
+        self.search = lambda text: search(normalize("NFC", text))
+
+    def normalized_search(self):
+        return self._search_normalized
+
+    def candidates(self, index, names=None):
+        if names is None:
+            return None
+        literals = get_literals(self.pattern)
+        if not literals:
+            return None
+        return index.candidates(names, literals)
+
     def __repr__(self):
         return "<Regex pattern=%s mod=%s>" % (self.pattern, self.mod_string)
 
 
+def get_literals(pattern):
+    """Returns a list of literal texts which have to be contained in any text
+    the regex pattern matches.
+
+    Args:
+        pattern (text_type)
+    Returns:
+        List[text_type]
+    """
+
+    pattern = unicodedata.normalize("NFC", pattern)
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+
+    literals = []
+    current = []
+    for op, av in parsed:
+        if str(op).lower() == "literal":
+            current.append(unichr(av))
+        elif current:
+            literals.append(u"".join(current))
+            current = []
+    if current:
+        literals.append(u"".join(current))
+
+    return literals
+
+
 class True_(Node):
     """Always True"""
 
@@ -76,6 +140,9 @@ class True_(Node):
     def filter(self, list_):
         return list(list_)
 
+    def normalized_search(self):
+        return self.search
+
     def __repr__(self):
         return "<True>"
 
@@ -99,6 +166,28 @@ class Union(Node):
                 return True
         return False
 
+    def normalized_search(self):
+        searches = [re.normalized_search() for re in self.res]
+        if None in searches:
+            return None
+
+        def search(text):
+            for search in searches:
+                if search(text):
+                    return True
+            return False
+
+        return search
+
+    def candidates(self, index, names=None):
+        result = set()
+        for re in self.res:
+            candidates = re.candidates(index, names)
+            if candidates is None:
+                return None
+            result.update(candidates)
+        return result
+
     def __repr__(self):
         return "<Union %r>" % self.res
 
@@ -133,6 +222,19 @@ class Inter(Node):
                 return False
         return True
 
+    def normalized_search(self):
+        searches = [re.normalized_search() for re in self.res]
+        if None in searches:
+            return None
+
+        def search(text):
+            for search in searches:
+                if not search(text):
+                    return False
+            return True
+
+        return search
+
     def filter(self, sequence):
         current = sequence
         for re in self.res:
@@ -141,6 +243,18 @@ class Inter(Node):
             current = list(current)
         return current
 
+    def candidates(self, index, names=None):
+        result = None
+        for re in self.res:
+            candidates = re.candidates(index, names)
+            if candidates is None:
+                continue
+            if result is None:
+                result = candidates
+            else:
+                result = result & candidates
+        return result
+
     def __repr__(self):
         return "<Inter %r>" % self.res
 
@@ -171,6 +285,12 @@ class Neg(Node):
     def search(self, data):
         return not self.res.search(data)
 
+    def normalized_search(self):
+        search = self.res.normalized_search()
+        if search is None:
+            return None
+        return lambda text: not search(text)
+
     def __repr__(self):
         return "<Neg %r>" % self.res
 
@@ -203,20 +323,65 @@ class Numcmp(Node):
         "!=": operator.ne,
     }
 
+    swapped = {
+        operator.lt: operator.gt,
+        operator.le: operator.ge,
+        operator.gt: operator.lt,
+        operator.ge: operator.le,
+        operator.eq: operator.eq,
+        operator.ne: operator.ne,
+    }
+
+    TIME_SLACK = 60
+    """Seconds between computing candidates and searching them we allow for
+    in comparisons against the current time"""
+
     def __init__(self, expr, op, expr2):
         self._expr = expr
         self._op = self.operators[op]
         self._expr2 = expr2
+        self._use_date = expr.use_date() or expr2.use_date()
 
     def search(self, data):
-        time_ = time.time()
-        use_date = self._expr.use_date() or self._expr2.use_date()
+        return self.search_at(data, time.time())
+
+    def search_at(self, data, time_):
+        """Like search() but with the current time passed in"""
+
+        use_date = self._use_date
         val = self._expr.evaluate(data, time_, use_date)
         val2 = self._expr2.evaluate(data, time_, use_date)
         if val is not None and val2 is not None:
             return self._op(val, val2)
         return False
 
+    def candidates(self, index, names=None):
+        expr, op, expr2 = self._expr, self._op, self._expr2
+        if not isinstance(expr, NumexprTag):
+            expr, expr2 = expr2, expr
+            op = self.swapped.get(op)
+        if op is None or not isinstance(expr, NumexprTag) or \
+                not expr2.is_constant() or expr.use_date():
+            return None
+
+        time_ = time.time()
+        value = expr2.evaluate(None, time_, self._use_date)
+        if value is None:
+            return None
+
+        if expr._ftag in TIME_TAGS:
+            # we compare against the age, so turn it into a comparison
+            # against the time. The time used for filtering afterwards will
+            # be a bit later, so widen the range.
+            if op in (operator.lt, operator.le):
+                op, value = operator.ge, time_ - value - self.TIME_SLACK
+            elif op in (operator.gt, operator.ge):
+                op, value = operator.le, time_ - value + self.TIME_SLACK
+            else:
+                return None
+
+        return index.numeric_candidates(expr._ftag, op, value)
+
     def __repr__(self):
         return "<Numcmp expr=%r, op=%r, expr2=%r>" % (
             self._expr, self._op.__name__, self._expr2)
@@ -249,6 +414,10 @@ class Numexpr(object):
         values instead of the number values."""
         return False
 
+    def is_constant(self):
+        """Returns whether the value doesn't depend on the audiofile"""
+        return True
+
 
 class NumexprTag(Numexpr):
     """Numeric tag"""
@@ -280,6 +449,9 @@ class NumexprTag(Numexpr):
     def use_date(self):
         return self._tag == 'date'
 
+    def is_constant(self):
+        return False
+
 
 class NumexprUnary(Numexpr):
     """Unary numeric operation (like -)"""
@@ -304,6 +476,9 @@ class NumexprUnary(Numexpr):
     def use_date(self):
         return self.__expr.use_date()
 
+    def is_constant(self):
+        return self.__expr.is_constant()
+
 
 class NumexprBinary(Numexpr):
     """Binary numeric operation (like + or *)"""
@@ -354,6 +529,9 @@ class NumexprBinary(Numexpr):
     def use_date(self):
         return self.__expr.use_date() or self.__expr2.use_date()
 
+    def is_constant(self):
+        return self.__expr.is_constant() and self.__expr2.is_constant()
+
 
 class NumexprGroup(Numexpr):
     """Parenthesized group in numeric expression"""
@@ -370,6 +548,9 @@ class NumexprGroup(Numexpr):
     def use_date(self):
         return self.__expr.use_date()
 
+    def is_constant(self):
+        return self.__expr.is_constant()
+
 
 class NumexprNumber(Numexpr):
     """Number in numeric expression"""
@@ -481,8 +662,8 @@ class Tag(Node):
     def __init__(self, names, res):
         self.res = res
         self._names = []
-        self.__intern = []
-        self.__fs = []
+        self._intern = []
+        self._fs = []
 
         names = [Tag.ABBRS.get(n.lower(), n.lower()) for n in names]
         for name in names:
@@ -490,13 +671,34 @@ class Tag(Node):
                 if name.startswith("~#"):
                     raise ValueError("numeric tags not supported")
                 if name in FILESYSTEM_TAGS:
-                    self.__fs.append(name)
+                    self._fs.append(name)
                 else:
-                    self.__intern.append(name)
+                    self._intern.append(name)
             else:
                 self._names.append(name)
 
+        self._search_normalized = res.normalized_search()
+
     def search(self, data):
+        search = self._search_normalized
+        if search is not None and isinstance(data, AudioFile):
+            # use the texts cached in the song
+            search_text = data.search_text
+            for name in self._names:
+                if search(search_text(name)):
+                    return True
+
+            normalize = unicodedata.normalize
+            for name in self._intern:
+                if search(normalize("NFC", data(name))):
+                    return True
+
+            for name in self._fs:
+                if search(search_text(name)):
+                    return True
+
+            return False
+
         search = self.res.search
         fs_default = fsnative()
 
@@ -511,18 +713,22 @@ class Tag(Node):
             if search(val):
                 return True
 
-        for name in self.__intern:
+        for name in self._intern:
             if search(data(name)):
                 return True
 
-        for name in self.__fs:
+        for name in self._fs:
             if search(fsn2text(data(name, fs_default))):
                 return True
 
         return False
 
+    def candidates(self, index, names=None):
+        return self.res.candidates(
+            index, self._names + self._intern + self._fs)
+
     def __repr__(self):
-        names = self._names + self.__intern
+        names = self._names + self._intern
         return ("<Tag names=%r, res=%r>" % (names, self.res))
 
     def __and__(self, other):
@@ -10,6 +10,7 @@
 from . import _match as match
 from ._match import error, Node
 from ._parser import QueryParser
+from ._compiler import QueryCompiler
 from quodlibet.util import re_escape, enum, cached_property
 from quodlibet.compat import PY2, text_type
 
@@ -100,13 +101,20 @@ class Query(Node):
         return "<Query string=%r type=%r star=%r>" % (
             self.string, self.type, self.star)
 
+    @cached_property
+    def _compiled(self):
+        return QueryCompiler(self._match).compile()
+
     @cached_property
     def search(self):
-        return self._match.search
+        return self._compiled[0]
 
     @cached_property
     def filter(self):
-        return self._match.filter
+        return self._compiled[1]
+
+    def candidates(self, index, names=None):
+        return self._match.candidates(index, names)
 
     @classmethod
     def is_valid(cls, string):
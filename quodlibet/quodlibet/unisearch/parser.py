@@ -6,12 +6,11 @@
 # published by the Free Software Foundation
 
 import re
-import sre_parse
 import unicodedata
 
 from quodlibet import print_d
 from quodlibet.util import re_escape
-from quodlibet.compat import text_type, xrange, unichr
+from quodlibet.compat import text_type, xrange, unichr, sre_parse
 
 from .db import get_replacement_mapping
 
@@ -256,13 +255,15 @@ def re_add_variants(text):
     return re_replace_literals(text, get_replacement_mapping())
 
 
-def compile(pattern, ignore_case=True, dot_all=False, asym=False):
+def compile(pattern, ignore_case=True, dot_all=False, asym=False,
+            normalized=False):
     """
     Args:
         pattern (text_type): a unicode regex
         ignore_case (bool): if case shouuld be ignored when matching
         dot_all (bool): if "." should match newlines
         asym (bool): if ascii should match similar looking unicode chars
+        normalized (bool): if the passed text is already NFC normalized
     Returns:
         A callable which will return True if the pattern is contained in
         the passed text.
@@ -293,6 +294,10 @@ def compile(pattern, ignore_case=True, dot_all=False, asym=False):
         reg = re.compile(pattern, mods)
     except re.error as e:
         raise ValueError(e)
+
+    if normalized:
+        return reg.search
+
     normalize = unicodedata.normalize
 
     def search(text):
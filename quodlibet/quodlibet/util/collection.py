@@ -45,9 +45,13 @@ def avg(nums):
 def bayesian_average(nums, c=None, m=None):
     """Returns the Bayesian average of an iterable of numbers,
     with parameters defaulting to config specific to ~#rating."""
+    return _bayesian_average(sum(nums), len(nums), c, m)
+
+
+def _bayesian_average(total, count, c=None, m=None):
     m = m or config.RATINGS.default
     c = c or config.getfloat("settings", "bayesian_rating_factor", 0.0)
-    ret = float(m * c + sum(nums)) / (c + len(nums))
+    ret = float(m * c + total) / (c + count)
     return ret
 
 NUM_DEFAULT_FUNCS = {
@@ -74,23 +78,212 @@ NUM_FUNCS = {
 }
 
 
+class _Aggregate(object):
+    """A value derived from the songs of a collection, which can be kept up
+    to date while songs get added or removed one by one.
+
+    What each song contributed gets remembered, so the old contribution
+    of a changed song can be taken back out.
+    """
+
+    def __init__(self, songs, track=True):
+        """If track is False the contributions aren't kept, which allows
+        duplicate songs but no updates."""
+
+        self._contributions = {} if track else None
+        self.add(songs)
+
+    def add(self, songs):
+        contributions = self._contributions
+        for song in songs:
+            contribution = self._get_contribution(song)
+            if contributions is not None:
+                contributions[song] = contribution
+            self._add(contribution)
+
+    def remove(self, songs):
+        contributions = self._contributions
+        for song in songs:
+            if song in contributions:
+                self._remove(contributions.pop(song))
+
+    def _get_contribution(self, song):
+        raise NotImplementedError
+
+    def _add(self, contribution):
+        raise NotImplementedError
+
+    def _remove(self, contribution):
+        raise NotImplementedError
+
+    def get(self, key):
+        """Returns the value for the key or None"""
+
+        raise NotImplementedError
+
+
+class _NumericAggregate(_Aggregate):
+    """Sum, count and value frequencies of a numeric key, enough for
+    all NUM_FUNCS"""
+
+    def __init__(self, key, songs, track=True):
+        self._key = key
+        self._total = 0
+        self._count = 0
+        # value -> number of songs
+        self._values = {}
+        self._min = self._max = None
+        super(_NumericAggregate, self).__init__(songs, track)
+
+    def _get_contribution(self, song):
+        value = song(self._key)
+        return None if value == "" else value
+
+    def _add(self, value):
+        if value is None:
+            return
+        self._total += value
+        self._count += 1
+        self._values[value] = self._values.get(value, 0) + 1
+        if self._min is not None and value < self._min:
+            self._min = value
+        if self._max is not None and value > self._max:
+            self._max = value
+
+    def _remove(self, value):
+        if value is None:
+            return
+        self._count -= 1
+        # don't let float errors pile up
+        self._total = self._total - value if self._count else 0
+        count = self._values.pop(value) - 1
+        if count:
+            self._values[value] = count
+        else:
+            if value == self._min:
+                self._min = None
+            if value == self._max:
+                self._max = None
+
+    def get(self, func):
+        if not self._count:
+            return None
+        elif func == "sum":
+            return self._total
+        elif func == "avg":
+            return float(self._total) / self._count
+        elif func == "bav":
+            return _bayesian_average(self._total, self._count)
+        elif func == "max":
+            if self._max is None:
+                self._max = max(self._values)
+            return self._max
+        elif func == "min":
+            if self._min is None:
+                self._min = min(self._values)
+            return self._min
+        raise ValueError(func)
+
+
+class _FrequencyAggregate(_Aggregate):
+    """All values of a key, sorted by their number of appearance"""
+
+    def __init__(self, key, songs, track=True):
+        self._key = key
+        # value -> negative number of appearances
+        self._values = {}
+        super(_FrequencyAggregate, self).__init__(songs, track)
+
+    def _get_contribution(self, song):
+        return song.list(self._key)
+
+    def _add(self, values):
+        result = self._values
+        for value in values:
+            result[value] = result.get(value, 0) - 1
+
+    def _remove(self, values):
+        result = self._values
+        for value in values:
+            count = result[value] + 1
+            if count:
+                result[value] = count
+            else:
+                del result[value]
+
+    def get(self, key):
+        values = listmap(lambda x: x[0],
+                     sorted(self._values.items(), key=lambda x: (x[1], x[0])))
+        return "\n".join(values) if values else None
+
+
+class _PeopleAggregate(_Aggregate):
+    """~people and ~peoplesort, ranked by "relevance" -- artists before
+    composers before performers, then by number of appearances."""
+
+    def __init__(self, key, songs, track=True):
+        self._people = {}
+        self._peoplesort = {}
+        super(_PeopleAggregate, self).__init__(songs, track)
+
+    def _get_contribution(self, song):
+        people = []
+        peoplesort = []
+        for w, k in enumerate(ELPOEP):
+            persons = song.list(k)
+            for person in persons:
+                people.append((person, PEOPLE_SCORE[w]))
+            if k in TAG_TO_SORT:
+                persons = song.list(TAG_TO_SORT[k]) or persons
+            for person in persons:
+                peoplesort.append((person, PEOPLE_SCORE[w]))
+        return people, peoplesort
+
+    def _add(self, contribution):
+        for scores, values in zip((self._people, self._peoplesort),
+                                  contribution):
+            for person, score in values:
+                scores[person] = scores.get(person, 0) - score
+
+    def _remove(self, contribution):
+        for scores, values in zip((self._people, self._peoplesort),
+                                  contribution):
+            for person, score in values:
+                value = scores[person] + score
+                if value:
+                    scores[person] = value
+                else:
+                    del scores[person]
+
+    def get(self, key):
+        scores = self._people if key == "~people" else self._peoplesort
+        values = sorted(scores.keys(), key=scores.__getitem__)[:100]
+        return "\n".join(values) if values else None
+
+
 class Collection(object):
     """A collection of songs which implements some methods similar to the
     AudioFile class.
 
     The content of the collection can be changed by changing the content of
     the songs attribute.
+
+    If `_keep_aggregates` is set, the values derived from the songs are
+    kept around and can be updated through `_update` when only a few
+    songs change. This requires the songs to be unique.
     """
 
     _cache_size = 6
+    _keep_aggregates = False
     songs = ()
 
     def __init__(self):
         """Cache in _cache, LRU key order in _used, keys that return default
-        are in _default"""
+        are in _default, aggregates for updating values in _aggregates"""
         self.__cache = {}
         self.__default = set()
         self.__used = []
+        self.__aggregates = {}
 
     def finalize(self):
         """Finalize the collection.
@@ -98,6 +291,32 @@ class Collection(object):
         self.__cache.clear()
         self.__default.clear()
         self.__used = []
+        self.__aggregates.clear()
+
+    def _update(self, added=(), removed=(), changed=()):
+        """Updates the kept aggregates for songs which got added to, removed
+        from or changed in `songs`. Cheaper than `finalize` if only a few
+        songs are affected.
+        """
+
+        for aggregate in set(self.__aggregates.values()):
+            aggregate.remove(removed)
+            aggregate.remove(changed)
+            aggregate.add(changed)
+            aggregate.add(added)
+        self.__cache.clear()
+        self.__default.clear()
+        self.__used = []
+
+    def __get_aggregate(self, cls, key):
+        aggregates = self.__aggregates
+        if not self._keep_aggregates:
+            return cls(key, self.songs, False)
+        try:
+            return aggregates[key]
+        except KeyError:
+            aggregate = aggregates[key] = cls(key, self.songs)
+            return aggregate
 
     def get(self, key, default=u"", connector=u" - "):
         if not self.songs:
@@ -184,54 +403,30 @@ class Collection(object):
                 func = NUM_DEFAULT_FUNCS.get(key, "avg")
 
             key = "~#" + key
-            func = NUM_FUNCS.get(func)
-            if func:
+            if func in NUM_FUNCS:
                 # If none of the songs can return a numeric key,
                 # the album returns default
-                values = (song(key) for song in self.songs)
-                values = [v for v in values if v != ""]
-                return func(values) if values else None
+                return self.__get_aggregate(_NumericAggregate, key).get(func)
             elif key in NUMERIC_ZERO_DEFAULT:
                 return 0
             return None
         elif key[:1] == "~":
             key = key[1:]
             numkey = key.split(":")[0]
-            keys = {"people": {}, "peoplesort": {}}
-            if key in keys:
-                people = keys["people"]
-                peoplesort = keys["peoplesort"]
-                for song in self.songs:
-                    # Rank people by "relevance" -- artists before composers
-                    # before performers, then by number of appearances.
-                    for w, k in enumerate(ELPOEP):
-                        persons = song.list(k)
-                        for person in persons:
-                            people[person] = (people.get(person, 0) -
-                                              PEOPLE_SCORE[w])
-                        if k in TAG_TO_SORT:
-                            persons = song.list(TAG_TO_SORT[k]) or persons
-                        for person in persons:
-                            peoplesort[person] = (peoplesort.get(person, 0) -
-                                                  PEOPLE_SCORE[w])
-                # It's cheaper to get people and peoplesort in one go
-                keys["people"] = sorted(people.keys(),
-                                        key=people.__getitem__)[:100]
-                keys["peoplesort"] = sorted(peoplesort.keys(),
-                                            key=peoplesort.__getitem__)[:100]
+            if key in ("people", "peoplesort"):
+                aggregate = self.__get_aggregate(_PeopleAggregate, "~people")
+                ret = aggregate.get("~" + key)
 
-                ret = keys.pop(key)
-                ret = (ret and "\n".join(ret)) or None
-
-                other, values = keys.popitem()
-                other = "~" + other
-                if not values:
+                # It's cheaper to get people and peoplesort in one go
+                other = "~peoplesort" if key == "people" else "~people"
+                value = aggregate.get(other)
+                if value is None:
                     self.__default.add(other)
                 else:
                     if other in self.__used:
                         self.__used.remove(other)
                     self.__used.append(other)
-                    self.__cache[other] = "\n".join(values)
+                    self.__cache[other] = value
                 return ret
             elif numkey == "length":
                 length = self.__get_value("~#" + key)
@@ -263,19 +458,19 @@ class Collection(object):
 
         # Nothing special was found, so just take all values of the songs
         # and sort them by their number of appearance
-        result = {}
-        for song in self.songs:
-            for value in song.list(key):
-                result[value] = result.get(value, 0) - 1
-
-        values = listmap(lambda x: x[0],
-                     sorted(result.items(), key=lambda x: (x[1], x[0])))
-        return "\n".join(values) if values else None
+        return self.__get_aggregate(_FrequencyAggregate, key).get(key)
 
 
 class Album(Collection):
     """Like a `Collection` but adds cover scanning, some attributes for sorting
-    and uses a set for the songs."""
+    and uses a set for the songs.
+
+    Instead of changing `songs` and calling `finalize`, `add_songs`,
+    `remove_songs` and `songs_changed` can be used, which update the
+    values incrementally.
+    """
+
+    _keep_aggregates = True
 
     @util.cached_property
     def peoplesort(self):
@@ -310,6 +505,30 @@ class Album(Collection):
         self.__dict__.pop("peoplesort", None)
         self.__dict__.pop("genre", None)
 
+    def add_songs(self, songs):
+        """Add songs to the album"""
+
+        songs = set(songs) - self.songs
+        self.songs.update(songs)
+        self.__update(added=songs)
+
+    def remove_songs(self, songs):
+        """Remove songs from the album"""
+
+        songs = self.songs.intersection(songs)
+        self.songs.difference_update(songs)
+        self.__update(removed=songs)
+
+    def songs_changed(self, songs):
+        """Call after tags of songs in the album have changed"""
+
+        self.__update(changed=self.songs.intersection(songs))
+
+    def __update(self, **kwargs):
+        self._update(**kwargs)
+        self.__dict__.pop("peoplesort", None)
+        self.__dict__.pop("genre", None)
+
     def __repr__(self):
         return "Album(%s)" % repr(self.key)
 
@@ -8,17 +8,31 @@
 
 from itertools import chain
 
-from gi.repository import GObject
+from gi.repository import GLib, GObject
+from senf import fsnative
 
 from quodlibet import config
 from quodlibet.plugins import PluginManager, PluginHandler
 from quodlibet.util.cover import built_in
-from quodlibet.util import print_d
+from quodlibet.util import print_d, print_exc
+from quodlibet.util.path import mtime, is_temp_path
 from quodlibet.util.thread import call_async
-from quodlibet.util.thumbnails import get_thumbnail_from_file
+from quodlibet.util.thumbnails import get_thumbnail_from_file, \
+    ThumbnailCache
 from quodlibet.plugins.cover import CoverSourcePlugin
 
 
+def _get_thumbnail(fileobj, boundary):
+    """Like get_thumbnail_from_file() but returns None on any error, so
+    the async callback always gets called.
+    """
+
+    try:
+        return get_thumbnail_from_file(fileobj, boundary)
+    except Exception:
+        print_exc()
+
+
 class CoverPluginHandler(PluginHandler):
     """A plugin handler for CoverSourcePlugin implementation"""
 
@@ -62,6 +76,9 @@ class CoverManager(GObject.Object):
     def __init__(self, use_built_in=True):
         super(CoverManager, self).__init__()
         self.plugin_handler = CoverPluginHandler(use_built_in)
+        self.thumbnail_cache = ThumbnailCache()
+        # (source, group) -> (stamp, cover path or None)
+        self._covers = {}
 
     def init_plugins(self):
         """Register the cover sources plugin handler with the global
@@ -83,6 +100,8 @@ class CoverManager(GObject.Object):
         to re-fetch the cover and do a display update.
         """
 
+        self._covers.clear()
+        self.thumbnail_cache.clear()
         self.emit("cover-changed", songs)
 
     def acquire_cover(self, callback, cancellable, song):
@@ -101,6 +120,8 @@ class CoverManager(GObject.Object):
             print_d('Successfully got cover from {0}'.format(name))
             source.disconnect_by_func(success)
             source.disconnect_by_func(failure)
+            # the cover might be there now
+            self._covers.clear()
             if not cancellable or not cancellable.is_cancelled():
                 callback(True, result)
 
@@ -157,10 +178,45 @@ class CoverManager(GObject.Object):
             # the same result for the same set of songs
             for key, group in sorted(groups.items()):
                 song = sorted(group, key=lambda s: s.key)[0]
-                cover = plugin(song).cover
+                cover = self._get_source_cover(plugin, key, song)
                 if cover:
                     return cover
 
+    def _get_source_cover(self, plugin, key, song):
+        """Returns the cover of the source for a song, remembering the
+        found path or that there is none for the group of the song.
+
+        Entries are valid as long as the mtimes of the song and its
+        directory don't change, or until cover_changed() is called.
+        """
+
+        if key is None:
+            # one group for all songs, so the result depends on the song
+            key = (None, song.key)
+        cache_key = (plugin, key)
+        stamp = (mtime(song("~dirname")), mtime(song("~filename")))
+
+        entry = self._covers.get(cache_key)
+        if entry is not None and entry[0] == stamp:
+            path = entry[1]
+            if path is None:
+                return None
+            try:
+                return open(path, "rb")
+            except EnvironmentError:
+                pass
+
+        cover = plugin(song).cover
+        path = getattr(cover, "name", None) if cover else None
+        if cover and (not isinstance(path, fsnative) or
+                      is_temp_path(path)):
+            # embedded images get extracted to a new temporary file
+            # each time, so only remember if there are none
+            self._covers.pop(cache_key, None)
+        else:
+            self._covers[cache_key] = (stamp, path)
+        return cover
+
     def get_cover(self, song):
         """Returns a cover file object for one song or None.
 
@@ -198,7 +254,17 @@ class CoverManager(GObject.Object):
         if fileobj is None:
             return
 
-        return get_thumbnail_from_file(fileobj, (width, height))
+        cache = self.thumbnail_cache
+        key = cache.get_key(fileobj, (width, height))
+        if key is not None:
+            pixbuf = cache.get(key)
+            if pixbuf is not None:
+                return pixbuf
+
+        pixbuf = get_thumbnail_from_file(fileobj, (width, height))
+        if key is not None and pixbuf is not None:
+            cache.put(key, pixbuf)
+        return pixbuf
 
     def get_pixbuf(self, song, width, height):
         """see get_pixbuf_many()"""
@@ -206,15 +272,37 @@ class CoverManager(GObject.Object):
         return self.get_pixbuf_many([song], width, height)
 
     def get_pixbuf_many_async(self, songs, width, height, cancel, callback):
-        """Async variant; callback gets called with a pixbuf or not called
-        in case of an error. cancel is a Gio.Cancellable.
+        """Async variant; callback gets called with a pixbuf or None in
+        case of an error. cancel is a Gio.Cancellable.
 
         The callback will be called in the main loop.
+
+        Returns False if there is no cover, in which case the callback
+        won't get called.
         """
 
         fileobj = self.get_cover_many(songs)
         if fileobj is None:
-            return
-
-        call_async(get_thumbnail_from_file, cancel, callback,
+            return False
+
+        cache = self.thumbnail_cache
+        key = cache.get_key(fileobj, (width, height))
+        if key is not None:
+            pixbuf = cache.get(key)
+            if pixbuf is not None:
+                def cached_cb():
+                    if not cancel.is_cancelled():
+                        callback(pixbuf)
+                    return False
+
+                GLib.idle_add(cached_cb, priority=GLib.PRIORITY_DEFAULT)
+                return True
+
+        def done_cb(pixbuf):
+            if key is not None and pixbuf is not None:
+                cache.put(key, pixbuf)
+            callback(pixbuf)
+
+        call_async(_get_thumbnail, cancel, done_cb,
                    args=(fileobj, (width, height)))
+        return True
@@ -10,12 +10,13 @@ import os
 import re
 import sys
 import errno
+import hashlib
 import tempfile
 import codecs
 import shlex
 
 from senf import fsnative, bytes2fsn, fsn2bytes, expanduser, sep, expandvars, \
-    fsn2text
+    fsn2text, gettempdir
 
 from quodlibet.compat import PY2, urlparse, text_type, quote, unquote, PY3
 from . import windows
@@ -267,6 +268,37 @@ def xdg_get_user_dirs():
         return {}
 
 
+def get_cache_folder(name):
+    """The per-user cache folder for `name`, might not exist"""
+
+    if os.name == "nt":
+        import quodlibet
+        return os.path.join(quodlibet.get_user_dir(), name)
+    return os.path.join(xdg_get_cache_home(), "quodlibet", name)
+
+
+def get_file_cache_key(filename):
+    """Returns a hex string identifying the content of the file by its
+    path, mtime and size, or None if the file can't be accessed.
+    """
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    data = fsn2bytes(filename, "utf-8") + \
+        (u"\0%r\0%d" % (stat.st_mtime, stat.st_size)).encode("ascii")
+    return hashlib.sha1(data).hexdigest()
+
+
+def is_temp_path(path):
+    """If the path is inside the temporary directory, like embedded images
+    which get extracted to a new temporary file each time.
+    """
+
+    return path.startswith(gettempdir().rstrip(sep) + sep)
+
+
 def get_temp_cover_file(data):
     """Returns a file object or None"""
 
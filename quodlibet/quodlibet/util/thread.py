@@ -7,11 +7,10 @@
 
 """Utils for executing things in a thread controlled from the main loop"""
 
+import threading
+import time
+from collections import deque
 from multiprocessing import cpu_count
-try:
-    from concurrent.futures import ThreadPoolExecutor
-except ImportError as e:
-    raise ImportError("python-futures is missing: %r" % e)
 
 from gi.repository import GLib
 
@@ -40,62 +39,234 @@ class Cancellable(object):
         self._cancelled = True
 
 
-_pools = {}
 _prio_mapping = {
     Priority.HIGH: GLib.PRIORITY_DEFAULT,
     Priority.BACKGROUND: GLib.PRIORITY_LOW,
 }
 
 
-def _get_pool(priority):
-    """Return a (shared) pool for a given priority"""
+class _Task(object):
 
-    global _pools
+    __slots__ = ("priority", "function", "args", "kwargs", "cancellable",
+                 "callback", "submitted", "finished")
 
-    if not priority in _pools:
-        try:
-            cpus = cpu_count()
-        except NotImplementedError:
-            cpus = 2
-        max_workers = int(cpus * 1.5)
-        _pools[priority] = ThreadPoolExecutor(max_workers)
-    return _pools[priority]
+    def __init__(self, priority, function, cancellable, callback, args,
+                 kwargs):
+        self.priority = priority
+        self.function = function
+        self.cancellable = cancellable
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted = time.time()
+        self.finished = None
 
+    def is_cancelled(self):
+        return self.cancellable.is_cancelled()
 
-def _wrap_function(function, cancellable, args, kwargs):
-
-    def wrap():
-        # check once we are scheduled
-        if not cancellable.is_cancelled():
-            try:
-                return function(*args, **kwargs)
-            except:
-                # ThreadPool catches the exception for the async result
-                # which we don't use. Print instead as if it was not catched.
-                util.print_exc()
-                raise
-
-    return wrap
 
+class _Histogram(object):
 
-def _wrap_callback(priority, cancellable, callback):
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
 
-    def callback_main(cancellable, callback, result):
-        if not cancellable.is_cancelled():
-            callback(result)
-        return False
+    def add(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
 
-    def callback_thread(future):
-        global _prio_mapping
 
-        result = future.result()
+class TaskScheduler(object):
+    """Runs functions in worker threads and passes the results to callbacks
+    in the main loop.
 
-        if not cancellable.is_cancelled():
-            glib_priority = _prio_mapping[priority]
-            GLib.idle_add(callback_main, cancellable, callback, result,
-                          priority=glib_priority)
+    Queued tasks with a higher priority get started first and each priority
+    can only use a limited number of workers, so background tasks can't
+    block all of them. Results get delivered in batches, one idle callback per
+    priority, which hands control back to the main loop after
+    `DELIVERY_TIME` seconds.
+    """
 
-    return callback_thread
+    DELIVERY_TIME = 0.01
+    """Time in seconds after which result delivery pauses"""
+
+    LATENCY_BOUNDS = (0.001, 0.01, 0.1, 1.0, 10.0)
+    """Upper bounds in seconds of the latency histogram buckets"""
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._threads = []
+        self._queues = dict((p, deque()) for p in Priority.values)
+        self._running = dict((p, 0) for p in Priority.values)
+        self._results = dict((p, deque()) for p in Priority.values)
+        self._delivering = set()
+        self._wait_times = dict(
+            (p, _Histogram(self.LATENCY_BOUNDS)) for p in Priority.values)
+        self._delivery_times = dict(
+            (p, _Histogram(self.LATENCY_BOUNDS)) for p in Priority.values)
+
+    def submit(self, priority, function, cancellable, callback, args=(),
+               kwargs=None):
+        """Queue `function` to be called with args/kwargs, `callback` gets
+        called with the result in the main loop unless the task got
+        cancelled.
+
+        If `function` raises, the error gets printed and `callback` doesn't
+        get called. Callers which need to know about failures have to
+        catch them in `function` and return something to signal them.
+        """
+
+        task = _Task(priority, function, cancellable, callback, args,
+                     kwargs or {})
+
+        with self._cond:
+            self._queues[priority].append(task)
+
+            threads = len(self._threads)
+            queued = sum(len(q) for q in self._queues.values())
+            idle = threads - sum(self._running.values())
+            if idle < queued and \
+                    threads < self._max_workers * len(Priority.values):
+                thread = threading.Thread(
+                    target=self._work, args=(self._generation,))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+
+    def terminate(self):
+        """Drop all queued tasks and results and let all workers exit once
+        they are done with their current task.
+        """
+
+        with self._cond:
+            self._generation += 1
+            self._threads = []
+            for queue in self._queues.values():
+                queue.clear()
+            for results in self._results.values():
+                results.clear()
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """Returns a dict with the number of queued and running tasks, and
+        histograms of the time tasks waited in the queue and of the time
+        from finishing to the callback, per priority.
+
+        The histograms are lists of counts for the `LATENCY_BOUNDS` buckets
+        plus one for everything longer.
+        """
+
+        with self._cond:
+            return {
+                "threads": len(self._threads),
+                "queued": dict(
+                    (p, len(q)) for p, q in self._queues.items()),
+                "running": dict(self._running),
+                "wait": dict(
+                    (p, list(h.counts))
+                    for p, h in self._wait_times.items()),
+                "delivery": dict(
+                    (p, list(h.counts))
+                    for p, h in self._delivery_times.items()),
+            }
+
+    def _pop(self):
+        for priority in sorted(self._queues):
+            if self._running[priority] >= self._max_workers:
+                continue
+            queue = self._queues[priority]
+            while queue:
+                task = queue.popleft()
+                if task.is_cancelled():
+                    continue
+                return task
+
+    def _work(self, generation):
+        cond = self._cond
+
+        with cond:
+            while True:
+                if generation != self._generation:
+                    return
+                task = self._pop()
+                if task is None:
+                    cond.wait()
+                    continue
+
+                priority = task.priority
+                self._running[priority] += 1
+                self._wait_times[priority].add(time.time() - task.submitted)
+                cond.release()
+                try:
+                    result = task.function(*task.args, **task.kwargs)
+                except Exception:
+                    util.print_exc()
+                    failed = True
+                else:
+                    failed = False
+                finally:
+                    cond.acquire()
+                    self._running[priority] -= 1
+
+                if failed or task.is_cancelled() or \
+                        generation != self._generation:
+                    # a priority might be below its limit again
+                    cond.notify()
+                    continue
+
+                task.finished = time.time()
+                self._results[priority].append((task, result))
+                if priority not in self._delivering:
+                    self._delivering.add(priority)
+                    GLib.idle_add(self._deliver, priority,
+                                  priority=_prio_mapping[priority])
+                cond.notify()
+
+    def _deliver(self, priority):
+        results = self._results[priority]
+        histogram = self._delivery_times[priority]
+        start = time.time()
+
+        while True:
+            with self._cond:
+                if not results:
+                    self._delivering.discard(priority)
+                    return False
+                task, result = results.popleft()
+                histogram.add(time.time() - task.finished)
+
+            if not task.is_cancelled():
+                try:
+                    task.callback(result)
+                except Exception:
+                    util.print_exc()
+
+            if time.time() - start > self.DELIVERY_TIME:
+                return True
+
+
+_scheduler = None
+
+
+def _get_scheduler():
+    """Returns the shared scheduler"""
+
+    global _scheduler
+
+    if _scheduler is None:
+        try:
+            cpus = cpu_count()
+        except NotImplementedError:
+            cpus = 2
+        _scheduler = TaskScheduler(int(cpus * 1.5))
+    return _scheduler
 
 
 def _call_async(priority, function, cancellable, callback, args, kwargs):
@@ -108,34 +279,35 @@ def _call_async(priority, function, cancellable, callback, args, kwargs):
     if kwargs is None:
         kwargs = {}
 
-    pool = _get_pool(priority)
-    wrapped_func = _wrap_function(function, cancellable, args, kwargs)
-    wrapped_callback = _wrap_callback(priority, cancellable, callback)
-    future = pool.submit(wrapped_func)
-    future.add_done_callback(wrapped_callback)
+    _get_scheduler().submit(
+        priority, function, cancellable, callback, args, kwargs)
 
 
 def terminate_all():
-    """Terminate all pools, doesn't wait for task completion.
+    """Terminate all workers, doesn't wait for task completion.
 
     Can be called multiple times and call_async() etc. can still be used.
     """
 
-    global _pools
+    if _scheduler is not None:
+        _scheduler.terminate()
+
+
+def get_stats():
+    """Returns the statistics of the shared scheduler, see
+    `TaskScheduler.get_stats`
+    """
 
-    for key, pool in list(_pools.items()):
-        del _pools[key]
-        pool.shutdown(wait=False)
+    return _get_scheduler().get_stats()
 
 
 def call_async(function, cancellable, callback, args=None, kwargs=None):
-    """Call `function` in a thread that gets passed the `cancellable`
-    and the passed args/kwargs.
+    """Call `function` in a thread with the passed args/kwargs.
 
     The return value will get passed to `callback` which will be called
     in the main thread. It will not be called if the `cancellable` gets
     cancelled and is not guaranteed to be called at all (on event loop
-    shutdown for example)
+    shutdown for example). It will also not be called if `function` raises.
     """
 
     _call_async(Priority.HIGH, function, cancellable, callback, args, kwargs)
@@ -6,14 +6,16 @@
 # published by the Free Software Foundation
 
 import os
-import tempfile
 import hashlib
+import threading
+from collections import OrderedDict
 
 from gi.repository import GdkPixbuf, GLib
 from senf import fsn2uri, fsnative
 
 import quodlibet
-from quodlibet.util.path import mtime, mkdir, xdg_get_cache_home
+from quodlibet.util.path import mtime, mkdir, xdg_get_cache_home, \
+    is_temp_path
 from quodlibet.util import enum
 from quodlibet.qltk.image import scale
 
@@ -97,6 +99,92 @@ def get_thumbnail_from_file(fileobj, boundary):
             pass
 
 
+class ThumbnailCache(object):
+    """A LRU cache for thumbnail pixbufs in memory, bounded by the size of
+    their pixel data.
+
+    Images get identified by path, mtime and the boundary they were loaded
+    for, so changed files don't return old thumbnails. Thread-safe.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        """Pixel data size in bytes above which old pixbufs get dropped"""
+
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._pixbufs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pixbufs)
+
+    @property
+    def size(self):
+        """The pixel data size of all cached pixbufs in bytes"""
+
+        return self._size
+
+    def get_key(self, fileobj, boundary):
+        """Returns a cache key for the image file of `fileobj` or None
+        if it can't be cached, like for temporary files.
+        """
+
+        path = getattr(fileobj, "name", None)
+        if not isinstance(path, fsnative):
+            return None
+
+        # embedded covers get extracted to a new temporary file each time
+        if is_temp_path(path):
+            return None
+
+        path_mtime = mtime(path)
+        if path_mtime == 0:
+            return None
+
+        return (path, path_mtime, tuple(boundary))
+
+    def get(self, key):
+        """Returns the pixbuf for the key or None"""
+
+        with self._lock:
+            pixbuf = self._pixbufs.pop(key, None)
+            if pixbuf is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pixbufs[key] = pixbuf
+            return pixbuf
+
+    def put(self, key, pixbuf):
+        """Adds a pixbuf, dropping the least recently used ones if the
+        cache gets too large.
+        """
+
+        size = pixbuf.get_rowstride() * pixbuf.get_height()
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._pixbufs.pop(key, None)
+            if old is not None:
+                self._size -= old.get_rowstride() * old.get_height()
+            self._pixbufs[key] = pixbuf
+            self._size += size
+
+            while self._size > self.max_bytes:
+                key, old = self._pixbufs.popitem(last=False)
+                self._size -= old.get_rowstride() * old.get_height()
+
+    def clear(self):
+        """Drops all pixbufs, keeps the counters"""
+
+        with self._lock:
+            self._pixbufs.clear()
+            self._size = 0
+
+
 def get_thumbnail(path, boundary):
     """Get a thumbnail pixbuf of an image at `path`.
 
@@ -123,7 +211,7 @@ def get_thumbnail(path, boundary):
 
     # embedded thumbnails come from /tmp/
     # FIXME: move this to another layer
-    if path.startswith(tempfile.gettempdir()):
+    if is_temp_path(path):
         return new_from_file_at_size(path, width, height)
 
     thumb_path, thumb_size = get_cache_info(path, boundary)
@@ -57,3 +57,27 @@ class TDuplicates(PluginTestCase):
     def test_starts_up(self):
         sws = [SongWrapper(s) for s in app.library.songs]
         self.plugin.plugin_songs(sws)
+
+    def test_index(self):
+        songs = [AudioFile({'~filename': '/music/%d.ogg' % i,
+                            'artist': artist, 'title': u'no'})
+                 for i, artist in enumerate([u'foo BAR', u'föo bár', u'x'])]
+        app.library.add(songs[:2])
+        index = self.mod.Duplicates.get_index()
+        key = index.get_key(songs[0])
+        self.assertEqual(index.find(key), set(songs[:2]))
+        app.library.add(songs[2:])
+        songs[2]['artist'] = u'Foo bar'
+        app.library.changed(songs[2:])
+        self.assertEqual(index.find(key), set(songs))
+        app.library.remove(songs[:1])
+        self.assertEqual(index.find(key), set(songs[1:]))
+        self.assertTrue(self.mod.Duplicates.get_index() is index)
+
+    def test_disabled(self):
+        index = self.mod.Duplicates.get_index()
+        self.plugin.disabled()
+        self.assertTrue(self.mod._index is None)
+        app.library.add([AudioFile({'~filename': '/music/x.ogg',
+                                    'artist': u'foo bar', 'title': u'no'})])
+        self.assertEqual(index.find(index.get_key(self.song)), set())
@@ -5,9 +5,12 @@
 # it under the terms of version 2 of the GNU General Public License as
 # published by the Free Software Foundation.
 
+import os
+import shutil
 import time
 
 from gi.repository import Gtk
+from senf import fsnative
 
 try:
     from gi.repository import Gst
@@ -20,9 +23,9 @@ else:
 
 
 from tests.plugin import PluginTestCase
-from tests import skipUnless, get_data_path
+from tests import skipUnless, get_data_path, mkdtemp
 from quodlibet import config
-from quodlibet.formats import MusicFile
+from quodlibet.formats import MusicFile, AudioFile
 
 
 @skipUnless(Gst and chromaprint and vorbisdec, "gstreamer plugins missing")
@@ -80,6 +83,57 @@ class TFingerprint(PluginTestCase):
         self.assertEqual(events[1][-1], "error")
 
 
+@skipUnless(Gst and chromaprint, "gstreamer plugins missing")
+class TFingerPrintCache(PluginTestCase):
+
+    def setUp(self):
+        config.init()
+        self.mod = self.modules["AcoustidSearch"]
+        self.temp = mkdtemp()
+        self.filename = os.path.join(self.temp, fsnative(u"song.ogg"))
+        with open(self.filename, "wb") as h:
+            h.write(b"foo")
+        self.song = AudioFile({"~filename": self.filename})
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+        config.quit()
+
+    def test_get_put(self):
+        analyze = self.mod.analyze
+        cache = analyze.FingerPrintCache(
+            os.path.join(self.temp, fsnative(u"cache")))
+        self.assertTrue(cache.get(self.song) is None)
+        cache.put(analyze.FingerPrintResult(self.song, u"AQAAfoo", 12.5))
+        result = cache.get(self.song)
+        self.assertTrue(result.song is self.song)
+        self.assertEqual(result.chromaprint, u"AQAAfoo")
+        self.assertEqual(result.length, 12.5)
+
+    def test_pool_cached(self):
+        analyze = self.mod.analyze
+        cache = analyze.FingerPrintCache(
+            os.path.join(self.temp, fsnative(u"cache")))
+        cache.put(analyze.FingerPrintResult(self.song, u"AQAAfoo", 12.5))
+        pool = analyze.FingerPrintPool(cache=cache)
+
+        events = []
+
+        def handler(*args):
+            events.append(args)
+
+        pool.connect("fingerprint-started", handler, "start")
+        pool.connect("fingerprint-done", handler, "done")
+        pool.push(self.song)
+        while Gtk.events_pending():
+            Gtk.main_iteration_do(False)
+
+        self.assertEqual([e[-1] for e in events], ["start", "done"])
+        self.assertEqual(events[1][1].chromaprint, u"AQAAfoo")
+        self.assertTrue(pool.throughput > 0)
+        pool.stop()
+
+
 @skipUnless(Gst and chromaprint, "gstreamer plugins missing")
 class TAcoustidLookup(PluginTestCase):
 
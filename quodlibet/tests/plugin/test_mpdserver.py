@@ -7,6 +7,7 @@
 
 import os
 import socket
+import time
 
 from senf import fsnative
 from gi.repository import Gtk
@@ -15,7 +16,7 @@ from quodlibet.formats import AudioFile
 from quodlibet import app
 from quodlibet import config
 from tests.plugin import PluginTestCase, init_fake_app, destroy_fake_app
-from tests import skipIf
+from tests import skip, skipIf
 
 
 @skipIf(os.name == "nt", "mpd server not supported under Windows")
@@ -71,7 +72,6 @@ class TMPDCommands(PluginTestCase):
         init_fake_app()
 
         MPDServerPlugin = self.mod.MPDServerPlugin
-        MPDConnection = self.mod.main.MPDConnection
         MPDService = self.mod.main.MPDService
 
         class Server(object):
@@ -80,16 +80,19 @@ class TMPDCommands(PluginTestCase):
             def _remove_connection(self, conn):
                 pass
 
-        server = Server()
+        self.server = Server()
+        self.s, self.conn = self._connect()
+
+    def _connect(self):
         s, c = socket.socketpair()
-        self.s = s
         c.setblocking(False)
         s.settimeout(1)
-        self.conn = MPDConnection(server, c)
-        self.conn.handle_init(server)
+        conn = self.mod.main.MPDConnection(self.server, c)
+        conn.handle_init(self.server)
         while Gtk.events_pending():
             Gtk.main_iteration_do(True)
-        self.s.recv(9999)
+        s.recv(9999)
+        return s, conn
 
     def _cmd(self, data):
         self.s.send(data)
@@ -99,6 +102,7 @@ class TMPDCommands(PluginTestCase):
             return self.s.recv(99999)
 
     def tearDown(self):
+        self.server.service.destroy()
         destroy_fake_app()
         config.quit()
 
@@ -121,6 +125,129 @@ class TMPDCommands(PluginTestCase):
         for cmd in cmds:
             self._cmd(cmd.encode("ascii") + b"\n")
 
+    def test_database(self):
+        songs = []
+        for i, artist in enumerate([u"foo", u"bar", u"Foo Bar"]):
+            song = AudioFile({
+                "~filename": fsnative(u"/music/%s/%d.ogg" % (artist, i)),
+                "artist": artist,
+                "album": u"album%d" % (i % 2),
+                "~#length": 10,
+            })
+            songs.append(song)
+        app.library.add(songs)
+
+        response = self._cmd(b"find artist foo\n")
+        assert b"file: music/foo/0.ogg\n" in response
+        assert b"file: music/bar/1.ogg\n" not in response
+        assert response.endswith(b"OK\n")
+
+        response = self._cmd(b"search Artist \"foo\"\n")
+        assert response.count(b"file: ") == 2
+
+        response = self._cmd(b"find artist bar album album1\n")
+        assert response.count(b"file: ") == 1
+
+        response = self._cmd(b"count album album0\n")
+        assert response == b"songs: 2\nplaytime: 20\nOK\n"
+
+        response = self._cmd(b"list album\n")
+        assert response == b"Album: album0\nAlbum: album1\nOK\n"
+
+        response = self._cmd(b"list artist album album1\n")
+        assert response == b"Artist: bar\nOK\n"
+
+        response = self._cmd(b"lsinfo music\n")
+        assert b"directory: music/foo\n" in response
+        assert b"file: " not in response
+
+        response = self._cmd(b"listallinfo\n")
+        assert response.count(b"file: ") == 3
+
+        response = self._cmd(b"lsinfo nope\n")
+        assert response.startswith(b"ACK [50]")
+
+        response = self._cmd(b"find nope foo\n")
+        assert response.startswith(b"ACK [2]")
+
+        songs[1]["artist"] = u"foo"
+        app.library.changed(songs[1:2])
+        response = self._cmd(b"find artist foo\n")
+        assert b"file: music/bar/1.ogg\n" in response
+        response = self._cmd(b"find artist bar\n")
+        assert response == b"OK\n"
+
+        assert b"db_playtime: 30\n" in self._cmd(b"stats\n")
+        songs[1]["~#length"] = 20
+        app.library.changed(songs[1:2])
+        assert b"db_playtime: 40\n" in self._cmd(b"stats\n")
+        app.library.remove(songs[2:])
+        assert b"db_playtime: 30\n" in self._cmd(b"stats\n")
+
+        app.library.remove(songs[:2])
+        response = self._cmd(b"find artist foo\n")
+        assert response == b"OK\n"
+
+    def test_pipelined(self):
+        songs = [AudioFile({"~filename": fsnative(u"/music/%d.ogg" % i)})
+                 for i in range(5)]
+        app.library.add(songs)
+
+        main = self.mod.main
+        old_step = main._SONGS_PER_STEP
+        main._SONGS_PER_STEP = 2
+        try:
+            response = self._cmd(b"ping\nlistall\nrepeat 1\nstatus\n")
+        finally:
+            main._SONGS_PER_STEP = old_step
+
+        lines = response.decode("utf-8").splitlines()
+        assert lines[:3] == [u"OK", u"directory: music", u"file: music/0.ogg"]
+        assert lines.count(u"OK") == 4
+        assert u"repeat: 1" in lines[lines.index(u"file: music/4.ogg"):]
+
+    def test_status_cache(self):
+        response = self._cmd(b"status\n")
+        assert b"repeat: 0\n" in response
+        assert self._cmd(b"status\n") == response
+        self._cmd(b"repeat 1\n")
+        assert b"repeat: 1\n" in self._cmd(b"status\n")
+
+    @skip("Enable for basic benchmarking of the MPD server")
+    def test_many_clients(self):
+        num_clients = 20
+        num_rounds = 50
+
+        app.library.add([
+            AudioFile({"~filename": fsnative(u"/music/%d/%d.ogg" % (i, j)),
+                       "artist": u"artist%d" % i, "~#length": 100})
+            for i in range(50) for j in range(100)])
+        app.player.go_to(AudioFile({"~filename": fsnative(u"/x.ogg")}))
+
+        clients = [self._connect() for i in range(num_clients)]
+        requests = [
+            b"status\ncurrentsong\n",
+            b"command_list_begin\nstatus\nplaylistinfo\n"
+            b"command_list_end\n",
+            b"find artist artist1\n",
+        ]
+
+        t = time.time()
+        for i in range(num_rounds):
+            for j, (s, conn) in enumerate(clients):
+                s.send(requests[(i + j) % len(requests)])
+            for s, conn in clients:
+                data = b""
+                while not data.endswith(b"OK\n"):
+                    while Gtk.events_pending():
+                        Gtk.main_iteration_do(True)
+                    data += s.recv(99999)
+        print("%d requests: %.3f" % (num_clients * num_rounds,
+                                     time.time() - t))
+
+        for s, conn in clients:
+            conn.close()
+
     def test_idle_close(self):
         for cmd in ["idle", "noidle", "close"]:
             self._cmd(cmd.encode("ascii") + b"\n")
@@ -6,14 +6,17 @@
 # published by the Free Software Foundation.
 
 from gi.repository import Gtk
+import os
 import re
+import shutil
 import time
+from senf import fsnative
 from quodlibet.ext.songsmenu.replaygain import UpdateMode
 from quodlibet.formats import MusicFile
 from quodlibet.formats import AudioFile
 
 from tests.plugin import PluginTestCase
-from tests import get_data_path
+from tests import get_data_path, mkdtemp
 
 
 class TReplayGain(PluginTestCase):
@@ -64,6 +67,36 @@ class TReplayGain(PluginTestCase):
         self.failIf(rga.done)
         self.failUnlessEqual(rga.title, 'foo - the album')
 
+    def test_cache(self):
+        temp = mkdtemp()
+        try:
+            songs = []
+            for name in [u"a.ogg", u"b.ogg"]:
+                filename = os.path.join(temp, fsnative(name))
+                with open(filename, "wb") as h:
+                    h.write(b"foo")
+                songs.append(AudioFile({"~filename": filename}))
+
+            cache = self.mod.RGCache(os.path.join(temp, fsnative(u"rg.db")))
+            album = self.mod.RGAlbum.from_songs(songs)
+            self.failIf(cache.lookup(album))
+            album.gain, album.peak = -2.5, 0.75
+            for i, rgs in enumerate(album.songs):
+                rgs.gain, rgs.peak, rgs.done = -i, 0.5, True
+            cache.store(album)
+
+            album = self.mod.RGAlbum.from_songs(songs)
+            self.failUnless(cache.lookup(album))
+            self.failUnless(album.done)
+            self.failUnlessEqual((album.gain, album.peak), (-2.5, 0.75))
+            self.failUnlessEqual(album.songs[1].gain, -1)
+
+            # different album, different album gain
+            self.failIf(cache.lookup(self.mod.RGAlbum.from_songs(songs[:1])))
+            cache.close()
+        finally:
+            shutil.rmtree(temp)
+
     def test_delete_bs1770gain(self):
         tags = ["replaygain_reference_loudness", "replaygain_algorithm",
                 "replaygain_album_range", "replaygain_track_range"]
@@ -6,6 +6,12 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+import os
+import shutil
+
+from senf import fsnative
+
+from tests import mkdtemp
 from tests.plugin import PluginTestCase
 from tests.helper import visible
 
@@ -33,3 +39,67 @@ class TWaveformSeekBar(PluginTestCase):
         with visible(scale):
             scale.compute_redraw_interval()
             scale.compute_redraw_area()
+
+
+class TWaveformCache(PluginTestCase):
+
+    def setUp(self):
+        self.mod = self.modules["WaveformSeekBar"]
+        self.temp = mkdtemp()
+        self.filename = os.path.join(self.temp, fsnative(u"song.ogg"))
+        with open(self.filename, "wb") as h:
+            h.write(b"foo")
+        self.song = AudioFile({"~filename": self.filename})
+        self.cache = self.mod.WaveformCache(
+            os.path.join(self.temp, fsnative(u"cache")))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp)
+        del self.mod
+
+    def test_resample(self):
+        resample = self.mod.resample
+        self.assertEqual(resample([1, 3, 5, 7], 2), [2, 6])
+        self.assertEqual(resample([1, 3], 4), [1, 1, 3, 3])
+        self.assertEqual(resample([], 4), [])
+
+    def test_get_put(self):
+        cache = self.cache
+        self.assertEqual(cache.get(self.song, 4), None)
+        cache.put(self.song, 4, [0.0, 0.5, 1.0, 0.25])
+        values = cache.get(self.song, 4)
+        self.assertEqual(len(values), 4)
+        self.assertAlmostEqual(values[1], 0.5, places=4)
+        self.assertEqual(len(cache.get(self.song, 2)), 2)
+        self.assertEqual(len(cache.get(self.song, 8)), 8)
+
+    def test_other_resolutions_removed(self):
+        cache = self.cache
+        cache.put(self.song, 4, [0.5] * 4)
+        cache.put(self.song, 8, [0.5] * 8)
+        self.assertEqual(len(cache._list_entries()), 1)
+        self.assertEqual(len(cache.get(self.song, 4)), 4)
+
+    def test_prune(self):
+        cache = self.cache
+        songs = []
+        for i in range(4):
+            filename = os.path.join(self.temp, fsnative(u"%d.ogg" % i))
+            with open(filename, "wb") as h:
+                h.write(b"foo")
+            songs.append(AudioFile({"~filename": filename}))
+
+        cache.MAX_SIZE = 3 * (cache.HEADER.size + 2 * 100)
+        for i, song in enumerate(songs[:3]):
+            cache.put(song, 100, [0.5] * 100)
+            folder, prefix = cache._get_base(song)
+            os.utime(os.path.join(folder, prefix + "100"), (i, i))
+        self.assertEqual(len(cache._list_entries()), 3)
+
+        # the least recently used ones get removed
+        cache.put(songs[3], 100, [0.5] * 100)
+        self.assertEqual(cache.get(songs[0], 100), None)
+        self.assertEqual(cache.get(songs[1], 100), None)
+        self.assertTrue(cache.get(songs[2], 100))
+        self.assertTrue(cache.get(songs[3], 100))
+        self.assertTrue(cache._size <= cache.MAX_SIZE)
@@ -15,10 +15,11 @@ from quodlibet.browsers._base import DisplayPatternMixin
 from . import TestCase
 from .helper import realized
 
+from quodlibet import app
 from quodlibet import config
 
 from quodlibet.browsers.albums import AlbumList
-from quodlibet.browsers.albums.models import AlbumItem
+from quodlibet.browsers.albums.models import AlbumItem, CoverLoader
 from quodlibet.browsers.albums.prefs import Preferences, DEFAULT_PATTERN_TEXT
 from quodlibet.browsers.albums.main import (compare_title, compare_artist,
     compare_genre, compare_rating, compare_date)
@@ -125,6 +126,65 @@ class TAlbumSort(TestCase):
         self.assertOrder(compare_rating, [AlbumItem(None), a, b, c, n])
 
 
+class TCoverLoader(TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self._manager = app.cover_manager
+
+        class Manager(object):
+
+            def get_pixbuf_many_async(manager, songs, width, height, cancel,
+                                      callback):
+                self.requests.append((songs, cancel, callback))
+                return True
+
+        app.cover_manager = Manager()
+        self.loader = CoverLoader()
+        self.loader.MAX_LOADING = 1
+        self.items = []
+        for song in SONGS:
+            album = Album(song)
+            album.songs.add(song)
+            self.items.append(AlbumItem(album))
+
+    def tearDown(self):
+        self.loader.cancel_all()
+        app.cover_manager = self._manager
+
+    def test_merge(self):
+        results = []
+        loader = self.loader
+        loader.request(self.items[0], 10, results.append)
+        loader.request(self.items[1], 10, results.append)
+        loader.request(self.items[1], 10, results.append)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(len(loader), 2)
+        self.requests[0][2]("a")
+        self.assertEqual(results, ["a"])
+        self.requests[1][2]("b")
+        self.assertEqual(results, ["a", "b", "b"])
+        self.assertEqual(len(loader), 0)
+
+    def test_visible(self):
+        loader = self.loader
+        items = self.items
+        loader.set_visible(items[1:3])
+        for item in items:
+            item.scanned = True
+            loader.request(item, 10, lambda p: None)
+        self.assertEqual(len(self.requests), 1)
+        # the first request starts right away, then visible ones go first
+        self.requests[0][2](None)
+        self.assertTrue(self.requests[1][0] is items[1].album.songs)
+
+        loader.set_visible(items[2:])
+        self.assertTrue(self.requests[1][1].is_cancelled())
+        self.assertFalse(items[1].scanned)
+        self.assertTrue(items[3].scanned)
+        self.assertTrue(self.requests[2][0] is items[2].album.songs)
+
+
 class TAlbumBrowser(TestCase):
 
     def setUp(self):
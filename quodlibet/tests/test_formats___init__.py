@@ -14,8 +14,8 @@ from .helper import capture_output
 
 from quodlibet import formats
 from quodlibet.formats import AudioFile, load_audio_files, dump_audio_files, \
-    SerializationError
-from quodlibet.compat import PY3, long
+    SerializationError, load_audio_files_from_file
+from quodlibet.compat import PY3, long, cBytesIO
 from quodlibet.util.picklehelper import pickle_dumps
 from quodlibet import config
 
@@ -99,6 +99,21 @@ class TPickle(TestCase):
             assert len(items) == len(formats.types)
             assert all(isinstance(i, AudioFile) for i in items)
 
+    def test_load_audio_files_from_file(self):
+        data = pickle_dumps(self.instances, 2)
+        items = load_audio_files_from_file(cBytesIO(data))
+        assert len(items) == len(formats.types)
+        assert all(isinstance(i, AudioFile) for i in items)
+
+    def test_load_audio_files_shared_keys(self):
+        if not PY3:
+            return
+
+        data = dump_audio_files(
+            [AudioFile({"title": u"foo"}), AudioFile({"title": u"bar"})])
+        a, b = load_audio_files(data)
+        assert list(a.keys())[0] is list(b.keys())[0]
+
     def test_sanitized_py3(self):
         i = AudioFile.__new__(list(formats.types)[0])
         # this is something that old py2 versions could pickle
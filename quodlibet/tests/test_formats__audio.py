@@ -674,6 +674,36 @@ class TAudioFile(TestCase):
             afile.sanitize(fsnative(u'/dir/fn'))
             self.failUnlessEqual(afile.album_key, expected)
 
+    def test_search_text(self):
+        afile = AudioFile({"title": u"A\u0308", "~#track": 1})
+        afile.sanitize(fsnative(u'/dir/fn'))
+        self.assertEqual(afile.search_text("title"), u"\xc4")
+        self.assertEqual(afile.search_text("artist"), u"")
+        self.assertEqual(afile.search_text("filename"), u"/dir/fn")
+        self.assertEqual(afile.search_text("~basename"), u"fn")
+        afile["title"] = u"foo"
+        self.assertEqual(afile.search_text("title"), u"foo")
+        afile["~filename"] = fsnative(u"/other/fn")
+        self.assertEqual(afile.search_text("~dirname"), u"/other")
+        del afile["title"]
+        self.assertEqual(afile.search_text("title"), u"")
+
+    def test_search_text_dict_methods(self):
+        afile = AudioFile({"title": u"foo"})
+        self.assertEqual(afile.search_text("title"), u"foo")
+        afile.update({"title": u"bar"})
+        self.assertEqual(afile.search_text("title"), u"bar")
+        afile.pop("title")
+        self.assertEqual(afile.search_text("title"), u"")
+        afile.setdefault("title", u"baz")
+        self.assertEqual(afile.search_text("title"), u"baz")
+        afile.popitem()
+        self.assertEqual(afile.search_text("title"), u"")
+        afile["title"] = u"foo"
+        self.assertEqual(afile.search_text("title"), u"foo")
+        afile.clear()
+        self.assertEqual(afile.search_text("title"), u"")
+
     def test_eq_ne(self):
         self.failIf(AudioFile({"a": "b"}) == AudioFile({"a": "b"}))
         self.failUnless(AudioFile({"a": "b"}) != AudioFile({"a": "b"}))
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation
+
+import time
+
+from senf import fsnative
+
+from tests import TestCase
+
+from quodlibet import config
+from quodlibet.formats import AudioFile
+from quodlibet.library import SongLibrary
+from quodlibet.library.index import fold_text, get_trigrams
+from quodlibet.query import Query
+
+
+def AF(filename, **kwargs):
+    song = AudioFile(kwargs)
+    song["~filename"] = fsnative(filename)
+    return song
+
+
+SONGS = [
+    AF(u"/a/one.ogg", title=u"Föhn", artist=u"Bar Baz", album=u"ÆON"),
+    AF(u"/a/two.ogg", title=u"foehn", artist=u"BAR", album=u"aeon flux"),
+    AF(u"/a/three.ogg", title=u"Don’t Stop", artist=u"Ünïcödé",
+       genre=u"Rock\nPop"),
+    AF(u"/b/four.ogg", title=u"dont stop", artist=u"Unicode Orchestra"),
+    AF(u"/b/five.ogg", title=u"Straße", artist=u"STRASSE"),
+    AF(u"/b/six.ogg", title=u"ΣΊΣΥΦΟΣ", artist=u"σίσυφος"),
+]
+
+QUERIES = [
+    u"föhn", u"fohn", u"foehn", u"bar", u"BAZ", u"aeon", u"æon", u"dont",
+    u"don't", u"don’t", u"unicode", u"ünïcödé", u"strasse", u"straße",
+    u"σίσυφος", u"ΣΊΣΥΦΟΣ", u"title=stop", u"title=/st.p/", u"genre=pop",
+    u"genre=/^pop$/", u"artist=|(bar, uni)", u"artist=&(bar, baz)",
+    u"!bar", u"~filename=/a/", u"~dirname=b", u"~people=orch",
+    u"#(playcount < 3)", u"&(bar, !baz)", u"|(bar, stop)", u"xyz",
+]
+
+
+class TSearchIndex(TestCase):
+
+    def setUp(self):
+        self.library = SongLibrary()
+        self.library.add(SONGS)
+        self.library.enable_index()
+
+    def tearDown(self):
+        self.library.destroy()
+
+    def _check(self):
+        for text in QUERIES:
+            query = Query(text, star=["artist", "album", "title"])
+            expected = set(filter(query.search, self.library.values()))
+            self.assertEqual(
+                set(self.library.filter_query(query)), expected, msg=text)
+
+    def test_same_results(self):
+        self._check()
+
+    def test_narrows(self):
+        query = Query(u"foehn", star=["title"])
+        candidates = query.candidates(self.library.index)
+        self.assertEqual(len(candidates), 2)
+        self.assertEqual(Query(u"!bar").candidates(self.library.index), None)
+
+    def test_lazy_tags(self):
+        self.assertEqual(self.library.index.tags, [])
+        self.library.query(u"foo", star=["title"])
+        self.assertEqual(self.library.index.tags, ["title"])
+
+    def test_signals(self):
+        self._check()
+        song = AF(u"/c/seven.ogg", title=u"Föhn Again")
+        self.library.add([song])
+        self._check()
+        song["title"] = u"Other"
+        self.library.changed([song])
+        self._check()
+        self.library.remove(SONGS[:2])
+        self._check()
+        self.library.add(SONGS[:2])
+        self._check()
+
+    def test_destroy(self):
+        index = self.library.index
+        self.library.destroy()
+        self.assertTrue(self.library.index is None)
+        self.assertEqual(index.tags, [])
+
+
+NOW = time.time()
+
+NUMERIC_SONGS = [
+    AF(u"/n/one.ogg", **{"~#playcount": 3, "~#added": NOW - 3600,
+                         "~#rating": 1.0}),
+    AF(u"/n/two.ogg", **{"~#playcount": 0, "~#added": NOW - 86400 * 10}),
+    AF(u"/n/three.ogg", **{"~#length": 200.5, "~#added": NOW - 86400 * 3,
+                           "~#rating": 0.25}),
+    AF(u"/n/four.ogg", **{"~#playcount": 1, "~#length": 10}),
+    AF(u"/n/five.ogg", **{"~#skipcount": 2.125, "~#filesize": 2 ** 40}),
+]
+
+NUMERIC_QUERIES = [
+    u"#(playcount > 0)", u"#(playcount = 0)", u"#(playcount >= 3)",
+    u"#(0 < playcount)", u"#(playcount != 0)", u"#(playcount < 1)",
+    u"#(added < 7 days)", u"#(added > 2 days)", u"#(added < 1 hour)",
+    u"#(rating = 0.5)", u"#(rating > 0.3)", u"#(rating <= 0.25)",
+    u"#(length > 3 minutes)", u"#(length < 10.01)", u"#(skipcount = 2.12)",
+    u"#(filesize > 1gb)", u"#(playcount + 1 > 1)", u"#(2 * 2 < playcount)",
+    u"&(#(playcount < 5), #(added < 7 days))", u"#(lastplayed < 1 day)",
+    u"#(lastplayed > 1 day)", u"#(track > 0)", u"#(date > 2000)",
+]
+
+
+class TNumericIndex(TestCase):
+
+    def setUp(self):
+        config.init()
+        self.library = SongLibrary()
+        self.library.add(NUMERIC_SONGS)
+        self.library.enable_index()
+
+    def tearDown(self):
+        self.library.destroy()
+        config.quit()
+
+    def _check(self):
+        for text in NUMERIC_QUERIES:
+            query = Query(text)
+            expected = set(filter(query.search, self.library.values()))
+            self.assertEqual(
+                set(self.library.filter_query(query)), expected, msg=text)
+
+    def test_same_results(self):
+        self._check()
+
+    def test_narrows(self):
+        index = self.library.index
+        self.assertEqual(
+            Query(u"#(playcount > 0)").candidates(index),
+            set(NUMERIC_SONGS[:1] + NUMERIC_SONGS[3:4]))
+        self.assertEqual(
+            Query(u"#(added < 7 days)").candidates(index),
+            {NUMERIC_SONGS[0], NUMERIC_SONGS[2]})
+        self.assertEqual(
+            Query(u"#(3 != playcount)").candidates(index),
+            set(NUMERIC_SONGS[1:]))
+        self.assertEqual(Query(u"#(added != 1)").candidates(index), None)
+        self.assertEqual(Query(u"#(track > 0)").candidates(index), None)
+        self.assertEqual(index.columns, ["~#playcount", "~#added"])
+
+    def test_signals(self):
+        self._check()
+        song = AF(u"/n/six.ogg", **{"~#playcount": 10})
+        self.library.add([song])
+        self._check()
+        song["~#playcount"] = 0
+        self.library.changed([song])
+        self._check()
+        self.library.remove(NUMERIC_SONGS[:2])
+        self._check()
+        self.library.add(NUMERIC_SONGS[:2])
+        self._check()
+
+    def test_default_rating(self):
+        self._check()
+        config.RATINGS.default = 0.25
+        self._check()
+
+    def test_sort_func(self):
+        index = self.library.index
+        self.assertTrue(index.get_sort_func(u"~#foo") is None)
+        sort_func = index.get_sort_func(u"~#added")
+        other = AF(u"/n/other.ogg", **{"~#added": 42})
+        songs = NUMERIC_SONGS + [other]
+        self.assertEqual(
+            sorted(songs, key=sort_func),
+            sorted(songs, key=lambda s: s("~#added")))
+
+
+class TSortKeys(TestCase):
+
+    def setUp(self):
+        self.library = SongLibrary()
+        self.library.add(SONGS)
+        self.cache = self.library.sort_keys
+
+    def tearDown(self):
+        self.library.destroy()
+
+    def _check(self, tag):
+        sort_func = self.cache.get_sort_func(tag)
+        other = AF(u"/c/other.ogg", title=u"other", artist=u"b")
+        songs = SONGS + [other]
+        self.assertEqual(
+            list(map(sort_func, songs)),
+            list(map(AudioFile.sort_by_func(tag), songs)))
+
+    def test_sort_func(self):
+        for tag in [u"title", u"~dirname", u"~title~artist", u"~people"]:
+            self._check(tag)
+            self._check(tag)
+
+    def test_not_cached(self):
+        cache = self.cache
+        # AudioFile caches the artist sort key itself
+        self.assertTrue(cache.get_sort_func(u"artistsort") is None)
+        self.assertTrue(cache.get_sort_func(u"~rating") is None)
+        self.assertTrue(cache.get_sort_func(u"~#added") is None)
+        self.assertTrue(cache.get_sort_func(u"~title~#track") is None)
+        self.assertTrue(cache.get_sort_func(lambda s: s("title")) is None)
+
+    def test_changed(self):
+        self._check(u"title")
+        song = SONGS[0]
+        old = song[u"title"]
+        try:
+            song[u"title"] = u"zzz"
+            self.library.changed([song])
+            self._check(u"title")
+        finally:
+            song[u"title"] = old
+            self.library.changed([song])
+
+    def test_bounded(self):
+        tags = [u"tag%d" % i for i in range(self.cache.TAGS + 2)]
+        for tag in tags:
+            self.cache.get_sort_func(tag)
+        self.assertEqual(self.cache.tags, tags[-self.cache.TAGS:])
+
+    def test_removed(self):
+        sort_func = self.cache.get_sort_func(u"title")
+        list(map(sort_func, SONGS))
+        keys = self.cache._sort_keys[u"title"].keys
+        self.assertEqual(len(keys), len(SONGS))
+        self.library.remove(SONGS[:1])
+        self.assertEqual(len(keys), len(SONGS) - 1)
+
+    def test_index_text_tags(self):
+        self.library.enable_index()
+        self.assertTrue(self.library.index.get_sort_func(u"title") is None)
+
+
+class TFoldText(TestCase):
+
+    def test_basic(self):
+        self.assertEqual(fold_text(u"FöHn"), u"fohn")
+        self.assertEqual(fold_text(u"Σίσυφος"), fold_text(u"ΣΊΣΥΦΟΣ"))
+
+    def test_trigrams(self):
+        self.assertEqual(get_trigrams(u"ab"), set())
+        self.assertEqual(get_trigrams(u"abcd"), {u"abc", u"bcd"})
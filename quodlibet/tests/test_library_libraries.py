@@ -6,20 +6,23 @@
 from gi.repository import Gtk
 
 import os
+import time
 import shutil
 from senf import fsnative
 
 from quodlibet.formats import AudioFileError
 from quodlibet import config
 from quodlibet.util import connect_obj, is_windows
-from quodlibet.formats import AudioFile
+from quodlibet.util.path import mtime
+from quodlibet.formats import AudioFile, dump_audio_files
 from quodlibet.compat import text_type, iteritems, iterkeys, itervalues
 
-from tests import TestCase, get_data_path, mkstemp, mkdtemp, skipIf
+from tests import TestCase, get_data_path, mkstemp, mkdtemp, skipIf, skip
 from .helper import capture_output, get_temp_copy
 
 from quodlibet.library.libraries import Library, PicklingMixin, SongLibrary, \
-    FileLibrary, AlbumLibrary, SongFileLibrary, iter_paths
+    FileLibrary, AlbumLibrary, SongFileLibrary, iter_paths, \
+    get_journal_filename, _MtimeChecker
 
 
 class Fake(int):
@@ -313,6 +316,194 @@ class TPicklingMixin(TestCase):
             os.unlink(filename)
 
 
+class TPicklingJournal(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(mkdtemp(), "library")
+        self.library = SongLibrary()
+        self.library.filename = self.filename
+        self.library.add(FakeAudioFileRange(30))
+        self.library.save()
+
+    def tearDown(self):
+        self.library.destroy()
+        shutil.rmtree(os.path.dirname(self.filename))
+
+    def _reload(self):
+        library = SongLibrary()
+        library.load(self.filename)
+        self.addCleanup(library.destroy)
+        return library
+
+    def test_save_appends_journal(self):
+        song = self.library[fsnative(u"3")]
+        song["title"] = u"foo"
+        self.library.changed([song])
+        self.library.remove([self.library[fsnative(u"5")]])
+        self.library.add([FakeAudioFile(42)])
+        self.library.save()
+
+        self.assertTrue(
+            os.path.exists(get_journal_filename(self.filename)))
+        library = self._reload()
+        self.assertEqual(
+            sorted(library.keys()), sorted(self.library.keys()))
+        self.assertEqual(library[fsnative(u"3")]("title"), u"foo")
+
+    def test_outdated_journal_ignored(self):
+        song = self.library[fsnative(u"3")]
+        song["title"] = u"foo"
+        self.library.changed([song])
+        self.library.save()
+        with open(self.filename, "ab") as h:
+            h.write(b"x")
+        library = self._reload()
+        self.assertFalse(library[fsnative(u"3")]("title") == u"foo")
+
+    def test_truncated_journal(self):
+        for i in range(2):
+            song = self.library[fsnative(u"3")]
+            song["title"] = text_type(i)
+            self.library.changed([song])
+            self.library.save()
+        journal = get_journal_filename(self.filename)
+        with open(journal, "rb+") as h:
+            h.truncate(os.path.getsize(journal) - 1)
+        library = self._reload()
+        self.assertEqual(len(library), 30)
+        self.assertEqual(library[fsnative(u"3")]("title"), u"0")
+
+    def test_compact(self):
+        self.library.JOURNAL_COMPACT_RATIO = 0
+        song = self.library[fsnative(u"3")]
+        self.library.changed([song])
+        self.library.save()
+        self.assertFalse(
+            os.path.exists(get_journal_filename(self.filename)))
+        self.assertEqual(len(self._reload()), 30)
+
+
+class TLazyLoad(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(mkdtemp(), "library")
+        self.library = SongLibrary()
+        self.library.filename = self.filename
+        self.library.CHUNK_SIZE = 10
+        self.library.add(FakeAudioFileRange(30))
+        self.library.save()
+
+    def tearDown(self):
+        self.library.destroy()
+        shutil.rmtree(os.path.dirname(self.filename))
+
+    def _reload(self, lazy=True):
+        library = SongLibrary()
+        library.load(self.filename, lazy=lazy)
+        self.addCleanup(library.destroy)
+        added = []
+        library.connect("added", lambda l, items: added.extend(items))
+        return library, added
+
+    def test_on_demand(self):
+        library, added = self._reload()
+        self.assertEqual(len(library._contents), 0)
+        self.assertTrue(library.has_pending())
+        song = library[fsnative(u"3")]
+        self.assertEqual(song.key, fsnative(u"3"))
+        self.assertEqual(len(library._contents), 10)
+        self.assertTrue(fsnative(u"25") in library)
+        self.assertFalse(fsnative(u"42") in library)
+        self.assertEqual(len(library._contents), 20)
+        self.assertRaises(KeyError, library.__getitem__, fsnative(u"42"))
+        self.assertFalse(added)
+
+    def test_load_pending(self):
+        library, added = self._reload()
+        for x in library.iter_load_pending():
+            pass
+        self.assertFalse(library.has_pending())
+        self.assertEqual(
+            sorted(library.keys()), sorted(self.library.keys()))
+        self.assertFalse(added)
+        self.assertFalse(library.dirty)
+
+    def test_iter_loads_pending(self):
+        for get_all in [list, lambda l: list(l.values()),
+                        lambda l: list(l.keys()),
+                        lambda l: list(l.itervalues())]:
+            library, added = self._reload()
+            self.assertTrue(library)
+            self.assertEqual(len(get_all(library)), 30)
+            self.assertFalse(library.has_pending())
+            self.assertFalse(added)
+
+        library, added = self._reload()
+        self.assertEqual(len(library), 30)
+
+    def test_journal(self):
+        song = self.library[fsnative(u"3")]
+        song["title"] = u"foo"
+        self.library.changed([song])
+        self.library.remove([self.library[fsnative(u"5")]])
+        self.library.save()
+
+        library, added = self._reload()
+        self.assertEqual(len(library._contents), 1)
+        self.assertEqual(library[fsnative(u"3")]("title"), u"foo")
+        self.assertFalse(fsnative(u"5") in library)
+        library.load_pending()
+        self.assertEqual(len(library), 29)
+        self.assertEqual(library[fsnative(u"3")]("title"), u"foo")
+
+    def test_save_pending(self):
+        library, added = self._reload()
+        library[fsnative(u"3")]["title"] = u"foo"
+        library.changed([library[fsnative(u"3")]])
+        library.save()
+        library.save(self.filename + ".copy")
+        for lazy in [True, False]:
+            other, added = self._reload(lazy)
+            other.load_pending()
+            self.assertEqual(len(other), 30)
+            self.assertEqual(other[fsnative(u"3")]("title"), u"foo")
+
+    def test_file_changed(self):
+        library, added = self._reload()
+        with open(self.filename, "ab") as h:
+            h.write(b"x")
+        library.load_pending()
+        self.assertFalse(library.has_pending())
+        self.assertEqual(len(library), 0)
+
+    def test_old_format(self):
+        with open(self.filename, "wb") as h:
+            h.write(dump_audio_files(FakeAudioFileRange(5)))
+        library, added = self._reload()
+        self.assertFalse(library.has_pending())
+        self.assertEqual(len(library), 5)
+
+    @skip("Enable for basic benchmarking of library loading")
+    def test_benchmark(self):
+        num_songs = 100000
+        self.library.CHUNK_SIZE = PicklingMixin.CHUNK_SIZE
+        self.library.add([
+            AudioFile({"~filename": fsnative(u"/music/%d.ogg" % i),
+                       "artist": u"artist%d" % (i // 100),
+                       "album": u"album%d" % (i // 10),
+                       "title": u"title%d" % i, "~#length": 200,
+                       "~#playcount": i % 7, "~#added": 1500000000 + i})
+            for i in range(num_songs)])
+        self.library.save()
+
+        # target: a lazy load of 100k songs takes less than 0.5 seconds,
+        # compared to several seconds for a full load
+        for lazy in [False, True]:
+            t = time.time()
+            library, added = self._reload(lazy)
+            print("lazy=%s: %.3f" % (lazy, time.time() - t))
+
+
 class TSongLibrary(TLibrary):
     Fake = FakeSong
     Frange = staticmethod(FSrange)
@@ -525,6 +716,64 @@ class TSongFileLibrary(TSongLibrary):
         finally:
             os.unlink(filename)
 
+    def test_scan(self):
+        config.init()
+        dirname = mkdtemp()
+        try:
+            for i in range(5):
+                shutil.copy(get_data_path('empty.flac'),
+                            os.path.join(dirname, "%d.flac" % i))
+            with open(os.path.join(dirname, "other.txt"), "wb"):
+                pass
+            list(self.library.scan([dirname]))
+            self.assertEqual(len(self.library), 5)
+            self.assertEqual(len(self.added), 5)
+        finally:
+            shutil.rmtree(dirname)
+            config.quit()
+
+    def test_scan_threads(self):
+        config.init()
+        dirname = mkdtemp()
+        try:
+            for i in range(20):
+                shutil.copy(get_data_path('empty.flac'),
+                            os.path.join(dirname, "%d.flac" % i))
+            with capture_output():
+                open(os.path.join(dirname, "broken.flac"), "wb").close()
+                self.library.scan_threads = 3
+                list(self.library.scan([dirname]))
+            self.assertEqual(len(self.library), 20)
+            self.assertEqual(len(self.added), 20)
+            # nothing new
+            list(self.library.scan([dirname]))
+            self.assertEqual(len(self.added), 20)
+        finally:
+            shutil.rmtree(dirname)
+            config.quit()
+
+    def test_rebuild(self):
+        config.init()
+        dirname = mkdtemp()
+        try:
+            for i in range(3):
+                shutil.copy(get_data_path('empty.flac'),
+                            os.path.join(dirname, "%d.flac" % i))
+            list(self.library.scan([dirname]))
+            self.assertEqual(len(self.library), 3)
+
+            os.unlink(os.path.join(dirname, "0.flac"))
+            filename = os.path.join(dirname, "1.flac")
+            song = self.library[filename]
+            os.utime(filename, (0, song("~#mtime") + 10))
+            list(self.library.rebuild([], False))
+            self.assertEqual(len(self.library), 2)
+            self.assertTrue(song in self.changed)
+            self.assertTrue(song.valid())
+        finally:
+            shutil.rmtree(dirname)
+            config.quit()
+
     def test_add_filename_normalize_path(self):
         if not os.name == "nt":
             return
@@ -545,6 +794,78 @@ class TSongFileLibrary(TSongLibrary):
         config.quit()
 
 
+@skipIf(not hasattr(os, "scandir"), "no os.scandir")
+class TMtimeChecker(TestCase):
+
+    def setUp(self):
+        config.init()
+        self.dirname = mkdtemp()
+        self.songs = []
+        for i in range(3):
+            filename = os.path.join(self.dirname, "%d.flac" % i)
+            shutil.copy(get_data_path('empty.flac'), filename)
+            song = AudioFile({"~filename": filename})
+            song.sanitize()
+            self.songs.append(song)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+        config.quit()
+
+    def test_valid(self):
+        checker = _MtimeChecker()
+        for song in self.songs:
+            self.assertTrue(checker.valid(song))
+            self.assertEqual(checker.valid(song), song.valid())
+        self.assertEqual(checker.checked, 6)
+        self.assertEqual(checker.dirs_checked, 1)
+
+        os.utime(self.songs[0]("~filename"),
+                 (0, self.songs[0]("~#mtime") + 10))
+        os.unlink(self.songs[1]("~filename"))
+        checker = _MtimeChecker()
+        for song in self.songs:
+            self.assertEqual(checker.valid(song), song.valid())
+        self.assertFalse(checker.valid(self.songs[0]))
+        self.assertFalse(checker.valid(self.songs[1]))
+        self.assertTrue(checker.valid(self.songs[2]))
+
+    def test_no_mtime(self):
+        song = AudioFile({"~filename": self.songs[0]("~filename")})
+        self.assertFalse(_MtimeChecker().valid(song))
+
+    def test_other_items(self):
+        checker = _MtimeChecker()
+        item = FakeSongFile(1)
+        item._valid = False
+        self.assertFalse(checker.valid(item))
+        self.assertEqual(checker.checked, 1)
+        self.assertEqual(checker.dirs_checked, 0)
+
+    def test_skip_unchanged(self):
+        dir_mtimes = {}
+        checker = _MtimeChecker(dir_mtimes)
+        for song in self.songs:
+            checker.valid(song)
+        self.assertEqual(list(dir_mtimes.keys()), [self.dirname])
+
+        os.utime(self.songs[0]("~filename"),
+                 (0, self.songs[0]("~#mtime") + 10))
+        checker = _MtimeChecker(dir_mtimes)
+        for song in self.songs:
+            self.assertTrue(checker.valid(song))
+        self.assertEqual(checker.skipped, 3)
+        self.assertEqual(checker.dirs_skipped, 1)
+
+        # a new entry changes the directory mtime
+        os.unlink(self.songs[1]("~filename"))
+        os.utime(self.dirname, (0, mtime(self.dirname) + 10))
+        checker = _MtimeChecker(dir_mtimes)
+        self.assertFalse(checker.valid(self.songs[0]))
+        self.assertFalse(checker.valid(self.songs[1]))
+        self.assertEqual(checker.dirs_checked, 1)
+
+
 class TAlbumLibrary(TestCase):
     Fake = FakeSong
     Frange = staticmethod(ASrange)
@@ -633,6 +954,48 @@ class TAlbumLibrary(TestCase):
         # It shouldn't implement FileLibrary etc
         self.failIf(getattr(self.library, "filename", None))
 
+    def test_changed_album_key(self):
+        song = self.underlying.get("file_1.mp3")
+        old_album = self.library[song.album_key]
+        song["album"] = song["labelid"] = "Album 2"
+        self.underlying.changed([song])
+        self.assertFalse(song in old_album.songs)
+        new_album = self.library[song.album_key]
+        self.assertTrue(song in new_album.songs)
+        self.assertEqual(len(new_album.songs), 5)
+        self.assertEqual(len(self.library), 3)
+
+        # moving the album back and forth
+        song["album"] = song["labelid"] = "Album 1"
+        self.underlying.changed([song])
+        self.assertTrue(song in old_album.songs)
+        self.assertTrue(self.library[song.album_key] is old_album)
+
+    def test_changed_remove_album(self):
+        songs = [self.underlying.get("file_%d.mp3" % i)
+                 for i in range(1, 12, 3)]
+        for song in songs:
+            song["album"] = song["labelid"] = "New"
+        self.underlying.changed(songs)
+        self.assertEqual(len(self.library), 3)
+        self.assertEqual(len(self.library[songs[0].album_key].songs), 4)
+        # removing after a change without signal uses the old album
+        songs[0]["album"] = songs[0]["labelid"] = "Other"
+        self.underlying.remove(songs)
+        self.assertEqual(len(self.library), 2)
+
+    @skip("Enable for basic benchmarking of AlbumLibrary")
+    def test_changed_performance(self):
+        songs = [AlbumSong(i, album="Album %d" % i) for i in range(20000)]
+        self.underlying.add(songs)
+        retag = songs[:10000]
+        for i, song in enumerate(retag):
+            song["album"] = song["labelid"] = "Album %d" % (i + 10000)
+        t = time.time()
+        self.underlying.changed(retag)
+        print("Moving %d songs between %d albums took %.3f s" % (
+            len(retag), len(self.library), time.time() - t))
+
 
 class TAlbumLibrarySignals(TestCase):
     def setUp(self):
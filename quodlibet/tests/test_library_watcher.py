@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation
+
+import os
+import shutil
+
+from gi.repository import Gio
+
+from tests import TestCase, get_data_path, mkdtemp, skipIf
+
+from quodlibet import config
+from quodlibet.library import SongFileLibrary
+from quodlibet.library.watcher import PollingWatcher, MonitorWatcher
+from quodlibet.util.path import mtime
+
+
+class TPollingWatcher(TestCase):
+
+    def setUp(self):
+        config.init()
+        self.root = os.path.realpath(mkdtemp())
+        self.library = SongFileLibrary()
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.library.connect(
+            "added", lambda l, s: self.added.extend(s))
+        self.library.connect(
+            "removed", lambda l, s: self.removed.extend(s))
+        self.library.connect(
+            "changed", lambda l, s: self.changed.extend(s))
+
+        self.add_file("a.flac")
+        os.mkdir(os.path.join(self.root, "sub"))
+        self.add_file(os.path.join("sub", "b.flac"))
+        list(self.library.scan([self.root]))
+        self.assertEqual(len(self.library), 2)
+        del self.added[:]
+
+        self.library.watch([self.root], poll_interval=60)
+        self.watcher = self.library.watcher
+        self.assertTrue(isinstance(self.watcher, PollingWatcher))
+
+    def tearDown(self):
+        self.library.destroy()
+        shutil.rmtree(self.root)
+        config.quit()
+
+    def add_file(self, name):
+        path = os.path.join(self.root, name)
+        shutil.copy(get_data_path("empty.flac"), path)
+        return path
+
+    def update(self):
+        self.watcher.poll()
+        self.watcher.flush()
+
+    def test_nothing(self):
+        self.update()
+        self.assertFalse(self.added or self.removed or self.changed)
+
+    def test_add(self):
+        path = self.add_file("c.flac")
+        self.add_file(".hidden.flac")
+        with open(os.path.join(self.root, "other.txt"), "wb"):
+            pass
+        self.update()
+        self.assertEqual([s("~filename") for s in self.added], [path])
+        self.assertTrue(self.library.contains_filename(path))
+
+    def test_add_dir(self):
+        os.mkdir(os.path.join(self.root, "new"))
+        self.add_file(os.path.join("new", "1.flac"))
+        self.add_file(os.path.join("new", "2.flac"))
+        self.update()
+        self.assertEqual(len(self.added), 2)
+        self.assertEqual(len(self.library), 4)
+
+    def test_remove(self):
+        os.unlink(os.path.join(self.root, "a.flac"))
+        self.update()
+        self.assertEqual(len(self.removed), 1)
+        self.assertEqual(len(self.library), 1)
+
+    def test_remove_dir(self):
+        shutil.rmtree(os.path.join(self.root, "sub"))
+        self.update()
+        self.assertEqual(len(self.removed), 1)
+        self.assertEqual(len(self.library), 1)
+
+    def test_change(self):
+        path = os.path.join(self.root, "a.flac")
+        song = self.library[path]
+        os.utime(path, (0, mtime(path) + 10))
+        self.update()
+        self.assertEqual(self.changed, [song])
+        self.assertTrue(song.valid())
+
+    def test_move(self):
+        old = os.path.join(self.root, "sub")
+        new = os.path.join(self.root, "moved")
+        song = self.library[os.path.join(old, "b.flac")]
+        song["~#playcount"] = 42
+        os.rename(old, new)
+        self.watcher._queue_moved(old, new)
+        self.watcher.flush()
+        self.assertEqual(self.changed, [song])
+        self.assertFalse(self.added or self.removed)
+        self.assertEqual(song("~filename"), os.path.join(new, "b.flac"))
+        self.assertTrue(self.library[song("~filename")] is song)
+        self.assertEqual(song("~#playcount"), 42)
+
+    def test_move_out(self):
+        path = os.path.join(self.root, "a.flac")
+        outside = mkdtemp()
+        try:
+            shutil.move(path, os.path.join(outside, "a.flac"))
+            self.watcher._queue_moved(path, os.path.join(outside, "a.flac"))
+            self.watcher.flush()
+        finally:
+            shutil.rmtree(outside)
+        self.assertEqual(len(self.removed), 1)
+        self.assertEqual(len(self.library), 1)
+
+    def test_move_onto_other(self):
+        old = os.path.join(self.root, "a.flac")
+        new = os.path.join(self.root, "sub", "b.flac")
+        song = self.library[old]
+        other = self.library[new]
+        os.rename(old, new)
+        self.watcher._queue_moved(old, new)
+        self.watcher.flush()
+        self.assertEqual(self.removed, [other])
+        self.assertEqual(self.changed, [song])
+        self.assertTrue(self.library[new] is song)
+        self.assertEqual(len(self.library), 1)
+
+    def test_exclude(self):
+        self.library.watch(
+            [self.root], [os.path.join(self.root, "sub")], poll_interval=60)
+        self.watcher = self.library.watcher
+        self.add_file(os.path.join("sub", "c.flac"))
+        self.update()
+        self.assertFalse(self.added)
+
+    def test_exclude_prefix(self):
+        self.library.watch(
+            [self.root], [os.path.join(self.root, "su")], poll_interval=60)
+        self.watcher = self.library.watcher
+        self.add_file(os.path.join("sub", "c.flac"))
+        self.update()
+        self.assertEqual(len(self.added), 1)
+
+    def test_background(self):
+        self.add_file("c.flac")
+        self.watcher.poll()
+        self.watcher._LibraryWatcher__flush_timeout()
+        # gets applied in the main loop
+        self.assertFalse(self.added)
+        self.watcher.flush()
+        self.assertEqual(len(self.added), 1)
+
+    def test_destroy(self):
+        watcher = self.watcher
+        self.library.destroy()
+        self.assertTrue(self.library.watcher is None)
+        self.add_file("c.flac")
+        watcher.flush()
+        self.assertFalse(self.added)
+
+
+Event = Gio.FileMonitorEvent
+
+
+@skipIf(not hasattr(Event, "MOVED_OUT"), "needs GLib 2.46")
+class TMonitorWatcher(TestCase):
+
+    def setUp(self):
+        config.init()
+        self.root = os.path.realpath(mkdtemp())
+        self.library = SongFileLibrary()
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.library.connect(
+            "added", lambda l, s: self.added.extend(s))
+        self.library.connect(
+            "removed", lambda l, s: self.removed.extend(s))
+        self.library.connect(
+            "changed", lambda l, s: self.changed.extend(s))
+
+        for name in ["one", "two"]:
+            os.mkdir(os.path.join(self.root, name))
+        shutil.copy(get_data_path("empty.flac"),
+                    os.path.join(self.root, "one", "a.flac"))
+        list(self.library.scan([self.root]))
+        del self.added[:]
+
+        self.library.watch([self.root])
+        self.watcher = self.library.watcher
+        self.assertTrue(isinstance(self.watcher, MonitorWatcher))
+
+    def tearDown(self):
+        self.library.destroy()
+        shutil.rmtree(self.root)
+        config.quit()
+
+    def send(self, event, path, other=None):
+        other = other and Gio.File.new_for_path(other)
+        self.watcher._MonitorWatcher__changed(
+            None, Gio.File.new_for_path(path), other, event)
+
+    def test_move_between_dirs(self):
+        old = os.path.join(self.root, "one", "a.flac")
+        new = os.path.join(self.root, "two", "a.flac")
+        song = self.library[old]
+        song["~#playcount"] = 42
+        os.rename(old, new)
+        self.send(Event.MOVED_IN, new, old)
+        self.send(Event.MOVED_OUT, old, new)
+        self.watcher.flush()
+        self.assertFalse(self.added or self.removed)
+        self.assertEqual(self.changed, [song])
+        self.assertTrue(self.library[new] is song)
+        self.assertEqual(song("~#playcount"), 42)
+
+    def test_move_out(self):
+        old = os.path.join(self.root, "one", "a.flac")
+        outside = mkdtemp()
+        try:
+            new = os.path.join(outside, "a.flac")
+            shutil.move(old, new)
+            self.send(Event.MOVED_OUT, old, new)
+            self.watcher.flush()
+        finally:
+            shutil.rmtree(outside)
+        self.assertEqual(len(self.removed), 1)
+        self.assertEqual(len(self.library), 0)
+
+    def test_move_in(self):
+        outside = mkdtemp()
+        try:
+            old = os.path.join(outside, "b.flac")
+            new = os.path.join(self.root, "two", "b.flac")
+            shutil.copy(get_data_path("empty.flac"), old)
+            shutil.move(old, new)
+            self.send(Event.MOVED_IN, new, old)
+            self.watcher.flush()
+        finally:
+            shutil.rmtree(outside)
+        self.assertEqual([s("~filename") for s in self.added], [new])
@@ -3,11 +3,12 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation
 
+import random
 from collections import defaultdict
 
 from quodlibet.formats import AudioFile
 from quodlibet.order import OrderInOrder
-from quodlibet.order.reorder import OrderWeighted, OrderShuffle
+from quodlibet.order.reorder import OrderWeighted, OrderShuffle, _WeightTree
 from quodlibet.order.repeat import OneSong
 from quodlibet.qltk.songmodel import PlaylistModel
 from tests import TestCase
@@ -35,6 +36,28 @@ class TOrderWeighted(TestCase):
         self.failUnless(scores[r2] > scores[r1])
         self.failUnless(scores[r3] > scores[r2])
 
+    def test_remaining(self):
+        pl = PlaylistModel()
+        pl.set([r3, r0, r1, r0, r2])
+        order = OrderWeighted()
+        cur = pl.current_iter
+        seen = []
+        for i in range(5):
+            cur = order.next_explicit(pl, cur)
+            seen.append(pl.get_path(cur).get_indices()[0])
+        self.failUnlessEqual(sorted(seen), list(range(5)))
+        self.failUnless(order.next_explicit(pl, cur) is None)
+
+    def test_playlist_changed(self):
+        pl = PlaylistModel(OrderWeighted)
+        pl.set([r1, r2])
+        pl.next()
+        pl.append(row=[r3])
+        pl.next()
+        pl.next()
+        pl.next()
+        self.failUnless(pl.current is None)
+
 
 class TOrderShuffle(TestCase):
 
@@ -56,3 +79,37 @@ class TOrderOneSong(TestCase):
         pl.set([r0, r1])
         for i in range(2):
             self.failUnlessEqual(order.next(pl, pl.current_iter), None)
+
+
+class TWeightTree(TestCase):
+
+    def test_find(self):
+        weights = [0.5, 0.0, 1.0, 0.25]
+        tree = _WeightTree(weights)
+        self.assertEqual(tree.total, 1.75)
+        self.assertEqual(tree.find(0.0), 0)
+        self.assertEqual(tree.find(0.5), 2)
+        self.assertEqual(tree.find(1.6), 3)
+        tree.set(2, 0.0)
+        self.assertEqual(tree.total, 0.75)
+        self.assertEqual(tree.find(0.5), 3)
+        self.assertEqual(_WeightTree([0.0]).find(0.0), None)
+        self.assertEqual(_WeightTree([]).find(0.0), None)
+
+    def test_random(self):
+        weights = [random.choice([0.0, 0.25, 1.0]) for i in range(50)]
+        tree = _WeightTree(weights)
+        for i in range(200):
+            index = random.randrange(len(weights))
+            weights[index] = random.choice([0.0, 0.5, 1.0])
+            tree.set(index, weights[index])
+            self.assertAlmostEqual(tree.total, sum(weights))
+            value = random.random() * tree.total
+            current = 0.0
+            for expected, weight in enumerate(weights):
+                current += weight
+                if current > value and weight:
+                    break
+            else:
+                expected = None
+            self.assertEqual(tree.find(value), expected)
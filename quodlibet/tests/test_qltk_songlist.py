@@ -3,10 +3,12 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation
 
+import time
+
 from gi.repository import Gtk
 from senf import fsnative
 
-from tests import TestCase
+from tests import TestCase, skip
 
 from quodlibet.library import SongLibrary
 from quodlibet.qltk.songlist import SongList, set_columns, get_columns, \
@@ -169,6 +171,52 @@ class TSongList(TestCase):
 
         self.assertEqual(self.songlist.get_songs(), [song] * 4)
 
+    def test_add_songs_sorted(self):
+        def AF(i):
+            return AudioFile({
+                "~filename": fsnative(u"/dev/%d" % i),
+                "artist": u"a%d" % (i % 3), "title": u"t%d" % (i % 5)})
+
+        songs = [AF(i) for i in range(30)]
+        s = self.songlist
+        s.set_column_headers(["artist", "title"])
+        s.set_sort_orders([("artist", True), ("title", False)])
+        s.add_songs(songs[:10])
+        s.add_songs(songs[10:12])
+        s.add_songs(songs[12:])
+
+        expected = list(songs)
+        s._sort_songs(expected)
+        self.assertEqual(s.get_songs(), expected)
+
+    def test_sort_songs_mixed_orders(self):
+        songs = [AudioFile({"~filename": fsnative(u"/dev/%d" % i),
+                            "artist": u"a%d" % (i % 3),
+                            "title": u"t%d" % (i % 4)})
+                 for i in range(24)]
+        s = self.songlist
+        s.set_column_headers(["artist", "title"])
+        s.set_sort_orders([("artist", True), ("title", False)])
+
+        expected = sorted(songs, key=lambda s: s.sort_key, reverse=True)
+        expected.sort(key=lambda s: s("artist"), reverse=True)
+        expected.sort(key=lambda s: s("title"))
+        s._sort_songs(songs)
+        self.assertEqual(songs, expected)
+
+    @skip("Enable for basic benchmarking of SongList")
+    def test_add_songs_performance(self):
+        songs = [AudioFile({"~filename": fsnative(u"/dev/%d" % i),
+                            "title": u"%d" % (i * 7 % 1000)})
+                 for i in range(20500)]
+        s = self.songlist
+        s.set_column_headers(["title"])
+        s.set_sort_orders([("title", False)])
+        s.set_songs(songs[:20000])
+        t = time.time()
+        s.add_songs(songs[20000:])
+        print("Adding 500 songs took %.3f s" % (time.time() - t))
+
     def test_header_menu(self):
         from quodlibet import browsers
         from quodlibet.library import SongLibrary, SongLibrarian
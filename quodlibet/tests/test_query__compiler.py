@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation
+
+import time
+
+from senf import fsnative
+
+from tests import TestCase
+
+from quodlibet import config
+from quodlibet.formats import AudioFile
+from quodlibet.query import Query
+from quodlibet.query._compiler import QueryCompiler, _get_cost
+from quodlibet.util.collection import Album
+
+
+def AF(**kwargs):
+    song = AudioFile(kwargs)
+    song["~filename"] = fsnative(u"/dir/%s.ogg" % kwargs.get("title", u"x"))
+    return song
+
+
+SONGS = [
+    AF(title=u"foo", artist=u"bar", album=u"baz",
+       **{"~#playcount": 5, "~#added": time.time()}),
+    AF(title=u"quux", artist=u"foo\nbar", genre=u"rock",
+       **{"~#playcount": 0, "~#added": time.time() - 3600 * 24 * 30}),
+    AF(title=u"", artist=u"Ünïcödé", date=u"2004-10-31"),
+    AF(**{"~foo": u"tilde"}),
+]
+
+QUERIES = [
+    u"", u"foo", u"foo bar", u"!foo", u"artist=bar", u"foo=tilde",
+    u"artist=|(foo, baz)", u"artist=&(foo, bar)", u"artist=!foo",
+    u"|(title=foo, genre=rock)", u"&(title=/^qu/, !genre=pop)",
+    u"#(playcount > 1)", u"#(playcount < 1)", u"#(added < 1 day)",
+    u"&(#(playcount = 0), artist=foo)", u"#(date > 2003)",
+    u"~filename=dir", u"~dirname=/^\\/dir$/", u"~people=unicode",
+    u"filename=quux", u"title=/^$/", u"&(|(foo, quux), !&(bar, baz))",
+    u"&()", u"|()", u"artist=&()", u"artist=|()",
+]
+
+
+class TQueryCompiler(TestCase):
+
+    def setUp(self):
+        config.init()
+
+    def tearDown(self):
+        config.quit()
+
+    def test_same_as_match_tree(self):
+        for text in QUERIES:
+            if not Query.is_parsable(text):
+                continue
+            query = Query(text)
+            match = query._match
+            search, filter_ = QueryCompiler(match).compile()
+            for song in SONGS:
+                self.assertEqual(
+                    bool(search(song)), bool(match.search(song)),
+                    msg="%r %r" % (text, song))
+            self.assertEqual(filter_(SONGS), match.filter(SONGS), msg=text)
+
+    def test_not_audiofile(self):
+        album = Album(SONGS[0])
+        album.songs = set(SONGS[:2])
+        for text in [u"artist=foo", u"~filename=dir", u"~people=bar"]:
+            match = Query(text)._match
+            search, filter_ = QueryCompiler(match).compile()
+            self.assertEqual(
+                bool(search(album)), bool(match.search(album)), msg=text)
+
+    def test_query_uses_compiled(self):
+        query = Query(u"foo")
+        self.assertEqual(query.filter(SONGS), SONGS[:2])
+        self.assertTrue(query.search(SONGS[0]))
+        self.assertFalse(query.search(SONGS[2]))
+
+    def test_cost_order(self):
+        cheap = Query(u"title=foo")._match
+        expensive = Query(u"~people=foo")._match
+        self.assertTrue(_get_cost(cheap) < _get_cost(expensive))
@@ -257,6 +257,43 @@ class TAlbum(TestCase):
         s.failUnlessEqual(album.comma("c"), "cc3, cc1")
         s.failUnlessEqual(album.comma("~c~b"), "cc3, cc1 - bb1, bb4")
 
+    def test_incremental_updates(s):
+        keys = ["~#length", "~#rating", "~#rating:avg", "~#added:min",
+                "~#lastplayed:max", "~#bitrate", "~#tracks", "~people",
+                "~peoplesort", "artist", "~length", "~rating", "genre"]
+        songs = [
+            Fakesong({"artist": "a\nb", "genre": "g1", "~#length": 4,
+                      "~#added": 5, "~#rating": 0.1, "~#bitrate": 100}),
+            Fakesong({"artist": "b", "performer": "c", "genre": "g1\ng2",
+                      "~#length": 1.5, "~#added": 3, "~#lastplayed": 9}),
+            Fakesong({"albumartist": "d", "albumartistsort": "dd",
+                      "artist": "b", "~#length": 7, "~#rating": 0.75}),
+        ]
+
+        def check(album):
+            fresh = Album(songs[0])
+            fresh.songs = set(album.songs)
+            for key in keys:
+                s.assertEqual(album(key, None), fresh(key, None), msg=key)
+
+        album = Album(songs[0])
+        album.add_songs(songs[:2])
+        check(album)
+        album.add_songs(songs)
+        check(album)
+        album.remove_songs(songs[:1])
+        check(album)
+        songs[1]["artist"] = "b\ne"
+        songs[1]["~#length"] = 12
+        del songs[1]["genre"]
+        album.songs_changed(songs)
+        check(album)
+        album.remove_songs(songs)
+        s.assertFalse(album.songs)
+        s.assertEqual(album("~#length", None), None)
+        album.add_songs(songs[:1])
+        check(album)
+
     def tearDown(self):
         config.quit()
 
@@ -11,11 +11,12 @@ import shutil
 from senf import fsnative, bytes2fsn
 
 from quodlibet.formats import AudioFile
-from quodlibet.util.cover.manager import CoverManager
+from quodlibet.util.cover.manager import CoverManager, _get_thumbnail
 from quodlibet.util.path import normalize_path, path_equal
 from quodlibet.compat import text_type
 
 from tests import TestCase, mkdtemp
+from .helper import capture_output
 
 
 bar_2_1 = AudioFile({
@@ -154,7 +155,33 @@ class TCoverManager(TestCase):
             assert path_equal(
                 actual, f, "\"%s\" should trump \"%s\"" % (f, actual))
 
+    def test_cached_missing(self):
+        self.failIf(self._find_cover(self.song))
+        # embedded and filesystem lookups are remembered
+        self.assertEqual(len(self.manager._covers), 2)
+        self.assertEqual(
+            {path for stamp, path in self.manager._covers.values()}, {None})
+
+        # new files change the directory mtime
+        f = self.add_file("cover.jpg")
+        cover = self._find_cover(self.song)
+        assert path_equal(os.path.abspath(cover.name), f)
+        cover.close()
+
+        self.manager.cover_changed([self.song])
+        self.failIf(self.manager._covers)
+
     def test_get_thumbnail(self):
         self.assertTrue(self.manager.get_pixbuf(self.song, 10, 10) is None)
         self.assertTrue(
             self.manager.get_pixbuf_many([self.song], 10, 10) is None)
+
+    def test_get_thumbnail_error(self):
+
+        class BrokenFile(object):
+            @property
+            def name(self):
+                raise ValueError
+
+        with capture_output():
+            self.assertTrue(_get_thumbnail(BrokenFile(), (10, 10)) is None)
@@ -6,13 +6,14 @@
 import os
 import unittest
 
-from senf import uri2fsn, fsn2uri, fsnative, environ
+from senf import uri2fsn, fsn2uri, fsnative, environ, gettempdir
 
 from quodlibet.util.path import iscommand, limit_path, \
-    get_home_dir, uri_is_valid, ishidden
+    get_home_dir, uri_is_valid, ishidden, get_file_cache_key, \
+    get_cache_folder, is_temp_path
 from quodlibet.util import print_d
 
-from . import TestCase
+from . import TestCase, mkstemp
 
 
 is_win = os.name == "nt"
@@ -97,6 +98,40 @@ class Tget_x_dir(TestCase):
         self.assertTrue(os.path.isabs(get_home_dir()))
 
 
+class Tget_file_cache_key(TestCase):
+
+    def test_main(self):
+        fd, filename = mkstemp()
+        os.close(fd)
+        try:
+            key = get_file_cache_key(filename)
+            self.assertTrue(key)
+            self.assertEqual(key, get_file_cache_key(filename))
+
+            with open(filename, "wb") as h:
+                h.write(b"foo")
+            self.assertNotEqual(get_file_cache_key(filename), key)
+        finally:
+            os.remove(filename)
+
+        self.assertTrue(get_file_cache_key(filename) is None)
+
+    def test_cache_folder(self):
+        folder = get_cache_folder(fsnative(u"foo"))
+        self.assertTrue(os.path.isabs(folder))
+        self.assertEqual(os.path.basename(folder), fsnative(u"foo"))
+
+
+class Tis_temp_path(TestCase):
+
+    def test_main(self):
+        temp = gettempdir()
+        self.assertTrue(is_temp_path(os.path.join(temp, fsnative(u"foo"))))
+        self.assertFalse(is_temp_path(temp + fsnative(u"foo")))
+        self.assertFalse(is_temp_path(temp))
+        self.assertFalse(is_temp_path(os.path.dirname(temp)))
+
+
 class Tlimit_path(TestCase):
 
     def test_main(self):
@@ -8,11 +8,12 @@
 import threading
 
 from tests import TestCase
+from .helper import capture_output
 
 from gi.repository import Gtk
 
 from quodlibet.util.thread import call_async, call_async_background, \
-    Cancellable, terminate_all
+    Cancellable, terminate_all, get_stats, Priority
 
 
 class Tcall_async(TestCase):
@@ -59,5 +60,37 @@ class Tcall_async(TestCase):
         while Gtk.events_pending():
             Gtk.main_iteration()
 
+    def test_error(self):
+        data = []
+
+        def func(result):
+            if result is None:
+                raise Exception
+            return result
+
+        cancel = Cancellable()
+        with capture_output():
+            call_async(func, cancel, data.append, args=(None,))
+            call_async(func, cancel, data.append, args=(2,))
+            while not data:
+                Gtk.main_iteration()
+            while Gtk.events_pending():
+                Gtk.main_iteration()
+        # no callback for the failed one
+        self.assertEqual(data, [2])
+
+    def test_stats(self):
+        cancel = Cancellable()
+        data = []
+        call_async_background(lambda: 1, cancel, data.append)
+        while not data:
+            Gtk.main_iteration()
+
+        stats = get_stats()
+        self.assertEqual(stats["queued"][Priority.BACKGROUND], 0)
+        self.assertEqual(stats["running"][Priority.BACKGROUND], 0)
+        self.assertTrue(sum(stats["wait"][Priority.BACKGROUND]) >= 1)
+        self.assertTrue(sum(stats["delivery"][Priority.BACKGROUND]) >= 1)
+
     def test_terminate_all(self):
         terminate_all()
@@ -114,3 +114,51 @@ class TThumb(TestCase):
         #check rights
         if os.name != "nt":
             s.failUnlessEqual(os.stat(path).st_mode, 33152)
+
+
+class TThumbnailCache(TestCase):
+
+    def setUp(self):
+        self.cache = thumbnails.ThumbnailCache()
+        self.pixbuf = GdkPixbuf.Pixbuf.new(
+            GdkPixbuf.Colorspace.RGB, True, 8, 10, 10)
+        self.pixbuf_size = self.pixbuf.get_rowstride() * 10
+
+    def test_get_key(self):
+        filename = get_data_path("test.png")
+        with open(filename, "rb") as h:
+            key = self.cache.get_key(h, (50, 60))
+            self.assertEqual(key, (filename, mtime(filename), (50, 60)))
+
+        fn = NamedTemporaryFile()
+        self.assertTrue(self.cache.get_key(fn, (50, 60)) is None)
+        fn.close()
+
+    def test_get_put(self):
+        cache = self.cache
+        self.assertTrue(cache.get("a") is None)
+        cache.put("a", self.pixbuf)
+        self.assertTrue(cache.get("a") is self.pixbuf)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.size, self.pixbuf_size)
+        cache.put("a", self.pixbuf)
+        self.assertEqual(cache.size, self.pixbuf_size)
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_bounded(self):
+        cache = self.cache
+        cache.max_bytes = self.pixbuf_size * 2
+        cache.put("a", self.pixbuf)
+        cache.put("b", self.pixbuf)
+        cache.get("a")
+        cache.put("c", self.pixbuf)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get("b") is None)
+        self.assertTrue(cache.get("a") is self.pixbuf)
+
+        large = GdkPixbuf.Pixbuf.new(
+            GdkPixbuf.Colorspace.RGB, True, 8, 100, 100)
+        cache.put("d", large)
+        self.assertTrue(cache.get("d") is None)
+        self.assertEqual(len(cache), 2)